@@ -1,5 +1,6 @@
 import math
 from copy import deepcopy
+from dataclasses import fields
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Iterator, Tuple
@@ -13,7 +14,7 @@ from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessageProm
 from langchain_core.runnables import RunnableParallel
 from tqdm import tqdm
 
-from .em_tree import HigherLevelSummary, RawDataInstant, SceneGraphInstant, ObjectNode, GoalBasedSummary
+from .em_tree import HigherLevelSummary, RawDataInstant, SceneGraphInstant, ObjectNode, GoalBasedSummary, interning
 from .llm_summary import LLMBasedSummarizer
 from .rule_based_summary import select_keyframe_indices, build_event_summaries_with_indices, \
     build_goals_from_hierarchical_goal_items
@@ -157,6 +158,12 @@ def _is_end_state(state: str):
     return state in ['Succeeded', 'Aborted', 'Failed']
 
 
+def _raw_fields(raw: RawDataInstant) -> dict:
+    # RawDataInstant has __slots__, so there is no __dict__ to copy
+    return {f.name: getattr(raw, f.name) for f in fields(raw)}
+
+
+@interning()
 def load_episode_from_armarx_lt_mem(
         mem_export_dir: Path,
         action_param_summarizer_llm: BaseChatModel = None,
@@ -247,7 +254,7 @@ def load_episode_from_armarx_lt_mem(
             prev_scene_idx = 0
         else:
             prev_scene = scenes[prev_scene_idx]
-            copy = dict(prev_scene.raw.__dict__) if prev_scene else {}
+            copy = _raw_fields(prev_scene.raw) if prev_scene else {}
             if prev_scene.raw.current_action_state and _is_end_state(prev_scene.raw.current_action_state):
                 copy.update(current_action=None, current_action_state=None, current_action_parameters={})
             if prev_scene.raw.current_goal_state and _is_end_state(prev_scene.raw.current_goal_state):
@@ -282,7 +289,7 @@ def load_episode_from_armarx_lt_mem(
             if ts - prev_scene.raw.timestamp > max_delta_to_copy_action_goal_to_asr:
                 copy = dict()
             else:
-                copy = dict(prev_scene.raw.__dict__)
+                copy = _raw_fields(prev_scene.raw)
             copy['timestamp'] = ts
             copy['asr_recognition'] = text
             scenes.append(SceneGraphInstant(
@@ -353,6 +360,7 @@ def load_episode_from_armarx_lt_mem(
     )
 
 
+@interning()
 def extend_existing_history_from_memory_snapshots(
         existing_history: HigherLevelSummary,
         mem_export_dir: Path,
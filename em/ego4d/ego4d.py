@@ -11,7 +11,7 @@ from langchain_core.prompts import SystemMessagePromptTemplate as SystemMsg, Hum
     AIMessagePromptTemplate as AIMsg
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough, RunnableLambda
 
-from ..em_tree import HigherLevelSummary, EventBasedSummary, SceneGraphInstant, RawDataInstant
+from ..em_tree import HigherLevelSummary, EventBasedSummary, SceneGraphInstant, RawDataInstant, unpickle_history
 from ..em_util import move_history_to_start_date, LazyVideoFramePILImage
 from ..rule_based_summary import select_goal_indices, build_goal_summaries_with_indices
 
@@ -148,9 +148,9 @@ def load_history_from_video_recap_pickle(pickle_history_file: Path,
                                          start_time: datetime = None):
     first_person_history_file = pickle_history_file.with_suffix('.first_person.pkl')
     if convert_to_first_person_llm is not None and first_person_history_file.is_file():
-        history: HigherLevelSummary = pickle.loads(first_person_history_file.read_bytes())
+        history: HigherLevelSummary = unpickle_history(first_person_history_file.read_bytes())
     else:
-        history: HigherLevelSummary = pickle.loads(pickle_history_file.read_bytes())
+        history: HigherLevelSummary = unpickle_history(pickle_history_file.read_bytes())
 
     if convert_to_first_person_llm is not None and not first_person_history_file.is_file():
         captions = [{
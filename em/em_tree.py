@@ -1,17 +1,281 @@
+import pickle
+import sys
+import threading
 from collections import defaultdict
-from dataclasses import dataclass
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
 from datetime import datetime
 from itertools import chain
-from typing import List, Tuple, Optional, Union
+from types import MemberDescriptorType
+from typing import Callable, List, Tuple, Optional, Union
 
 import numpy as np
 from PIL.Image import Image
 
 from lmp.repl.semantic_hint_error import SemanticHintError
 
+# Incremented by every mutation of a tree node. Memoized properties are only valid for the epoch they were computed
+# in, which also invalidates all ancestors of a mutated node without needing parent pointers.
+# Histories are only mutated while they are built or extended, so a global counter costs next to nothing.
+# Constructing a node is not a mutation, so building views or loading another tree keeps the caches of this one.
+_mutation_epoch = 0
+
+
+# Called with the mutated node or child list, see TreeMutationWatcher
+_mutation_listeners: List[Callable[[object], None]] = []
+
+
+def _bump_mutation_epoch(target):
+    global _mutation_epoch
+    _mutation_epoch += 1
+    for listener in _mutation_listeners:
+        listener(target)
+
+
+def mutation_epoch() -> int:
+    # Changes whenever any tree node is mutated, e.g. to invalidate caches outside of the tree
+    return _mutation_epoch
+
+
+class ObservedList(list):
+    """Child list of a tree node. Mutating it invalidates all memoized properties. Pickles as a plain list."""
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def _observed(method):
+    def wrapper(self, *args, **kwargs):
+        _bump_mutation_epoch(self)
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+_MUTATING_LIST_METHODS = ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop',
+                          'remove', 'clear', 'sort', 'reverse')
+for _name in _MUTATING_LIST_METHODS:
+    setattr(ObservedList, _name, _observed(getattr(list, _name)))
+
+
+class FrozenList(list):
+    """
+    Immutable list, shared by all scenes with the same objects or relations (see _intern_list).
+    Assign a new list to change the objects of a scene. Pickles as a plain list.
+    """
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def _frozen(method):
+    def wrapper(self, *args, **kwargs):
+        raise TypeError('Scene graph lists are shared between scenes and cannot be modified. Assign a new list.')
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+for _name in _MUTATING_LIST_METHODS:
+    setattr(FrozenList, _name, _frozen(getattr(list, _name)))
+
+
+class memoized_property:
+    """
+    Like @property, but the value is cached on the instance until the next mutation of any tree node.
+    The cached value is shared, so callers must not modify returned lists.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.__doc__ = fn.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            epoch, values = instance._memo
+        except AttributeError:
+            epoch, values = None, None
+        if epoch != _mutation_epoch:
+            values = {}
+            object.__setattr__(instance, '_memo', (_mutation_epoch, values))
+        if self.name not in values:
+            values[self.name] = self.fn(instance)
+        return values[self.name]
+
+
+class InternTable:
+    """
+    Vocabulary of the values shared between L0/L1 nodes: relation tuples, action parameter dicts, object nodes and
+    the object and relation lists of scene graphs.
+    Months of ArmarX data repeat a few hundred distinct values thousands of times. Interned values are shared between
+    nodes and must not be modified in place.
+    A table is only used inside interning(), typically while one history is loaded or built. It keeps all its values
+    alive, so it is dropped afterwards instead of growing with every history of the process.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.values = {}
+        # Recently unpickled plain lists by id, with the list itself to keep the id valid. A list shared between
+        # scenes is unpickled as one plain list object, which then doesn't need to be interned item by item for every
+        # scene. Only used while unpickling, other lists could be modified and passed again.
+        self.unpickled_lists = {}
+
+
+_intern_state = threading.local()  # .table: the InternTable of the current thread, if inside interning()
+
+
+@contextmanager
+def interning(table: InternTable = None):
+    # Shares equal values between the nodes created or unpickled inside. Nested uses keep the outer table.
+    # Also usable as a decorator of functions that build a history
+    previous = getattr(_intern_state, 'table', None)
+    if previous is not None and table is None:
+        yield previous
+        return
+    _intern_state.table = table if table is not None else InternTable()
+    try:
+        yield _intern_state.table
+    finally:
+        _intern_state.table.unpickled_lists.clear()  # Ids of the lists are only valid during one pass
+        _intern_state.table = previous
+
+
+def unpickle_history(data: bytes):
+    with interning():
+        return pickle.loads(data)
+
+
+def _intern_with_key(value, table: InternTable = None):
+    # Returns the interned value and a hashable key of its contents (None if it can't be interned), bottom-up
+    t = type(value)
+    if t is str:
+        value = sys.intern(value)
+        return value, value
+    if value is None or t in (int, float, bool):
+        return value, (t.__name__, value)  # 1, 1.0 and True are equal but must not be merged
+    if t is np.ndarray:
+        return value, ('ndarray', value.dtype.str, value.shape, value.tobytes())
+    if table is None:
+        table = getattr(_intern_state, 'table', None)
+    if t is tuple or t is list:
+        items = [_intern_with_key(v, table) for v in value]
+        value = t(v for v, _ in items)
+        keys = tuple(k for _, k in items)
+        complete = all(k is not None for k in keys)
+    elif t is dict:
+        items = [(sys.intern(k) if type(k) is str else k, _intern_with_key(v, table)) for k, v in value.items()]
+        value = {k: v for k, (v, _) in items}
+        keys = tuple((k, vk) for k, (_, vk) in items)
+        complete = all(vk is not None for _, vk in keys)
+    else:
+        return value, None
+    if not complete:
+        return value, None
+    key = (t.__name__, keys)
+    if t is list or table is None:
+        return value, key  # Lists are only shared as part of an interned dict
+    return table.values.setdefault(key, value), key
+
+
+def _intern(value):
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is tuple or type(value) is dict:
+        return _intern_with_key(value)[0]
+    if type(value) is ObjectNode:
+        table = getattr(_intern_state, 'table', None)
+        return table.values.setdefault(('ObjectNode', value), value) if table is not None else value
+    return value
+
+
+def _intern_list(values, unpickled=False) -> FrozenList:
+    if type(values) is FrozenList:
+        return values
+    table = getattr(_intern_state, 'table', None)
+    if table is None:
+        return FrozenList(_intern(v) for v in values)
+    if unpickled:
+        recent = table.unpickled_lists.get(id(values))
+        if recent is not None:
+            return recent[1]
+    # Hash-consing: the items are interned, so the list is identified by the ids of its items.
+    # The table keeps the items alive, so their ids are never reused.
+    items = [_intern(v) for v in values]
+    key = ('FrozenList', tuple(id(v) for v in items))
+    if key not in table.values:
+        table.values[key] = FrozenList(items)
+    if unpickled:
+        if len(table.unpickled_lists) >= 256:
+            table.unpickled_lists.clear()
+        table.unpickled_lists[id(values)] = (values, table.values[key])
+    return table.values[key]
+
+
+_last_field_names = {}  # Node class -> name of its last dataclass field
+
+
+class _ObservedNode:
+    __slots__ = ('_memo',)  # (mutation epoch, {name: value}) of the memoized properties
+
+    # Fields that hold lists of child nodes. They are stored as ObservedList
+    _observed_list_fields = ()
+    # Fields that hold lists shared between nodes, see _intern_list
+    _frozen_list_fields = ()
+    # Whether to intern strings, tuples, dicts and object nodes, see InternTable
+    _intern_values = False
+
+    def _convert(self, name, value, unpickled=False):
+        if name in self._observed_list_fields and type(value) is list:
+            value = ObservedList(value)
+        elif name in self._frozen_list_fields and isinstance(value, list):
+            value = _intern_list(value, unpickled)
+        elif self._intern_values:
+            value = _intern(value)
+        return value
+
+    def _is_initialized(self):
+        # The dataclass __init__ assigns the fields in order, so the node is complete once the last one has a value
+        last_field = _last_field_names.get(type(self))
+        if last_field is None:
+            last_field = _last_field_names[type(self)] = fields(self)[-1].name
+        descriptor = getattr(type(self), last_field, None)
+        if isinstance(descriptor, MemberDescriptorType):
+            try:
+                descriptor.__get__(self)
+                return True
+            except AttributeError:
+                return False
+        return last_field in getattr(self, '__dict__', ())
+
+    def __setattr__(self, name, value):
+        if self._is_initialized():
+            _bump_mutation_epoch(self)
+        super().__setattr__(name, self._convert(name, value))
+
+    def __getstate__(self):
+        # Don't persist memoized values
+        state = dict(getattr(self, '__dict__', {}))
+        state.update((f.name, getattr(self, f.name)) for f in fields(self))
+        return state
+
+    def __setstate__(self, state):
+        # Also migrates pickles from before __slots__ and interning, which contain the plain instance __dict__
+        for name, value in state.items():
+            try:
+                object.__setattr__(self, name, self._convert(name, value, unpickled=True))
+            except AttributeError:
+                pass  # Attribute of an older version that has no slot anymore
+
+
+@dataclass(slots=True)
+class RawDataInstant(_ObservedNode):  # L0
+    _intern_values = True
 
-@dataclass
-class RawDataInstant:  # L0
     timestamp: datetime
 
     # Perception
@@ -31,32 +295,51 @@ class RawDataInstant:  # L0
 _original_repr = RawDataInstant.__repr__
 
 
+def _strip_img_details(r: str) -> str:
+    img_start = r.find('image=')
+    img_end = r.find(', sound=')
+    return r[:img_start + len('image=')] + '<PIL.Image.Image ...>' + r[img_end:]
+
+
 def _repr_without_img_details(self: RawDataInstant):
     r = _original_repr(self)
     if self.image is None:
         return r
-    img_start = r.find('image=')
-    img_end = r.find(', sound=')
-    return r[:img_start + len('image=')] + '<PIL.Image.Image ...>' + r[img_end:]
+    return _strip_img_details(r)
 
 
 RawDataInstant.__repr__ = _repr_without_img_details
 
 
-@dataclass(frozen=True)  # To make this hashable
+@dataclass(frozen=True, slots=True)  # To make this hashable
 class ObjectNode:
     obj_class: str
     instance_id: str
     state: Optional[str] = None
 
+    def __post_init__(self):
+        for f in fields(self):
+            object.__setattr__(self, f.name, _intern(getattr(self, f.name)))
+
+    def __getstate__(self):
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def __setstate__(self, state):
+        # Also loads pickles from before __slots__, which contain the plain instance __dict__
+        for name, value in state.items():
+            object.__setattr__(self, name, _intern(value))
+
+
+@dataclass(slots=True)
+class SceneGraphInstant(_ObservedNode):  # L1
+    _frozen_list_fields = ('objects', 'relations')
+    _intern_values = True
 
-@dataclass
-class SceneGraphInstant:  # L1
     objects: List[ObjectNode]
     relations: List[Tuple[int, int, str]]  # (from idx, to idx, type)
     raw: RawDataInstant
 
-    @property
+    @memoized_property
     def nl_graph_summary(self):
         objects = [f'{o.obj_class} [{o.state}]' if o.state else o.obj_class for o in self.objects]
         # Collect same relations to the same target to compatify representation
@@ -79,6 +362,10 @@ class SceneGraphInstant:  # L1
             return ''
 
     @property
+    def own_index_content(self) -> List[str]:
+        return self.index_content
+
+    @memoized_property
     def index_content(self) -> List[str]:
         return [
             o.obj_class for o in self.objects
@@ -93,7 +380,9 @@ class SceneGraphInstant:  # L1
 
 
 @dataclass
-class EventBasedSummary:  # L2
+class EventBasedSummary(_ObservedNode):  # L2
+    _observed_list_fields = ('scenes',)
+
     scenes: List[SceneGraphInstant]  # from oldest to newest. the last element is the moment of the event
     audio_description: Optional[str] = None
     action_parameter_summary: Optional[str] = None
@@ -106,7 +395,7 @@ class EventBasedSummary:  # L2
     def latest_raw(self):
         return self.latest_scene.raw
 
-    @property
+    @memoized_property
     def speech_events(self):
         return [(self.latest_raw.timestamp, self.latest_raw.asr_recognition)] if self.latest_raw.asr_recognition else []
 
@@ -114,7 +403,7 @@ class EventBasedSummary:  # L2
     def image(self):
         return self.latest_raw.image
 
-    @property
+    @memoized_property
     def nl_summary(self):
         action = self.latest_raw.current_action
         action_state = self.latest_raw.current_action_state
@@ -128,19 +417,25 @@ class EventBasedSummary:  # L2
         return (f"Action: {action}{action_param_str}{action_state_str}"
                 f"{graph}{audio}{asr}.")
 
-    @property
+    @memoized_property
     def range(self):
         return (self.scenes[0].raw.timestamp,
                 self.latest_raw.timestamp)
 
     @property
+    def own_index_content(self) -> List[str]:
+        # The index content without the content of the child nodes
+        return [self.audio_description, self.action_parameter_summary]
+
+    @memoized_property
     def index_content(self) -> List[str]:
-        return list(chain(*(s.index_content for s in self.scenes))) + [self.audio_description,
-                                                                       self.action_parameter_summary]
+        return list(chain(*(s.index_content for s in self.scenes))) + self.own_index_content
 
 
 @dataclass
-class GoalBasedSummary:  # L3
+class GoalBasedSummary(_ObservedNode):  # L3
+    _observed_list_fields = ('events',)
+
     # from oldest to newest. the last element is where the goal was reached/failed
     events: List[Union[EventBasedSummary, 'GoalBasedSummary']]
 
@@ -159,7 +454,7 @@ class GoalBasedSummary:  # L3
     def latest_raw(self):
         return self.latest_scene.raw
 
-    @property
+    @memoized_property
     def speech_events(self):
         return list(chain(*(
             child.speech_events for child in self.events
@@ -171,7 +466,7 @@ class GoalBasedSummary:  # L3
                                     'Use its child nodes to access observed images.')
         raise AttributeError(f"'GoalBasedSummary' object has no attribute '{item}'")
 
-    @property
+    @memoized_property
     def nl_summary(self):
         goal = self.explicit_goal or self.latest_raw.current_goal
         audio = '\n'.join(e.audio_description for e in self.events
@@ -191,32 +486,42 @@ class GoalBasedSummary:  # L3
             result += '\nSpeech:\n' + asr
         return result
 
-    @property
+    @memoized_property
     def range(self):
         return (self.events[0].range[0],
                 self.events[-1].range[-1])
 
     @property
+    def own_index_content(self) -> List[str]:
+        return [self.explicit_goal]
+
+    @memoized_property
     def index_content(self) -> List[str]:
-        return list(chain(*(e.index_content for e in self.events))) + [self.explicit_goal]
+        return list(chain(*(e.index_content for e in self.events))) + self.own_index_content
 
 
 HighestPredefinedSummaryLevel = GoalBasedSummary
 
 
 @dataclass
-class HigherLevelSummary:
+class HigherLevelSummary(_ObservedNode):
+    _observed_list_fields = ('children',)
+
     nl_summary: str
     children: List[Union[HighestPredefinedSummaryLevel, 'HigherLevelSummary']]
 
-    @property
+    @memoized_property
     def range(self):
         return (self.children[0].range[0],
                 self.children[-1].range[-1])
 
     @property
+    def own_index_content(self) -> List[str]:
+        return [self.nl_summary]
+
+    @memoized_property
     def index_content(self) -> List[str]:
-        return [self.nl_summary] + list(chain(*(c.index_content for c in self.children)))
+        return self.own_index_content + list(chain(*(c.index_content for c in self.children)))
 
     def __getattr__(self, item):
         if item == 'image':
@@ -231,6 +536,53 @@ type_to_children_property_map = {
     EventBasedSummary: 'scenes'
 }
 
+
+def node_class(node) -> type:
+    # The EM tree class of a node. Differs from type(node) for views like em.scene_timeline.TimelineEvent
+    for cls in type(node).__mro__:
+        if cls in type_to_children_property_map or cls in (SceneGraphInstant, RawDataInstant):
+            return cls
+    return type(node)
+
+
+def get_children(node) -> Optional[list]:
+    cls = node_class(node)
+    if cls in type_to_children_property_map:
+        return getattr(node, type_to_children_property_map[cls])
+    return None
+
+
+class TreeMutationWatcher:
+    """
+    Records whether a node of a tree or one of its child lists is mutated. Unlike mutation_epoch(), this ignores
+    mutations of other trees. Views like em.time_shift watch the nodes they show. Call close() when done.
+    """
+
+    def __init__(self, tree):
+        self.modified = False
+        self._watched = set()
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            node = getattr(node, '_base', node)
+            self._watched.add(id(node))
+            if isinstance(node, SceneGraphInstant):
+                self._watched.add(id(node.raw))
+            children = get_children(node)
+            if children is not None:
+                self._watched.add(id(children))
+                stack.extend(children)
+        _mutation_listeners.append(self._on_mutation)
+
+    def _on_mutation(self, target):
+        if id(target) in self._watched:
+            self.modified = True
+
+    def close(self):
+        if self._on_mutation in _mutation_listeners:
+            _mutation_listeners.remove(self._on_mutation)
+
+
 AnyTreeNode = Union[
     HigherLevelSummary,
     GoalBasedSummary,
@@ -1,4 +1,3 @@
-from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 from typing import Union, Optional
@@ -6,28 +5,13 @@ from typing import Union, Optional
 import PIL.Image
 import cv2
 
-from em.em_tree import HigherLevelSummary, GoalBasedSummary, EventBasedSummary
+from em.em_tree import HigherLevelSummary
+from em.time_shift import shift_time
 
 
 def move_history_to_start_date(history: HigherLevelSummary, start_date: datetime) -> HigherLevelSummary:
-    old_start = history.range[0]
-    diff = start_date - old_start
-
-    def _deep_adjust(h: Union[HigherLevelSummary, GoalBasedSummary, EventBasedSummary]):
-        if isinstance(h, EventBasedSummary):
-            for s in h.scenes:
-                s.raw.timestamp += diff
-        elif isinstance(h, GoalBasedSummary):
-            for e in h.events:
-                _deep_adjust(e)
-        else:
-            for c in h.children:
-                _deep_adjust(c)
-
-    history = deepcopy(history)
-    _deep_adjust(history)
-
-    return history
+    # A view with shifted timestamps, see em.time_shift. The nodes of the original history are shared, not copied
+    return shift_time(history, start_date - history.range[0])
 
 
 class LazyLoadPILImage:
@@ -0,0 +1,237 @@
+import argparse
+import io
+import mmap
+import os
+import pickle
+import struct
+from pathlib import Path
+from typing import Sequence, Union
+
+import numpy as np
+
+from em.em_tree import HigherLevelSummary, ObservedList, InternTable, interning, memoized_property, get_children, \
+    unpickle_history
+from em.tree_layout import TreeLayout
+
+
+SUFFIX = '.emvh'
+_MAGIC = b'EMVHIST1'
+_HEADER = struct.Struct('<Q')
+
+
+class StoredHigherLevelSummary(HigherLevelSummary):
+    """Higher level summary of a HistoryStore. Its children are loaded from the store on first access."""
+
+    def __init__(self, store: 'HistoryStore', number: int, nl_summary: str, range_):
+        object.__setattr__(self, 'nl_summary', nl_summary)
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, '_number', number)
+        object.__setattr__(self, '_stored_range', range_)
+
+    @property
+    def children(self):
+        if '_children' not in self.__dict__:
+            object.__setattr__(self, '_children', ObservedList(self._store.load_children(self._number)))
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        object.__setattr__(self, '_children', value)
+
+    @property
+    def is_loaded(self):
+        return '_children' in self.__dict__
+
+    @memoized_property
+    def range(self):
+        if not self.is_loaded:
+            return self._stored_range
+        return HigherLevelSummary.range.fn(self)
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are ordinary, completely loaded trees
+        return HigherLevelSummary, (self.nl_summary, list(self.children))
+
+
+class _StoredStrings(Sequence):
+    # Index strings of a store, decoded on access
+
+    def __init__(self, data, offsets: np.ndarray):
+        super().__init__()
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+class _RecordPickler(pickle.Pickler):
+
+    def __init__(self, file, layout: TreeLayout):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._layout = layout
+
+    def persistent_id(self, obj):
+        if isinstance(obj, HigherLevelSummary):
+            return self._layout.number_of(obj), obj.nl_summary, obj.range if len(obj.children) > 0 else None
+        return None
+
+
+class _RecordUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, store: 'HistoryStore'):
+        super().__init__(file)
+        self._store = store
+
+    def persistent_load(self, pid):
+        number, nl_summary, range_ = pid
+        node = StoredHigherLevelSummary(self._store, number, nl_summary, range_)
+        self._store.layout.register(node, number)
+        return node
+
+
+class HistoryStore:
+    """
+    Read-only history file, whose subtrees are only unpickled when they are accessed.
+
+        magic | offset of the directory (uint64) | records | arrays | strings | directory
+
+    Every higher level summary has a record with its pickled children list, where child higher level summaries are
+    replaced by references (layout number, nl_summary, range). The children of the lowest summaries (goals with their
+    events and scenes) are pickled completely. The node offset table `records` holds (offset, length) of the record
+    of each node, indexed by TreeLayout number (0 for nodes without a record). The TreeLayout arrays and the index
+    strings of the whole tree are stored as well, so search indices can be built without loading the tree.
+
+    The file is memory-mapped: opening a store only reads the directory and the root.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__()
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f'{self.path} is not a history store')
+        directory_offset, = _HEADER.unpack_from(self._mmap, len(_MAGIC))
+        directory = pickle.loads(self._mmap[directory_offset:])
+        self._intern_table = InternTable()  # Values are shared between all subtrees loaded from this store
+        arrays = {name: np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+                  for name, (offset, dtype, count) in directory['arrays'].items()}
+        self._records = arrays['records'].reshape(-1, 2)
+        strings_offset, strings_length = directory['strings']
+        self.layout = TreeLayout.from_arrays(
+            _StoredStrings(memoryview(self._mmap)[strings_offset:strings_offset + strings_length],
+                           arrays['string_offsets']),
+            arrays)
+        self.root = self._unpickle(*directory['root'])
+        self._register([self.root], 0)
+
+    def _unpickle(self, offset, length):
+        with interning(self._intern_table):
+            return _RecordUnpickler(io.BytesIO(self._mmap[offset:offset + length]), self).load()
+
+    def load_children(self, number: int) -> list:
+        children = self._unpickle(*self._records[number])
+        self._register(children, number + 1)
+        return children
+
+    def _register(self, nodes: list, first: int):
+        # Numbers the loaded nodes like TreeLayout: pre-order, so the next sibling starts after the subtree
+        stack = [(nodes, first)]
+        while stack:
+            nodes, n = stack.pop()
+            for node in nodes:
+                if not isinstance(node, StoredHigherLevelSummary):  # These were registered when unpickled
+                    self.layout.register(node, n)
+                    stack.append((get_children(node) or [], n + 1))
+                n = int(self.layout.subtree_end[n])
+
+    @property
+    def num_loaded(self):
+        return len(self.layout.nodes)
+
+
+def write_history_store(history, path: Union[str, Path]):
+    layout = TreeLayout(history)
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC + _HEADER.pack(0))
+
+        def write(data: bytes):
+            offset = f.tell()
+            f.write(data)
+            return offset, len(data)
+
+        def write_array(a: np.ndarray):
+            f.write(b'\0' * (-f.tell() % 8))
+            return f.tell(), a.dtype.str, write(a.tobytes())[1] // a.itemsize
+
+        def dump(obj):
+            data = io.BytesIO()
+            _RecordPickler(data, layout).dump(obj)
+            return write(data.getvalue())
+
+        records = np.zeros((len(layout), 2), dtype=np.int64)
+        for n, node in enumerate(layout.nodes):
+            if isinstance(node, HigherLevelSummary):
+                records[n] = dump(list(node.children))
+        root = dump(history)
+
+        encoded = [s.encode('utf-8') for s in layout.strings]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=string_offsets[1:])
+        strings = write(b''.join(encoded))
+
+        arrays = {name: write_array(getattr(layout, name)) for name in TreeLayout.ARRAYS}
+        arrays['records'] = write_array(records.reshape(-1))
+        arrays['string_offsets'] = write_array(string_offsets)
+
+        directory_offset, _ = write(pickle.dumps(dict(root=root, strings=strings, arrays=arrays)))
+        f.seek(len(_MAGIC))
+        f.write(_HEADER.pack(directory_offset))
+    os.replace(tmp_path, path)
+
+
+def convert_pickle(pickle_path: Union[str, Path], store_path: Union[str, Path] = None) -> Path:
+    pickle_path = Path(pickle_path)
+    store_path = Path(store_path) if store_path is not None else pickle_path.with_suffix(SUFFIX)
+    write_history_store(unpickle_history(pickle_path.read_bytes()), store_path)
+    return store_path
+
+
+def open_history(path: Union[str, Path]) -> HigherLevelSummary:
+    """
+    Opens a history store, or a history pickle through an up-to-date store next to it (see main() to convert pickles).
+    Subtrees of a store are loaded when they are accessed, i.e. expanded or searched. Pickles without a store are
+    loaded completely.
+    """
+    path = Path(path)
+    if path.suffix != SUFFIX:
+        store_path = path.with_suffix(SUFFIX)
+        if not store_path.exists() or store_path.stat().st_mtime < path.stat().st_mtime:
+            print(f'Loading {path} completely, convert it with "python -m em.history_store {path}" to load it lazily')
+            return unpickle_history(path.read_bytes())
+        path = store_path
+    return HistoryStore(path).root
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts history pickles to history stores')
+    parser.add_argument('history_pickle_files', nargs='+', type=Path)
+    args = parser.parse_args()
+    for pickle_path in args.history_pickle_files:
+        print(pickle_path, '->', convert_pickle(pickle_path))
+
+
+if __name__ == '__main__':
+    main()
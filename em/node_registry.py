@@ -0,0 +1,110 @@
+import hashlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from em.em_tree import get_children
+from em.tree_layout import TreeLayout, layout_of
+
+
+def _fingerprint(layout: TreeLayout, n: int) -> str:
+    # Own index content of the node and of its first leaf, which stay the same when the node is re-dated or gets
+    # new children at the end
+    first_leaf = n
+    while layout.subtree_end[first_leaf] > first_leaf + 1:
+        first_leaf += 1
+    key = '\x1e'.join('\x1f'.join(layout.strings[i] for i in layout.occurrences[layout.occ_start[m]:layout.own_end[m]])
+                      for m in (n, first_leaf))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=4).hexdigest()
+
+
+class NodeRegistry:
+    """
+    Stable IDs for the nodes of an EM tree, with lookup of nodes and their parents by ID.
+
+    The ID of a node is its child index path from the root plus a hash of its own index content and that of its first
+    leaf, for example '3.0.12#5f0c2a1b'. Neither changes when the history is extended at the end or moved in time
+    (e.g. em.time_shift views). The hash detects when a different node took the place, e.g. after the history was
+    summarized again. IDs can therefore be stored and used in later sessions.
+    IDs are resolved in the layout, by a binary search per path element, so checking an ID does not load subtrees of a
+    history store. Resolved IDs are cached.
+    """
+
+    def __init__(self, root: Any, layout: TreeLayout = None):
+        super().__init__()
+        self.root = root
+        self.layout = layout if layout is not None else layout_of(root)
+        self._nodes: Dict[str, Any] = {}
+        # (parent, child index) of all nodes as sorted keys, and the node numbers in that order. Built on first lookup
+        self._child_keys: Optional[np.ndarray] = None
+        self._child_numbers: Optional[np.ndarray] = None
+        self._key_stride = 0
+
+    def _number_of(self, node) -> int:
+        n = self.layout.number_of(getattr(node, '_wrapped', node))
+        if n is None:
+            raise ValueError(f'Node is not part of this tree: {node!r:.200}')
+        return n
+
+    def path_of(self, node) -> Tuple[int, ...]:
+        return self.layout.path_to(self._number_of(node))
+
+    def id_of(self, node) -> str:
+        node = getattr(node, '_wrapped', node)
+        n = self._number_of(node)
+        node_id = '.'.join(map(str, self.layout.path_to(n))) + '#' + _fingerprint(self.layout, n)
+        self._nodes[node_id] = node
+        return node_id
+
+    def node(self, node_id: str):
+        node = self._nodes.get(node_id)
+        if node is not None:
+            return node
+        path, _, fingerprint = node_id.partition('#')
+        try:
+            path = tuple(int(i) for i in path.split('.') if i)
+            n = self._number_at(path)
+        except (ValueError, IndexError):
+            raise KeyError(node_id) from None
+        if _fingerprint(self.layout, n) != fingerprint:
+            raise KeyError(node_id)
+        node = self._registered(n)
+        if node is None:
+            node = self.node_at(path)
+        self._nodes[node_id] = node
+        return node
+
+    def _number_at(self, path: Tuple[int, ...]) -> int:
+        if self._child_keys is None:
+            self._key_stride = int(self.layout.child_index.max(initial=0)) + 1
+            keys = self.layout.parents.astype(np.int64) * self._key_stride + self.layout.child_index
+            self._child_numbers = np.argsort(keys, kind='stable')
+            self._child_keys = keys[self._child_numbers]
+        n = 0
+        for i in path:
+            if not 0 <= i < self._key_stride:
+                raise IndexError(path)
+            key = n * self._key_stride + i
+            k = int(np.searchsorted(self._child_keys, key))
+            if k == len(self._child_keys) or self._child_keys[k] != key:
+                raise IndexError(path)
+            n = int(self._child_numbers[k])
+        return n
+
+    def _registered(self, n: int):
+        # None for nodes of a history store that are not loaded yet
+        nodes = self.layout.nodes
+        return nodes.get(n) if isinstance(nodes, dict) else nodes[n]
+
+    def node_at(self, path: Tuple[int, ...]):
+        node = self.root
+        for i in path:
+            node = (get_children(node) or [])[i]
+        return node
+
+    def parent(self, node) -> Optional[Any]:
+        p = int(self.layout.parents[self._number_of(node)])
+        if p < 0:
+            return None
+        parent = self._registered(p)
+        return parent if parent is not None else self.node_at(self.layout.path_to(p))
@@ -2,6 +2,7 @@ from datetime import timedelta
 from typing import List, Sequence, Union
 
 from em.em_tree import SceneGraphInstant, EventBasedSummary, GoalBasedSummary
+from em.scene_timeline import SceneTimeline
 from lmp.util import safe_equals as np_safe_equals
 
 
@@ -47,6 +48,12 @@ _MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES = timedelta(minutes=2)
 
 
 def select_keyframe_indices(scenes: List[SceneGraphInstant]) -> List[int]:
+    # The loaders pass plain scenes. Views of a SceneTimeline only come from SceneTimeline.from_history, e.g. to
+    # segment the scenes of an existing history again
+    timeline_rows = SceneTimeline.rows_of(scenes)
+    if timeline_rows is not None and timeline_rows[0].is_sorted:
+        timeline, start, end = timeline_rows
+        return timeline.keyframe_indices(start, end).tolist()
     scenes.sort(key=lambda s: s.raw.timestamp)
     keyframe_indices = []
     for i, scene in enumerate(scenes):
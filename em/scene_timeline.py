@@ -0,0 +1,329 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from em.em_tree import SceneGraphInstant, RawDataInstant, EventBasedSummary, GoalBasedSummary, HigherLevelSummary, \
+    ObjectNode, ObservedList, get_children, _intern, _intern_with_key
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Must match rule_based_summary._MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES
+_MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES_US = timedelta(minutes=2) // _MICROSECOND
+
+
+def _to_us(ts: datetime) -> int:
+    # Timestamps are naive local time, like datetime.fromtimestamp in the loaders
+    return (ts - _EPOCH) // _MICROSECOND
+
+
+def _from_us(us) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(us))
+
+
+class _Table:
+    # Deduplicating table of values with their int32 ids. key_fn returns a hashable key, or None to not deduplicate
+    def __init__(self, key_fn=lambda v: v):
+        self.values = []
+        self._ids = {}
+        self._key_fn = key_fn
+
+    def id_of(self, value) -> int:
+        key = self._key_fn(value)
+        if key is None:
+            self.values.append(value)
+            return len(self.values) - 1
+        if key not in self._ids:
+            self._ids[key] = len(self.values)
+            self.values.append(value)
+        return self._ids[key]
+
+
+class SceneTimeline:
+    """
+    Struct-of-arrays store of scene-level (L1 and L0) data, one row per scene.
+
+    - timestamps: int64 microseconds since 1970-01-01 (naive, like the datetimes in the tree)
+    - actions, action_states, goals, goal_states, asr: int32 ids into strings, -1 for None
+    - parameter_ids: int32 ids into parameters (deduplicated current_action_parameters)
+    - object_set_ids: int32 ids into object_sets (deduplicated object tuples)
+    - relations in CSR layout: those of row i are relation_from/_to/_types[relation_offsets[i]:relation_offsets[i + 1]]
+    Images and sounds are rare and kept in dicts by row.
+
+    TimelineScene and TimelineEvent are views over rows of a timeline that behave like SceneGraphInstant and
+    EventBasedSummary. Time range queries, keyframe selection and statistics run on the columns directly.
+    The loaders still build plain node objects, histories are converted explicitly with from_history.
+    """
+
+    def __init__(self, scenes: Sequence[SceneGraphInstant]):
+        super().__init__()
+        n = len(scenes)
+        string_table = _Table()
+        parameter_table = _Table(lambda v: _intern_with_key(v)[1])
+        object_set_table = _Table()
+        object_key_table = _Table()  # Set of objects, for change detection like set(scene.objects)
+        relation_key_table = _Table()  # Set of relations, same
+
+        def string_id(s):
+            return -1 if s is None else string_table.id_of(s)
+
+        self.timestamps = np.empty(n, dtype=np.int64)
+        string_columns = np.empty((5, n), dtype=np.int32)
+        self.parameter_ids = np.empty(n, dtype=np.int32)
+        self.object_set_ids = np.empty(n, dtype=np.int32)
+        self.object_keys = np.empty(n, dtype=np.int32)
+        self.relation_keys = np.empty(n, dtype=np.int32)
+        self.relation_offsets = np.zeros(n + 1, dtype=np.int64)
+        relation_from, relation_to, relation_types = [], [], []
+        self.images: Dict[int, Any] = {}
+        self.sounds: Dict[int, np.ndarray] = {}
+
+        for i, scene in enumerate(scenes):
+            raw = scene.raw
+            self.timestamps[i] = _to_us(raw.timestamp)
+            string_columns[:, i] = [string_id(raw.current_action), string_id(raw.current_action_state),
+                                    string_id(raw.current_goal), string_id(raw.current_goal_state),
+                                    string_id(raw.asr_recognition)]
+            self.parameter_ids[i] = parameter_table.id_of(raw.current_action_parameters)
+            objects = tuple(scene.objects)
+            self.object_set_ids[i] = object_set_table.id_of(objects)
+            self.object_keys[i] = object_key_table.id_of(frozenset(objects))
+            self.relation_keys[i] = relation_key_table.id_of(frozenset(scene.relations))
+            for o1, o2, rel in scene.relations:
+                relation_from.append(o1)
+                relation_to.append(o2)
+                relation_types.append(string_table.id_of(rel))
+            self.relation_offsets[i + 1] = len(relation_from)
+            if raw.image is not None:
+                self.images[i] = raw.image
+            if raw.sound is not None:
+                self.sounds[i] = raw.sound
+
+        self.actions, self.action_states, self.goals, self.goal_states, self.asr = string_columns
+        self.relation_from = np.array(relation_from, dtype=np.int32)
+        self.relation_to = np.array(relation_to, dtype=np.int32)
+        self.relation_types = np.array(relation_types, dtype=np.int32)
+        self.strings: List[str] = [_intern(s) for s in string_table.values]
+        self.parameters: List[Optional[dict]] = [_intern(p) for p in parameter_table.values]
+        self.object_sets: List[Tuple[ObjectNode, ...]] = object_set_table.values
+        self.is_sorted = bool(np.all(np.diff(self.timestamps) >= 0))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (
+            self.timestamps, self.actions, self.action_states, self.goals, self.goal_states, self.asr,
+            self.parameter_ids, self.object_set_ids, self.object_keys, self.relation_keys, self.relation_offsets,
+            self.relation_from, self.relation_to, self.relation_types))
+
+    def _string(self, string_id) -> Optional[str]:
+        return self.strings[string_id] if string_id >= 0 else None
+
+    def timestamp(self, row: int) -> datetime:
+        return _from_us(self.timestamps[row])
+
+    def objects(self, row: int) -> List[ObjectNode]:
+        return list(self.object_sets[self.object_set_ids[row]])
+
+    def relations(self, row: int) -> List[Tuple[int, int, str]]:
+        start, end = self.relation_offsets[row], self.relation_offsets[row + 1]
+        return [(o1, o2, self.strings[rel]) for o1, o2, rel in zip(
+            self.relation_from[start:end].tolist(), self.relation_to[start:end].tolist(),
+            self.relation_types[start:end].tolist())]
+
+    def rows_between(self, start: datetime = None, end: datetime = None) -> np.ndarray:
+        """Rows with start <= timestamp <= end, in row order."""
+        lo = _to_us(start) if start is not None else np.iinfo(np.int64).min
+        hi = _to_us(end) if end is not None else np.iinfo(np.int64).max
+        if self.is_sorted:
+            return np.arange(np.searchsorted(self.timestamps, lo, side='left'),
+                             np.searchsorted(self.timestamps, hi, side='right'))
+        return np.flatnonzero((self.timestamps >= lo) & (self.timestamps <= hi))
+
+    def keyframe_indices(self, start=0, end: int = None) -> np.ndarray:
+        """
+        Same as rule_based_summary.select_keyframe_indices for the (time-sorted) rows start:end, relative to start.
+        Action parameters are compared by their interned content, which like safe_equals is type strict, but also
+        depends on the key order of dicts.
+        """
+        end = len(self) if end is None else end
+        if end - start < 2:
+            return np.empty(0, dtype=np.int64)
+        rows = slice(start, end - 1)
+        next_rows = slice(start + 1, end)
+        asr_lengths = np.array([len(s) for s in self.strings] + [0], dtype=np.int64)  # -1 (None) maps to 0
+        changed = (
+            # Scene graph change
+            (self.object_keys[rows] != self.object_keys[next_rows])
+            | (self.relation_keys[rows] != self.relation_keys[next_rows])
+            # Action change
+            | (self.actions[rows] != self.actions[next_rows])
+            | (self.parameter_ids[rows] != self.parameter_ids[next_rows])
+            # ASR event
+            | (asr_lengths[self.asr[rows]] > 0)
+            # too big time difference
+            | (np.diff(self.timestamps[start:end]) > _MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES_US)
+        )
+        return np.flatnonzero(changed)
+
+    def statistics(self, start: datetime = None, end: datetime = None) -> Dict[str, Dict[str, float]]:
+        """
+        Number of scenes and time spent per action in the time range. A scene lasts until the next one,
+        the last scene of the range counts as 0 seconds.
+        """
+        rows = self.rows_between(start, end)
+        if len(rows) == 0:
+            return {}
+        actions = self.actions[rows] + 1  # None -> 0 for bincount
+        durations = np.diff(self.timestamps[rows], append=self.timestamps[rows[-1]]) / 1e6
+        counts = np.bincount(actions, minlength=len(self.strings) + 1)
+        seconds = np.bincount(actions, weights=durations, minlength=len(self.strings) + 1)
+        return {
+            self._string(a - 1): dict(scenes=int(counts[a]), seconds=float(seconds[a]))
+            for a in np.flatnonzero(counts)
+        }
+
+    def scene(self, row: int) -> 'TimelineScene':
+        return TimelineScene(self, row)
+
+    def event(self, start: int, end: int, **kwargs) -> 'TimelineEvent':
+        return TimelineEvent(self, start, end, **kwargs)
+
+    @staticmethod
+    def rows_of(scenes: Sequence[SceneGraphInstant]) -> Optional[Tuple['SceneTimeline', int, int]]:
+        """(timeline, start, end) if the scenes are views of the rows start:end of one timeline, else None"""
+        if len(scenes) == 0 or not isinstance(scenes[0], TimelineScene):
+            return None
+        timeline, start = scenes[0]._timeline, scenes[0]._row
+        for i, s in enumerate(scenes):
+            if not isinstance(s, TimelineScene) or s._timeline is not timeline or s._row != start + i:
+                return None
+        return timeline, start, start + len(scenes)
+
+    @classmethod
+    def from_history(cls, history):
+        """
+        Returns a copy of the history whose events are TimelineEvent views over one new SceneTimeline,
+        and the timeline. Nodes above the events are copied shallowly.
+        """
+        events = []
+
+        def collect(node):
+            if isinstance(node, EventBasedSummary):
+                events.append(node)
+            for c in get_children(node) or []:
+                collect(c)
+
+        collect(history)
+        timeline = cls([s for e in events for s in e.scenes])
+        views = {}
+        row = 0
+        for e in events:
+            views[id(e)] = timeline.event(row, row + len(e.scenes), audio_description=e.audio_description,
+                                          action_parameter_summary=e.action_parameter_summary)
+            row += len(e.scenes)
+
+        def convert(node):
+            if id(node) in views:
+                return views[id(node)]
+            if isinstance(node, GoalBasedSummary):
+                return GoalBasedSummary([convert(c) for c in node.events], explicit_goal=node.explicit_goal)
+            if isinstance(node, HigherLevelSummary):
+                return HigherLevelSummary(node.nl_summary, [convert(c) for c in node.children])
+            return node
+
+        return convert(history), timeline
+
+
+class TimelineRaw(RawDataInstant):
+    """Read-only view of the L0 data of one timeline row."""
+
+    __slots__ = ('_timeline', '_row')
+
+    def __init__(self, timeline: SceneTimeline, row: int):
+        object.__setattr__(self, '_timeline', timeline)
+        object.__setattr__(self, '_row', row)
+
+    timestamp = property(lambda self: self._timeline.timestamp(self._row))
+    image = property(lambda self: self._timeline.images.get(self._row))
+    sound = property(lambda self: self._timeline.sounds.get(self._row))
+    asr_recognition = property(lambda self: self._timeline._string(self._timeline.asr[self._row]))
+    current_action = property(lambda self: self._timeline._string(self._timeline.actions[self._row]))
+    current_action_state = property(lambda self: self._timeline._string(self._timeline.action_states[self._row]))
+    current_action_parameters = property(
+        lambda self: self._timeline.parameters[self._timeline.parameter_ids[self._row]])
+    current_goal = property(lambda self: self._timeline._string(self._timeline.goals[self._row]))
+    current_goal_state = property(lambda self: self._timeline._string(self._timeline.goal_states[self._row]))
+
+    def materialize(self) -> RawDataInstant:
+        return RawDataInstant(**{f: getattr(self, f) for f in RawDataInstant.__dataclass_fields__})
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def __reduce__(self):
+        return TimelineRaw, (self._timeline, self._row)
+
+
+class TimelineScene(SceneGraphInstant):
+    """Read-only view of one timeline row, behaves like the SceneGraphInstant it was created from."""
+
+    __slots__ = ('_timeline', '_row')
+
+    def __init__(self, timeline: SceneTimeline, row: int):
+        object.__setattr__(self, '_timeline', timeline)
+        object.__setattr__(self, '_row', row)
+
+    objects = property(lambda self: self._timeline.objects(self._row))
+    relations = property(lambda self: self._timeline.relations(self._row))
+    raw = property(lambda self: TimelineRaw(self._timeline, self._row))
+
+    @property
+    def image(self):
+        return self._timeline.images.get(self._row)
+
+    def materialize(self) -> SceneGraphInstant:
+        return SceneGraphInstant(self.objects, self.relations, self.raw.materialize())
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def __reduce__(self):
+        return TimelineScene, (self._timeline, self._row)
+
+
+class TimelineEvent(EventBasedSummary):
+    """Read-only view of the rows start:end of a timeline, behaves like an EventBasedSummary with these scenes."""
+
+    def __init__(self, timeline: SceneTimeline, start: int, end: int, audio_description: Optional[str] = None,
+                 action_parameter_summary: Optional[str] = None):
+        assert 0 <= start < end <= len(timeline), 'An event needs at least one scene'
+        object.__setattr__(self, '_timeline', timeline)
+        object.__setattr__(self, '_rows', (start, end))
+        object.__setattr__(self, '_scenes', None)
+        self.audio_description = audio_description
+        self.action_parameter_summary = action_parameter_summary
+
+    @property
+    def scenes(self) -> List[TimelineScene]:
+        # Created once, since the tree (e.g. TreeLayout) identifies nodes by object identity
+        if self._scenes is None:
+            object.__setattr__(self, '_scenes', ObservedList(TimelineScene(self._timeline, row)
+                                                             for row in range(*self._rows)))
+        return self._scenes
+
+    @property
+    def range(self):
+        start, end = self._rows
+        return self._timeline.timestamp(start), self._timeline.timestamp(end - 1)
+
+    def materialize(self) -> EventBasedSummary:
+        return EventBasedSummary([s.materialize() for s in self.scenes], self.audio_description,
+                                 self.action_parameter_summary)
+
+    def __reduce__(self):
+        return TimelineEvent, (self._timeline, *self._rows, self.audio_description, self.action_parameter_summary)
+
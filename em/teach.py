@@ -5,7 +5,7 @@ from pathlib import Path
 
 import torch
 
-from em.em_tree import HigherLevelSummary, RawDataInstant, SceneGraphInstant, ObjectNode
+from em.em_tree import HigherLevelSummary, RawDataInstant, SceneGraphInstant, ObjectNode, interning
 from em.em_util import LazyLoadPILImage
 from em.rule_based_summary import select_keyframe_indices, build_event_summaries_with_indices, \
     build_goal_summaries_with_indices
@@ -95,6 +95,7 @@ class _TeachNamingAndStateTrackingHandler:
                           state=', '.join(active_states) if active_states else None)
 
 
+@interning()
 def load_teach_episode(teach_game_file: Path, start_time: datetime = None) -> HigherLevelSummary:
     if start_time is None:
         start_time = datetime.now()
@@ -186,6 +187,7 @@ def load_teach_episode(teach_game_file: Path, start_time: datetime = None) -> Hi
 TEACH_INTERACTION_ACTIONS = ['Close', 'Open', 'Pickup', 'Place', 'Pour', 'Slice', 'ToggleOff', 'ToggleOn']
 
 
+@interning()
 def load_teach_episode_no_gt(teach_trial_image_dir: Path,
                              obj_det_dir: Path,
                              action_inference_dir: Path,
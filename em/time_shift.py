@@ -0,0 +1,137 @@
+from dataclasses import fields
+from datetime import timedelta
+from typing import TypeVar
+
+from em.em_tree import RawDataInstant, SceneGraphInstant, EventBasedSummary, GoalBasedSummary, HigherLevelSummary, \
+    ObservedList, memoized_property, mutation_epoch, node_class, _strip_img_details
+
+Node = TypeVar('Node')
+
+
+def shift_time(node: Node, offset: timedelta) -> Node:
+    """
+    View of a tree node with all timestamps and ranges moved by offset. Nothing is copied, child views are created
+    when they are accessed. All other fields are shared with the original node, assigning them changes the original.
+    """
+    if isinstance(node, _TimeShifted):
+        node, offset = node._base, node._offset + offset
+    view_class = next(_view_classes[cls] for cls in type(node).__mro__ if cls in _view_classes)
+    return view_class(node, offset)
+
+
+def _forwarded(name):
+    def set_value(self, value):
+        setattr(self._base, name, value)
+    return property(lambda self: getattr(self._base, name), set_value)
+
+
+def _shifted_children(name):
+    def get_children(self):
+        # Created once, since the tree (e.g. TreeLayout) identifies nodes by object identity.
+        # Updated if the children of the original node were changed
+        epoch, views = getattr(self, '_views', (None, None))
+        if epoch != mutation_epoch():
+            children = getattr(self._base, name)
+            if (views is None or len(views) != len(children)
+                    or any(v._base is not c for v, c in zip(views, children))):
+                previous = {id(v._base): v for v in views or ()}
+                views = ObservedList(previous.get(id(c)) or shift_time(c, self._offset) for c in children)
+            object.__setattr__(self, '_views', (mutation_epoch(), views))
+        return views
+    return property(get_children)
+
+
+class _TimeShifted:
+    __slots__ = ()
+
+    def __init__(self, base, offset: timedelta):
+        object.__setattr__(self, '_base', base)
+        object.__setattr__(self, '_offset', offset)
+
+    def __reduce__(self):
+        return shift_time, (self._base, self._offset)
+
+    def __repr__(self):
+        # The dataclass repr of the original class, so views render exactly like re-dated copies
+        return (f'{node_class(self).__qualname__}('
+                + ', '.join(f'{f.name}={getattr(self, f.name)!r}' for f in fields(self) if f.repr) + ')')
+
+
+class ShiftedRawDataInstant(_TimeShifted, RawDataInstant):
+    __slots__ = ('_base', '_offset')
+
+    @property
+    def timestamp(self):
+        return self._base.timestamp + self._offset
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._base.timestamp = value - self._offset
+
+    def __repr__(self):
+        r = _TimeShifted.__repr__(self)
+        return r if self.image is None else _strip_img_details(r)
+
+
+for _field in fields(RawDataInstant):
+    if _field.name != 'timestamp':
+        setattr(ShiftedRawDataInstant, _field.name, _forwarded(_field.name))
+
+
+class ShiftedSceneGraphInstant(_TimeShifted, SceneGraphInstant):
+    __slots__ = ('_base', '_offset', '_raw')
+
+    objects = _forwarded('objects')
+    relations = _forwarded('relations')
+    nl_graph_summary = property(lambda self: self._base.nl_graph_summary)
+    index_content = property(lambda self: self._base.index_content)
+
+    @property
+    def raw(self):
+        raw = getattr(self, '_raw', None)
+        if raw is None or raw._base is not self._base.raw:
+            raw = ShiftedRawDataInstant(self._base.raw, self._offset)
+            object.__setattr__(self, '_raw', raw)
+        return raw
+
+
+class _ShiftedSummary(_TimeShifted):
+    __slots__ = ()
+
+    index_content = property(lambda self: self._base.index_content)
+
+    @memoized_property
+    def range(self):
+        start, end = self._base.range
+        return start + self._offset, end + self._offset
+
+    @memoized_property
+    def speech_events(self):
+        return [(ts + self._offset, speech) for ts, speech in self._base.speech_events]
+
+
+class ShiftedEventBasedSummary(_ShiftedSummary, EventBasedSummary):
+    scenes = _shifted_children('scenes')
+    audio_description = _forwarded('audio_description')
+    action_parameter_summary = _forwarded('action_parameter_summary')
+    nl_summary = property(lambda self: self._base.nl_summary)
+
+
+class ShiftedGoalBasedSummary(_ShiftedSummary, GoalBasedSummary):
+    # nl_summary is not forwarded, it contains the timestamps of speech
+    events = _shifted_children('events')
+    explicit_goal = _forwarded('explicit_goal')
+
+
+class ShiftedHigherLevelSummary(_ShiftedSummary, HigherLevelSummary):
+    children = _shifted_children('children')
+    nl_summary = _forwarded('nl_summary')
+
+
+_view_classes = {
+    RawDataInstant: ShiftedRawDataInstant,
+    SceneGraphInstant: ShiftedSceneGraphInstant,
+    EventBasedSummary: ShiftedEventBasedSummary,
+    GoalBasedSummary: ShiftedGoalBasedSummary,
+    HigherLevelSummary: ShiftedHigherLevelSummary,
+}
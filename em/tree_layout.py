@@ -0,0 +1,127 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from em.em_tree import get_children
+
+
+class TreeLayout:
+    """
+    Flat, read-only numbering of an EM tree.
+
+    Nodes are numbered in pre-order, so the subtree of node n is the node range [n, subtree_end[n]).
+    The index strings of all nodes are deduplicated into `strings`. `occurrences` holds the string ids of the own index
+    content of every node, also in pre-order. The full (chained) index content of node n is therefore the contiguous
+    range occurrences[occ_start[n]:occ_end[n]], its own content is occurrences[occ_start[n]:own_end[n]].
+
+    Layouts can also be restored from their arrays without the tree (see em.history_store). Nodes of such a layout are
+    numbered with register() as they are loaded.
+    """
+
+    ARRAYS = ('parents', 'child_index', 'depths', 'occ_start', 'own_end', 'occ_end', 'subtree_end', 'occurrences')
+
+    def __init__(self, root: Any, children_extractor: Callable[[Any], Optional[List[Any]]] = get_children):
+        super().__init__()
+        self.root = root
+        self.nodes: Union[List[Any], Dict[int, Any]] = []  # By number. Only the registered ones if restored
+        self.strings: List[str] = []
+        string_ids: Dict[str, int] = {}
+        parents = []
+        child_index = []  # Position within the children of the parent
+        depths = []
+        occ_start = []
+        own_end = []
+        occurrences = []
+
+        stack = [(root, -1, 0, 0)]
+        while stack:
+            node, parent, i, depth = stack.pop()
+            self.nodes.append(node)
+            parents.append(parent)
+            child_index.append(i)
+            depths.append(depth)
+            occ_start.append(len(occurrences))
+            for s in node.own_index_content:
+                if not s:
+                    continue
+                if s not in string_ids:
+                    string_ids[s] = len(self.strings)
+                    self.strings.append(s)
+                occurrences.append(string_ids[s])
+            own_end.append(len(occurrences))
+            n = len(self.nodes) - 1
+            children = children_extractor(node) or []
+            stack.extend((children[i], n, i, depth + 1) for i in reversed(range(len(children))))
+
+        self.parents = np.array(parents, dtype=np.int32)
+        self.child_index = np.array(child_index, dtype=np.int32)
+        self.depths = np.array(depths, dtype=np.int32)
+        self.occ_start = np.array(occ_start, dtype=np.int32)
+        self.own_end = np.array(own_end, dtype=np.int32)
+        self.occurrences = np.array(occurrences, dtype=np.int32)
+
+        # Subtree sizes, accumulated bottom-up. Parents always have a smaller number than their children.
+        sizes = np.ones(len(self.nodes), dtype=np.int32)
+        for n in range(len(self.nodes) - 1, 0, -1):
+            sizes[self.parents[n]] += sizes[n]
+        self.subtree_end = np.arange(len(self.nodes), dtype=np.int32) + sizes
+        self.occ_end = np.append(self.occ_start, len(self.occurrences))[self.subtree_end].astype(np.int32)
+
+        self._number_of = {id(node): n for n, node in enumerate(self.nodes)}
+
+    @classmethod
+    def from_arrays(cls, strings: Sequence[str], arrays: Dict[str, np.ndarray]) -> 'TreeLayout':
+        layout = cls.__new__(cls)
+        layout.root = None
+        layout.nodes = {}
+        layout.strings = strings
+        for name in cls.ARRAYS:
+            setattr(layout, name, arrays[name])
+        layout._number_of = {}
+        return layout
+
+    def register(self, node: Any, n: int):
+        self.nodes[n] = node
+        self._number_of[id(node)] = n
+
+    def __len__(self):
+        return len(self.parents)
+
+    def number_of(self, node: Any) -> Optional[int]:
+        return self._number_of.get(id(node))
+
+    def index_content_ids(self, n: int) -> np.ndarray:
+        # A view, not a copy
+        return self.occurrences[self.occ_start[n]:self.occ_end[n]]
+
+    def segment_max(self, string_values: np.ndarray, numbers: Sequence[int], empty=0) -> np.ndarray:
+        # Max of string_values over the full index content of each node, `empty` for nodes without any content
+        numbers = np.asarray(numbers, dtype=np.int64)
+        lengths = (self.occ_end[numbers] - self.occ_start[numbers]).astype(np.int64)
+        result = np.full(len(numbers), empty, dtype=string_values.dtype)
+        non_empty = lengths > 0
+        if non_empty.any():
+            ids = np.concatenate([self.occurrences[self.occ_start[n]:self.occ_end[n]] for n in numbers[non_empty]])
+            starts = np.cumsum(lengths[non_empty]) - lengths[non_empty]
+            result[non_empty] = np.maximum.reduceat(string_values[ids], starts)
+        return result
+
+    def path_to(self, n: int, ancestor: int = 0) -> Tuple[int, ...]:
+        # Child indices leading from the ancestor down to node n
+        path = []
+        while n != ancestor:
+            path.append(int(self.child_index[n]))
+            n = self.parents[n]
+        return tuple(reversed(path))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+
+def layout_of(root: Any) -> TreeLayout:
+    # Histories opened from a history store come with the layout of the whole tree, without loading it
+    store = getattr(root, '_store', None)
+    if store is not None and store.root is root:
+        return store.layout
+    return TreeLayout(root)
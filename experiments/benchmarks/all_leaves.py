@@ -0,0 +1,85 @@
+import argparse
+import time
+import tracemalloc
+from itertools import chain
+from random import Random
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _reference_all_leaves(node: ExpandableTreeNode):
+    # The previous implementation: the concatenated leaf lists of the children, materialized at every level
+    if len(node.children) == 0:
+        return [node._wrapped]
+    return list(chain(*(_reference_all_leaves(c) for c in node.children)))
+
+
+def _lazy_all_leaves(history):
+    leaves = ExpandableTreeNode(history, get_children, _no_similarity).all_leaves.children
+    len(leaves), leaves[-1]  # The leaf counts are computed on first use
+    return leaves
+
+
+def _measure(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    # Again for the memory, tracemalloc slows down everything
+    tracemalloc.start()
+    result = fn()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'  {label}: {elapsed * 1000:.0f}ms, {allocated / 1e6:.1f}MB allocated')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Building and accessing all_leaves of a history')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    print(f'all_leaves of {args.days} days x {args.goals_per_day} goals, with len() and the last leaf:')
+    expected = _measure('concatenated lists', lambda: _reference_all_leaves(
+        ExpandableTreeNode(history, get_children, _no_similarity)))
+    leaves = _measure('lazy sequence', lambda: _lazy_all_leaves(history))
+    assert len(leaves) == len(expected) and leaves[-1] is expected[-1]
+    print(f'{len(leaves)} leaves')
+
+    rng = Random(0)
+    indices = [rng.randrange(len(leaves)) for _ in range(10000)]
+    start = time.perf_counter()
+    assert all(leaves[i] is expected[i] for i in indices)
+    print(f'random access: {(time.perf_counter() - start) / len(indices) * 1e6:.1f}us per leaf')
+    start = time.perf_counter()
+    assert leaves[1000:1100] == expected[1000:1100]
+    print(f'slice of 100 leaves: {(time.perf_counter() - start) * 1e6:.0f}us')
+    start = time.perf_counter()
+    assert all(a is b for a, b in zip(leaves, expected))
+    print(f'iteration: {(time.perf_counter() - start) / len(leaves) * 1e6:.2f}us per leaf')
+
+    day = history.children[len(history.children) // 2]
+    start = time.perf_counter()
+    found = leaves.index_range(*day.range)
+    print(f'leaves of one day by time range: {(time.perf_counter() - start) * 1e6:.0f}us, {len(found)} leaves')
+    assert [leaves[i] for i in found] == _reference_all_leaves(ExpandableTreeNode(day, get_children, _no_similarity))
+
+    all_leaves = ExpandableTreeNode(history, get_children, _no_similarity).all_leaves
+    len(all_leaves.children)
+    start = time.perf_counter()
+    all_leaves.expand(day.range[0].date())
+    print(f'all_leaves.expand(date) of that day: {(time.perf_counter() - start) * 1000:.1f}ms')
+    assert all_leaves._expanded_indices() == list(found)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import time
+from random import Random
+from statistics import median, mean
+
+import torch
+
+from em.em_tree import get_children
+from em.tree_layout import TreeLayout
+from llm_emv.interactive_tree import search_similarity_to_filter_fn
+from llm_emv.search_index import SearchEmbeddingIndex, ApproximateLeafSearch
+from test.synthetic_history import make_synthetic_history, HashingEmbedding, _SPEECH_WORDS
+
+
+def _timed_searches(search_fn, queries, leaves):
+    results, timings = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(set(search_fn(q, leaves)))
+        timings.append(time.perf_counter() - start)
+    return results, median(timings)
+
+
+def _top_k_recall(approximate_scores, exact_scores, k):
+    # Fraction of the approximate top k that are within the exact top k. Robust to ties, which are frequent
+    # since many leaves share the same strings.
+    threshold = torch.topk(exact_scores, k).values[-1]
+    return (exact_scores[torch.topk(approximate_scores, k).indices] >= threshold - 1e-6).float().mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the approximate flat all_leaves search '
+                                                 'compared to the exact one')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--goals-per-day', type=int, default=200)
+    parser.add_argument('--speech-fraction', type=float, default=0.3)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--backends', type=str, nargs='+', default=['exact', 'ivf'])
+    parser.add_argument('--n-probes', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--n-candidates', type=int, default=256)
+    parser.add_argument('--top-p', type=float, default=0.3)
+    parser.add_argument('--min-cos-sim', type=float, default=0.2)
+    parser.add_argument('-k', type=int, default=100, help='For the top-k ranking recall')
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day, speech_fraction=args.speech_fraction)
+    layout = TreeLayout(history)
+    leaves = [n for n in layout.nodes if not get_children(n)]
+    index = SearchEmbeddingIndex(layout, HashingEmbedding(bag_of_words=True))
+    print(f'{len(leaves)} leaves, {len(layout.strings)} unique strings')
+
+    rng = Random(1)
+    queries = [' '.join(rng.choices(_SPEECH_WORDS, k=rng.randint(1, 4))) for _ in range(args.queries)]
+    filter_kwargs = dict(top_p=args.top_p, min_cos_sim=args.min_cos_sim)
+
+    exact_search = search_similarity_to_filter_fn(index.similarities, **filter_kwargs)
+    exact_search(queries[0], leaves)  # Embeds all strings
+    exact_results, exact_latency = _timed_searches(exact_search, queries, leaves)
+    print(f'{"exact path":<24} latency {exact_latency * 1000:7.1f}ms, '
+          f'{sum(map(len, exact_results)) / len(queries):.0f} results per query')
+
+    for backend in args.backends:
+        for n_probe in args.n_probes if backend != 'exact' else [None]:
+            start = time.perf_counter()
+            leaf_search = ApproximateLeafSearch(index, leaves, n_candidates=args.n_candidates, backend=backend,
+                                                n_probe=n_probe or 8)
+            build_time = time.perf_counter() - start
+            ann_search = search_similarity_to_filter_fn(leaf_search.similarities, **filter_kwargs)
+            results, latency = _timed_searches(ann_search, queries, leaves)
+            top_k_recall = mean(_top_k_recall(leaf_search.similarities(q, leaves), index.similarities(q, leaves),
+                                              args.k) for q in queries)
+            recall = (sum(len(r & e) for r, e in zip(results, exact_results)) /
+                      max(1, sum(len(e) for e in exact_results)))
+            precision = (sum(len(r & e) for r, e in zip(results, exact_results)) /
+                         max(1, sum(len(r) for r in results)))
+            name = backend if n_probe is None else f'{backend} n_probe={n_probe}'
+            print(f'{name:<24} latency {latency * 1000:7.1f}ms, top-{args.k} recall {top_k_recall:.3f}, '
+                  f'search result recall {recall:.3f}, precision {precision:.3f} (built in {build_time:.1f}s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import time
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collapsing a fully expanded tree and counting its expanded nodes')
+    parser.add_argument('--days', type=int, default=20)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    collapsed = repr(tree)
+
+    tree._set_expanded(True, recursive=True)
+    ms, num_expanded = _timed(lambda: len(tree.expanded_paths()))
+    print(f'{num_expanded} expanded nodes: expanded_paths {ms:.1f}ms', end=', ')
+    ms, slots = _timed(lambda: tree._expansion_state.expanded_slots())
+    print(f'expanded slots of the state array {ms:.2f}ms')
+    assert len(slots) == num_expanded
+
+    # Previous collapse_deep: every node of the tree, a filter call per child
+    ms, _ = _timed(lambda: tree._set_expanded(False, recursive=True))
+    print(f'collapse_deep, recursive: {ms:.1f}ms')
+    tree._set_expanded(True, recursive=True)
+    ms, _ = _timed(tree.collapse_deep)
+    print(f'collapse_deep, new epoch: {ms:.3f}ms')
+    assert len(tree.expanded_paths()) == 0 and repr(tree) == collapsed
+
+
+if __name__ == '__main__':
+    main()
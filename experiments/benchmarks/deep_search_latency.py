@@ -0,0 +1,40 @@
+import argparse
+import time
+from statistics import median
+
+from em.tree_layout import TreeLayout
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import make_synthetic_history, HashingEmbedding
+
+_QUERIES = ['milk', 'when did you load the dishwasher?', 'Pickup(Mug)', 'what did you do after handing over the cup?']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of scoring all nodes of a large tree with deep_search')
+    parser.add_argument('--days', type=int, default=50)
+    parser.add_argument('--goals-per-day', type=int, default=220)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    start = time.perf_counter()
+    layout = TreeLayout(history)
+    print(f'{len(layout)} nodes, {len(layout.strings)} unique strings, {len(layout.occurrences)} occurrences, '
+          f'layout built in {time.perf_counter() - start:.2f}s')
+
+    index = SearchEmbeddingIndex(layout, HashingEmbedding())
+    start = time.perf_counter()
+    index.deep_search(_QUERIES[0], history, args.k)
+    print(f'first query (embeds all strings): {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    timings = []
+    for i in range(args.repeats):
+        start = time.perf_counter()
+        paths = index.deep_search(_QUERIES[i % len(_QUERIES)], history, args.k)
+        timings.append(time.perf_counter() - start)
+    print(f'deep_search, median of {args.repeats}: {median(timings) * 1000:.1f}ms, e.g. {paths}')
+
+
+if __name__ == '__main__':
+    main()
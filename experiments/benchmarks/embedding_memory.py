@@ -0,0 +1,50 @@
+import argparse
+import pickle
+import time
+
+from em.em_tree import get_children
+from em.tree_layout import TreeLayout
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import HashingEmbedding
+
+
+def _iter_nodes(node):
+    yield node
+    for c in get_children(node) or []:
+        yield from _iter_nodes(c)
+
+
+def _mb(num_bytes):
+    return f'{num_bytes / 2 ** 20:.1f} MB'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search embedding memory: per-node caches vs. one shared matrix')
+    parser.add_argument('history', type=str, nargs='?', default='data/armarx_lt_mem/2024-07-a7a-summary.pkl')
+    parser.add_argument('--dim', type=int, default=768, help='Embedding dimension, 768 for multi-qa-mpnet-base-cos-v1')
+    args = parser.parse_args()
+
+    with open(args.history, 'rb') as f:
+        history = pickle.load(f)
+
+    # Per-node caches: every node with children stored an embedding row for each (non-empty) string of its
+    # chained index content, i.e. each leaf string once per ancestor
+    nodes = list(_iter_nodes(history))
+    rows_per_node = [sum(1 for s in n.index_content if s) for n in nodes]
+    root_children_rows = sum(sum(1 for s in c.index_content if s) for c in get_children(history))
+    print(f'nodes: {len(nodes)}')
+    print(f'per-node caches, after warm-up (root children): {root_children_rows} rows, '
+          f'{_mb(root_children_rows * args.dim * 4)}')
+    print(f'per-node caches, all nodes searched:            {sum(rows_per_node)} rows, '
+          f'{_mb(sum(rows_per_node) * args.dim * 4)}')
+
+    start = time.perf_counter()
+    index = SearchEmbeddingIndex(TreeLayout(history), HashingEmbedding(dim=args.dim))
+    index.similarities('', get_children(history))
+    print(f'shared matrix ({time.perf_counter() - start:.1f}s to build):'
+          f'{"":>19}{len(index.layout.strings)} rows, {_mb(index.nbytes)} '
+          f'(incl. {_mb(index.layout.nbytes)} layout)')
+
+
+if __name__ == '__main__':
+    main()
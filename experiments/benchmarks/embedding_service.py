@@ -0,0 +1,47 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+from lmp.embedding_service import EmbeddingService
+from test.synthetic_history import HashingEmbedding, _SPEECH_WORDS
+
+
+def _direct(model, queries):
+    for q in queries:
+        model.encode([q])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forward passes and latency of concurrent single-text encode calls, '
+                                                 'directly vs. through the coalescing EmbeddingService')
+    parser.add_argument('--callers', type=int, default=8)
+    parser.add_argument('--queries-per-caller', type=int, default=50)
+    parser.add_argument('--distinct-queries', type=int, default=100)
+    parser.add_argument('--encode-latency-ms', type=float, default=10.0,
+                        help='Simulated per forward pass latency of the hashing embedding')
+    parser.add_argument('--max-batch-wait-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    rng = Random(0)
+    vocabulary = [' '.join(rng.choices(_SPEECH_WORDS, k=4)) for _ in range(args.distinct_queries)]
+    per_caller = [[rng.choice(vocabulary) for _ in range(args.queries_per_caller)] for _ in range(args.callers)]
+
+    for name in ('direct', 'service'):
+        model = HashingEmbedding(encode_latency_s=args.encode_latency_ms / 1000)
+        if name == 'service':
+            service = EmbeddingService(model, max_batch_wait_s=args.max_batch_wait_ms / 1000)
+            fn = lambda queries: [service.encode([q]) for q in queries]
+        else:
+            fn = lambda queries: _direct(model, queries)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.callers) as pool:
+            list(pool.map(fn, per_caller))
+        print(f'{name:<8} {time.perf_counter() - start:6.2f}s, {model.num_calls} forward passes')
+        if name == 'service':
+            for k, v in service.stats().items():
+                print(f'  {k}: {v:.3f}' if isinstance(v, float) else f'  {k}: {v}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import time
+from datetime import timedelta
+from statistics import median
+
+import torch
+
+from em.em_tree import HigherLevelSummary, get_children
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_goals
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of expand() with date/datetime filters on a wide node')
+    parser.add_argument('--child-counts', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.child_counts:
+        history = HigherLevelSummary('', make_synthetic_goals(n))
+        tree = ExpandableTreeNode(history, get_children, _no_similarity)
+        middle = history.children[n // 2].range[0]
+        queries = {
+            'date': (middle.date(),),
+            'datetime (minute)': (middle.replace(second=0, microsecond=0),),
+            'datetime (hour)': (middle.replace(minute=0, second=0, microsecond=0),),
+            'datetime range': (middle, middle + timedelta(minutes=10)),
+            'date range': (middle.date(), middle.date() + timedelta(days=1)),
+        }
+        print(f'{n} children:')
+        for label, query in queries.items():
+            timings = []
+            for _ in range(args.repeats):
+                tree.collapse()
+                start = time.perf_counter()
+                tree.expand(*query)
+                timings.append(time.perf_counter() - start)
+            expanded = sum(tree._children_states)
+            print(f'  expand({label}): {median(timings) * 1000:.2f}ms, {expanded} children expanded')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import pickle
+from pathlib import Path
+from random import Random
+from statistics import mean
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.history_diff import HistoryStateMessages
+from llm_emv.interactive_tree import ExpandableTreeNode, recursive_apply
+from llm_emv.token_budget import estimate_tokens
+
+ARMARX_DIR = Path(__file__).parents[2] / 'data' / 'armarx_lt_mem'
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _set_simplified_repr(node):
+    node._simplified_repr = True
+
+
+def _inner_child(node, rng: Random):
+    indices = [i for i, c in enumerate(node.children) if len(c.children) > 0]
+    return rng.choice(indices) if indices else None
+
+
+def _investigation(tree, rng: Random):
+    # Scripted rounds of a deep investigation, like the agent: open a day, drill down to scenes, switch goals,
+    # then look at a second day
+    yield tree.expand
+    for _ in range(2):
+        day_i = _inner_child(tree, rng)
+        day = tree.children[day_i]
+        yield lambda: tree.expand(day_i)
+        yield day.expand
+        node = day
+        for _ in range(3):
+            i = _inner_child(node, rng)
+            if i is None:
+                break
+            node = node.children[i]
+            yield node.expand
+        i = _inner_child(day, rng)
+        yield lambda: day.collapse_all_but(i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='History state tokens per question, full views vs. diffs')
+    parser.add_argument('--history', type=Path, default=ARMARX_DIR / '2024-07-a7a-summary.pkl')
+    parser.add_argument('--questions', type=Path, default=ARMARX_DIR / 'qa.json')
+    parser.add_argument('--resync-interval', type=int, default=4)
+    args = parser.parse_args()
+
+    history = pickle.loads(args.history.read_bytes())
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    recursive_apply(tree, _set_simplified_repr)
+    questions = json.loads(args.questions.read_text())
+
+    # Every round sends the whole conversation again. State messages of the diff mode stay in the conversation and
+    # are part of all later prompts, but only the newest one is new to the (prefix-cached) prompt.
+    # The full view of the normal mode is always new, it follows the newest command and result
+    full_tokens, diff_tokens, diff_new_tokens, rounds = [], [], [], []
+    states = HistoryStateMessages(repr, args.resync_interval)
+    for question in questions:
+        tree.collapse_deep()
+        states.reset()
+        full, diff, diff_new, position = 0, 0, 0, 0
+        for action in _investigation(tree, Random(question['id'])):
+            action()
+            position += 1
+            full += estimate_tokens(repr(tree))
+            messages = states.update(tree, position)
+            diff += sum(estimate_tokens(text) for _, _, text in messages)
+            diff_new += estimate_tokens(messages[-1][2])
+        full_tokens.append(full)
+        diff_tokens.append(diff)
+        diff_new_tokens.append(diff_new)
+        rounds.append(position)
+
+    print(f'{len(questions)} questions, {mean(rounds):.1f} rounds each, resync after {args.resync_interval} diffs')
+    print(f'history state tokens per question, all prompts: full view {mean(full_tokens):.0f}, '
+          f'diffs {mean(diff_tokens):.0f}')
+    print(f'  not in the cached prompt prefix: full view {mean(full_tokens):.0f}, diffs {mean(diff_new_tokens):.0f}')
+
+
+if __name__ == '__main__':
+    main()
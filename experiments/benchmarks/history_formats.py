@@ -0,0 +1,83 @@
+import argparse
+import json
+import pickle
+import time
+from pathlib import Path
+from random import Random
+from statistics import mean
+
+import torch
+
+from em.em_tree import get_children
+from experiments.benchmarks.history_diff import _investigation
+from llm_emv.interactive_tree import ExpandableTreeNode, recursive_apply
+from llm_emv.token_budget import estimate_tokens
+from llm_emv.tree_renderers import HISTORY_FORMATS, render_json_lines
+
+# Only the ArmarX histories are bundled as trees. data/teach/test_set_*.pkl are QA sets over TEACh episodes, whose
+# trees are built from the TEACh dataset itself (--teach-base of llm_emv.eval)
+ARMARX_DIR = Path(__file__).parents[2] / 'data' / 'armarx_lt_mem'
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _set_simplified_repr(node):
+    node._simplified_repr = True
+
+
+def _formats(tree):
+    # The agent renders the simplified repr, the normal one is what repr() of a node gives
+    def full_repr(t):
+        recursive_apply(t, lambda n: setattr(n, '_simplified_repr', False))
+        result = repr(t)
+        recursive_apply(t, _set_simplified_repr)
+        return result
+
+    return {'repr (not simplified)': full_repr, **HISTORY_FORMATS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prompt tokens of the history formats on the bundled histories')
+    parser.add_argument('--histories', type=Path, nargs='+',
+                        default=[ARMARX_DIR / '2024-07-a7a-summary.pkl', ARMARX_DIR / '2024-07-a7a-predef.pkl'])
+    parser.add_argument('--questions', type=Path, default=ARMARX_DIR / 'qa.json')
+    parser.add_argument('--tiktoken-encoding', help='e.g. o200k_base, instead of estimating 4 characters per token')
+    args = parser.parse_args()
+
+    count_tokens = estimate_tokens
+    if args.tiktoken_encoding:
+        import tiktoken
+        encoding = tiktoken.get_encoding(args.tiktoken_encoding)
+        count_tokens = lambda text: len(encoding.encode(text))
+    questions = json.loads(args.questions.read_text())
+
+    for path in args.histories:
+        tree = ExpandableTreeNode(pickle.loads(path.read_bytes()), get_children, _no_similarity)
+        recursive_apply(tree, _set_simplified_repr)
+        formats = _formats(tree)
+        print(f'{path.name}:')
+
+        # The history state of every round of scripted investigations, see experiments.benchmarks.history_diff
+        round_tokens = {name: [] for name in formats}
+        for question in questions:
+            tree.collapse_deep()
+            for action in _investigation(tree, Random(question['id'])):
+                action()
+                for name, render in formats.items():
+                    round_tokens[name].append(count_tokens(render(tree)))
+                num_nodes = len(tree.expanded_paths()) + 1
+                assert sum('"path"' in line for line in render_json_lines(tree).splitlines()) == num_nodes
+
+        tree._set_expanded(True, recursive=True)
+        print(f'  {"format":<22} {"per round":>10} {"fully expanded":>15} {"render time":>12}')
+        for name, render in formats.items():
+            start = time.perf_counter()
+            rendered = render(tree)
+            ms = (time.perf_counter() - start) * 1000
+            print(f'  {name:<22} {mean(round_tokens[name]):>10.0f} {count_tokens(rendered):>15} {ms:>10.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import gc
+import pickle
+import resource
+import time
+import tracemalloc
+
+from em.em_tree import get_children, SceneGraphInstant, interning
+
+
+def _count_scenes(node):
+    if isinstance(node, SceneGraphInstant):
+        return 1
+    return sum(_count_scenes(c) for c in get_children(node) or [])
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory used by loaded histories')
+    parser.add_argument('--history', default='data/armarx_lt_mem/2024-07-a7a-summary.pkl')
+    parser.add_argument('--copies', type=int, default=6,
+                        help='Load the history this many times, to simulate several months of data')
+    args = parser.parse_args()
+
+    with open(args.history, 'rb') as f:
+        data = f.read()
+
+    gc.collect()
+    rss_before = _max_rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with interning():  # Like one history of several months, whose values are shared in one table
+        histories = [pickle.loads(data) for _ in range(args.copies)]
+    load_s = time.perf_counter() - start
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    scenes = sum(_count_scenes(h) for h in histories)
+    print(f'{args.copies} copies, {scenes} scenes, loaded in {load_s:.2f}s')
+    print(f'allocated: {traced / 1e6:.1f}MB ({traced / scenes:.0f} bytes per scene)')
+    print(f'max RSS growth: {_max_rss_mb() - rss_before:.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import pickle
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from em.em_tree import get_children
+from em.history_store import write_history_store, open_history
+from em.tree_layout import layout_of
+from llm_emv.interactive_tree import ExpandableTreeNode
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _rss_mb():
+    # Current RSS. ru_maxrss would include the peak of the parent process, which is kept across exec on Linux
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1e6
+
+
+def _worker(path: Path):
+    # Startup like llm_emv: load the history, build the search layout and the interactive tree, answer by expanding
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    history = pickle.loads(path.read_bytes()) if path.suffix == '.pkl' else open_history(path)
+    load_s = time.perf_counter() - start
+    index = SearchEmbeddingIndex(layout_of(history), None)
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    startup_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    day = tree.children[len(tree.children) // 2]
+    tree.expand(day.range[0].date())
+    day.expand(0)
+    rendered = repr(tree)
+    expand_s = time.perf_counter() - start
+    print(f'{path.suffix}: startup {startup_s * 1000:.1f}ms (load {load_s * 1000:.1f}ms), '
+          f'expanding one goal {expand_s * 1000:.1f}ms, RSS growth {_rss_mb() - rss_before:.0f}MB, '
+          f'{len(index.layout)} nodes, {len(rendered)} characters rendered')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time and memory of pickled histories vs. history stores')
+    parser.add_argument('--days', type=int, default=200)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    parser.add_argument('--worker', type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        _worker(args.worker)
+        return
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_path, store_path = Path(tmp) / 'history.pkl', Path(tmp) / 'history.emvh'
+        pickle_path.write_bytes(pickle.dumps(history))
+        start = time.perf_counter()
+        write_history_store(history, store_path)
+        print(f'{args.days} days x {args.goals_per_day} goals: pickle {pickle_path.stat().st_size / 1e6:.1f}MB, '
+              f'store {store_path.stat().st_size / 1e6:.1f}MB, written in {time.perf_counter() - start:.2f}s')
+        del history
+        # Fresh processes, so that the RSS of one does not hide the other
+        for path in (pickle_path, store_path):
+            subprocess.run([sys.executable, '-m', 'experiments.benchmarks.history_store', '--worker', str(path)],
+                           check=True)
+
+
+if __name__ == '__main__':
+    main()
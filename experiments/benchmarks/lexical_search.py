@@ -0,0 +1,66 @@
+import argparse
+import pickle
+import time
+from statistics import mean
+
+from em.em_tree import get_children
+from em.tree_layout import TreeLayout
+from llm_emv.interactive_tree import search_similarity_to_filter_fn
+from llm_emv.lexical_index import LexicalIndex
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import HashingEmbedding
+
+_QUERIES = ['milk', 'LoadDishwasher', 'sideboard', 'cup', 'Pickup(Mug)', 'bring the milk to the human',
+            'when did you load the dishwasher?', 'what did you see on the table',
+            # Action names of the widest node of the bundled history
+            'ShapeHand', 'wave', 'HomePose', 'SetCustomGazeTarget', 'move joints']
+
+
+def _measure(search_fn, items, close_match, embedding_fn, repeats):
+    timings = []
+    calls_before = embedding_fn.num_calls
+    for i in range(repeats):
+        start = time.perf_counter()
+        search_fn(_QUERIES[i % len(_QUERIES)], items, close_match=close_match)
+        timings.append(time.perf_counter() - start)
+    return mean(timings), (embedding_fn.num_calls - calls_before) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search latency and encoder calls with and without the BM25 stage')
+    parser.add_argument('history', type=str, nargs='?', default='data/armarx_lt_mem/2024-07-a7a-summary.pkl')
+    parser.add_argument('--encode-latency-ms', type=float, default=10.0,
+                        help='Simulated per-call encoder latency for the hashing embedding')
+    parser.add_argument('--repeats', type=int, default=40)
+    args = parser.parse_args()
+
+    with open(args.history, 'rb') as f:
+        history = pickle.load(f)
+    layout = TreeLayout(history)
+    embedding_fn = HashingEmbedding(bag_of_words=True, encode_latency_s=args.encode_latency_ms / 1000)
+    index = SearchEmbeddingIndex(layout, embedding_fn)
+    index.ensure_embedded(layout.occurrences)
+    start = time.perf_counter()
+    lexical = LexicalIndex(layout)
+    lexical.string_scores('')  # Built on the first search
+    print(f'BM25 index over {len(layout.strings)} strings built in {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    items = [n for n in layout.nodes if get_children(n) and len(get_children(n)) > 20]
+    items = max((get_children(n) for n in items), key=len)  # The node with the most children
+    embedding_only = search_similarity_to_filter_fn(index.similarities)
+    hybrid = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search)
+    lexical_only = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search,
+                                                  close_match_lexical_only=True)
+    print(f'searching {len(items)} children')
+    for close_match in (True, False):
+        variants = [('embedding only', embedding_only), ('hybrid', hybrid)]
+        if close_match:
+            variants.append(('lexical only', lexical_only))
+        for name, fn in variants:
+            latency, calls = _measure(fn, items, close_match, embedding_fn, args.repeats)
+            print(f'{"close_match" if close_match else "ordinary":<12} {name:<15} {latency * 1000:7.2f}ms, '
+                  f'{calls:.2f} encoder calls per search')
+
+
+if __name__ == '__main__':
+    main()
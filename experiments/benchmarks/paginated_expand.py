@@ -0,0 +1,55 @@
+import argparse
+import time
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode
+from llm_emv.token_budget import estimate_tokens
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expanding and rendering one page of a flat list of all leaves')
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    parser.add_argument('--days', type=int, nargs='+', default=[3, 30, 170])
+    parser.add_argument('--page', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    for days in args.days:
+        history = make_synthetic_history(days, args.goals_per_day)
+        leaves = ExpandableTreeNode(history, get_children, _no_similarity).all_leaves
+        print(f'{len(leaves)} leaves:')
+
+        # Previously, expand() expanded and rendered every child
+        ms, _ = _timed(lambda: leaves._set_expanded(True))
+        ms_render, rendered = _timed(lambda: repr(leaves))
+        print(f'  expand all: {ms:.1f}ms, render {ms_render:.1f}ms, {estimate_tokens(rendered)} tokens')
+
+        leaves.collapse()
+        ms, _ = _timed(lambda: leaves.expand(page=args.page, page_size=args.page_size))
+        ms_render, rendered = _timed(lambda: repr(leaves))
+        print(f'  expand(page={args.page}, page_size={args.page_size}): {ms:.2f}ms, render {ms_render:.2f}ms, '
+              f'{estimate_tokens(rendered)} tokens')
+        ms, _ = _timed(leaves.collapse)
+        print(f'  collapse: {ms:.2f}ms')
+
+    print('Rendering of the last page:')
+    leaves.collapse().expand(page=args.page, page_size=args.page_size)
+    rendered = repr(leaves)
+    print(rendered[:100] + ' (...) ' + rendered[-70:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import pickle
+import time
+from statistics import median
+
+import torch
+
+from em.em_tree import get_children, HigherLevelSummary, GoalBasedSummary
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_history, make_synthetic_goals
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _timed(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return median(timings) * 1000, result
+
+
+def _all_inner_nodes(node):
+    children = get_children(node)
+    if children:
+        yield node
+        for c in children:
+            yield from _all_inner_nodes(c)
+
+
+def _format_context(items):
+    # Same as LLMBasedSummarizer.format_context, which can't be imported without langchain
+    return '\n'.join(
+        f'{i}.\t{item.range[0]} - {item.range[1]}: ' + item.nl_summary.replace("\n", "\n\t")
+        for i, item in enumerate(items)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time to render a fully expanded EM tree and the summarizer context')
+    parser.add_argument('--history', help='Pickled history to render instead of a synthetic one')
+    parser.add_argument('--days', type=int, default=20)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.history:
+        with open(args.history, 'rb') as f:
+            history = pickle.load(f)
+    else:
+        history = make_synthetic_history(args.days, args.goals_per_day, speech_fraction=0.1)
+
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    tree._set_expanded(True, recursive=True)
+
+    first_ms, rendered = _timed(lambda: repr(tree), 1)
+    print(f'full tree repr ({len(rendered)} chars): first {first_ms:.1f}ms')
+    ms, _ = _timed(lambda: repr(tree), args.repeats)
+    print(f'full tree repr, unchanged, median of {args.repeats}: {ms:.3f}ms')
+
+    # Agent loop: a local expand or collapse deep in the tree, then the whole tree is rendered again
+    goal = tree.children[len(tree.children) // 2].children[0]
+
+    def toggle_and_render():
+        goal._set_expanded(not goal._children_states[0], 0)
+        return repr(tree)
+
+    ms, _ = _timed(toggle_and_render, args.repeats)
+    print(f'full tree repr after a local expand/collapse, median of {args.repeats}: {ms:.1f}ms')
+    goal.expand(0)
+    assert repr(tree) == rendered
+
+    nodes = list(_all_inner_nodes(history))
+    ms, _ = _timed(lambda: [(n.range, n.nl_summary) for n in nodes], args.repeats)
+    print(f'range and nl_summary of all {len(nodes)} inner nodes, median of {args.repeats}: {ms:.1f}ms')
+    ms, context = _timed(lambda: [_format_context(day.children) for day in history.children
+                                  if isinstance(day, HigherLevelSummary)], args.repeats)
+    print(f'format_context of all days, median of {args.repeats}: {ms:.1f}ms')
+    ms, content = _timed(lambda: history.index_content, args.repeats)
+    print(f'root index_content ({len(content)} strings), median of {args.repeats}: {ms:.1f}ms')
+
+    # Extending the history must be visible in the next render
+    last_day = history.children[-1]
+    last_day.children += make_synthetic_goals(1, start=last_day.range[1], seed=1)
+    assert isinstance(last_day.children[-1], GoalBasedSummary)
+    ms, _ = _timed(lambda: history.range, 1)
+    print(f'root range after extending the last day: {ms:.3f}ms, {history.range[1]}')
+    assert history.range[1] == last_day.children[-1].range[1]
+
+
+if __name__ == '__main__':
+    main()
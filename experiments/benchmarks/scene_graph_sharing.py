@@ -0,0 +1,77 @@
+import argparse
+import gc
+import pickle
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from random import Random
+
+from em.em_tree import HigherLevelSummary, EventBasedSummary, SceneGraphInstant, RawDataInstant, ObjectNode, \
+    interning, unpickle_history
+from test.synthetic_history import _OBJECT_CLASSES, _ACTIONS
+
+_STATES = [None, 'open', 'dirty', 'toggled', 'filled', 'cooked']
+
+
+@interning()
+def make_teach_like_history(n_episodes: int, steps_per_episode: int, n_objects=40, seed=0) -> HigherLevelSummary:
+    """
+    Like load_teach_episode: every interaction step builds new objects and relations lists of the whole room,
+    although consecutive steps differ by at most one object state.
+    """
+    rng = Random(seed)
+    episodes = []
+    ts = datetime(2024, 6, 1, 8)
+    for e in range(n_episodes):
+        classes = [rng.choice(_OBJECT_CLASSES) for _ in range(n_objects)]
+        states = [None] * n_objects
+        relations = [(i, rng.randrange(n_objects), rng.choice(['in/on', 'inside'])) for i in range(n_objects // 2)]
+        scenes = []
+        for step in range(steps_per_episode):
+            ts += timedelta(seconds=rng.randint(1, 10))
+            if rng.random() < 0.5:
+                states[rng.randrange(n_objects)] = rng.choice(_STATES)
+            scenes.append(SceneGraphInstant(
+                objects=[ObjectNode(c, f'{c}_{i}', s) for i, (c, s) in enumerate(zip(classes, states))],
+                relations=list(relations),
+                raw=RawDataInstant(ts, current_action=rng.choice(_ACTIONS), current_goal=f'Episode {e}'),
+            ))
+        events = [EventBasedSummary(scenes[i:i + 3]) for i in range(0, len(scenes), 3)]
+        episodes.append(HigherLevelSummary(f'Episode {e}', events))
+    return HigherLevelSummary('', episodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pickle size, load time and memory of TEACh-like histories')
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    history = make_teach_like_history(args.episodes, args.steps)
+    start = time.perf_counter()
+    data = pickle.dumps(history)
+    print(f'{args.episodes} episodes x {args.steps} steps: pickle {len(data) / 1e6:.1f}MB, '
+          f'dumped in {time.perf_counter() - start:.2f}s')
+    del history
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = unpickle_history(data)
+    load_s = time.perf_counter() - start
+    gc.collect()
+    print(f'load: {load_s:.2f}s, loaded history allocates {tracemalloc.get_traced_memory()[0] / 1e6:.1f}MB')
+    tracemalloc.stop()
+    del loaded
+
+    timings = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        unpickle_history(data)
+        timings.append(time.perf_counter() - start)
+    print(f'load without tracemalloc: {min(timings):.2f}s (best of {args.repeats})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import time
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+
+from em.em_tree import SceneGraphInstant, get_children
+from em.scene_timeline import SceneTimeline
+from test.synthetic_history import make_synthetic_history
+
+_MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES = timedelta(minutes=2)
+
+
+def _reference_keyframe_indices(scenes):
+    # Loop of rule_based_summary.select_keyframe_indices, which can't be imported without langchain
+    keyframe_indices = []
+    for i, scene in enumerate(scenes[:-1]):
+        nxt = scenes[i + 1]
+        if (set(scene.objects) != set(nxt.objects)
+                or set(scene.relations) != set(nxt.relations)
+                or scene.raw.current_action != nxt.raw.current_action
+                or scene.raw.current_action_parameters != nxt.raw.current_action_parameters
+                or scene.raw.asr_recognition
+                or nxt.raw.timestamp - scene.raw.timestamp > _MAX_TIME_DISTANCE_BETWEEN_KEY_FRAMES):
+            keyframe_indices.append(i)
+    return keyframe_indices
+
+
+def _scenes(node):
+    if isinstance(node, SceneGraphInstant):
+        yield node
+    for c in get_children(node) or []:
+        yield from _scenes(c)
+
+
+def _timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'  {label}: {(time.perf_counter() - start) * 1000:.1f}ms')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scene-level queries on node objects vs. the columnar SceneTimeline')
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--goals-per-day', type=int, default=500)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day, speech_fraction=0.1)
+    scenes = list(_scenes(history))
+    start = time.perf_counter()
+    columnar_history, timeline = SceneTimeline.from_history(history)
+    print(f'{len(timeline)} scenes, timeline built in {time.perf_counter() - start:.2f}s, '
+          f'{timeline.nbytes / 1e6:.1f}MB of columns, {len(timeline.object_sets)} distinct object sets')
+    assert list(_scenes(columnar_history))[-1].raw.timestamp == scenes[-1].raw.timestamp
+
+    day_start = scenes[len(scenes) // 2].raw.timestamp
+    day_end = day_start + timedelta(days=1)
+    print('time range query (one day):')
+    expected = _timed('objects', lambda: [i for i, s in enumerate(scenes) if day_start <= s.raw.timestamp <= day_end])
+    rows = _timed('timeline', lambda: timeline.rows_between(day_start, day_end))
+    assert rows.tolist() == expected
+
+    print('keyframe selection:')
+    expected = _timed('objects', lambda: _reference_keyframe_indices(scenes))
+    keyframes = _timed('timeline', lambda: timeline.keyframe_indices())
+    assert keyframes.tolist() == expected
+
+    print('scenes per action:')
+    expected = _timed('objects', lambda: Counter(s.raw.current_action for s in scenes))
+    stats = _timed('timeline', lambda: timeline.statistics())
+    assert {a: s['scenes'] for a, s in stats.items()} == dict(expected)
+    busiest = max(stats, key=lambda a: stats[a]['seconds'])
+    print(f'  most time spent in {busiest}: {stats[busiest]["seconds"] / 3600:.1f}h')
+
+    print('goals of one day:')
+    expected = _timed('objects', lambda: {s.raw.current_goal for s in scenes
+                                          if day_start <= s.raw.timestamp <= day_end})
+    goals = _timed('timeline', lambda: {timeline.strings[g] for g in np.unique(timeline.goals[rows]) if g >= 0})
+    assert goals == expected - {None}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import time
+from functools import partial
+from statistics import median
+
+import torch
+from sentence_transformers import util
+
+from em.em_tree import HigherLevelSummary
+from llm_emv.emv_api import make_tree_interactive
+from llm_emv.interactive_tree import ExpandableTreeNode
+from lmp.repl.semantic_hint_error import SemanticHintError
+from test.synthetic_history import make_synthetic_goals, HashingEmbedding
+
+_QUERIES = ['milk', 'when did you load the dishwasher?', 'Pickup(Mug)', 'what did you do after handing over the cup?']
+
+
+def _per_child_similarities(embedding_fn, query, nodes):
+    # Reference implementation of the original search path: one query encoding and one cos_sim per child,
+    # with the embeddings of each node cached on the node itself
+    result = []
+    for node in nodes:
+        if not hasattr(node, '_embedding_cache'):
+            node._embedding_cache = embedding_fn([s for s in node.index_content if s])
+        result.append(util.cos_sim(node._embedding_cache, embedding_fn([query])).max().item())
+    return torch.tensor(result)
+
+
+def _time_search(tree, repeats: int):
+    timings = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        try:
+            tree.search(_QUERIES[i % len(_QUERIES)])
+        except SemanticHintError:
+            pass  # No match, that's fine for timing purposes
+        timings.append(time.perf_counter() - start)
+    return median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search latency vs. number of children of the searched node')
+    parser.add_argument('--child-counts', type=int, nargs='+', default=[10, 100, 500, 1000, 5000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--embedding', type=str, default=None,
+                        help='SentenceTransformer model name. Uses a deterministic hashing embedding if not given.')
+    parser.add_argument('--encode-latency-ms', type=float, default=5.0,
+                        help='Simulated per-call encoder latency for the hashing embedding')
+    args = parser.parse_args()
+
+    if args.embedding:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.embedding)
+        embedding_fn = partial(model.encode, convert_to_tensor=True)
+    else:
+        embedding_fn = HashingEmbedding(encode_latency_s=args.encode_latency_ms / 1000)
+
+    print(f'{"children":>10} {"per-child [ms]":>15} {"batched [ms]":>13} {"speedup":>8}')
+    for n in args.child_counts:
+        history = HigherLevelSummary('', make_synthetic_goals(n))
+        batched = make_tree_interactive(history, embedding_fn)
+        per_child = ExpandableTreeNode(history, children_extractor=lambda c: c.children if c is history else None,
+                                       search_similarity_fn=partial(_per_child_similarities, embedding_fn))
+        for tree in (batched, per_child):  # Fill the node embedding caches, only measure query time afterwards
+            _time_search(tree, repeats=1)
+        t_batched = _time_search(batched, args.repeats)
+        t_per_child = _time_search(per_child, args.repeats)
+        print(f'{n:>10} {t_per_child * 1000:>15.1f} {t_batched * 1000:>13.1f} {t_per_child / t_batched:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
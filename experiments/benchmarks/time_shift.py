@@ -0,0 +1,68 @@
+import argparse
+import time
+import tracemalloc
+from copy import deepcopy
+from datetime import datetime
+from random import Random
+
+from em.em_tree import HigherLevelSummary, GoalBasedSummary, EventBasedSummary
+from em.em_util import move_history_to_start_date
+from em.randomize_episodes import randomize_datetimes
+from test.synthetic_history import make_synthetic_history
+
+
+def _reference_move_history_to_start_date(history: HigherLevelSummary, start_date: datetime):
+    # The previous implementation: deep copy, then adjust the timestamp of every scene
+    diff = start_date - history.range[0]
+
+    def _deep_adjust(h):
+        if isinstance(h, EventBasedSummary):
+            for s in h.scenes:
+                s.raw.timestamp += diff
+        elif isinstance(h, GoalBasedSummary):
+            for e in h.events:
+                _deep_adjust(e)
+        else:
+            for c in h.children:
+                _deep_adjust(c)
+
+    history = deepcopy(history)
+    _deep_adjust(history)
+    return history
+
+
+def _measure(label, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    # Again for the memory, tracemalloc slows down the deep copy a lot
+    tracemalloc.start()
+    result = fn()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'  {label}: {elapsed * 1e6:.0f}us, {allocated / 1e3:.1f}KB allocated')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-dating histories by deep copy vs. with a time-shift view')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    history.range  # Memoized, like for every history that was rendered or re-dated before
+    start_date = datetime(2025, 1, 1, 8)
+    print(f'move_history_to_start_date, {args.days} days x {args.goals_per_day} goals:')
+    expected = _measure('deep copy', lambda: _reference_move_history_to_start_date(history, start_date))
+    moved = _measure('view', lambda: move_history_to_start_date(history, start_date))
+    day = len(history.children) // 2
+    assert moved.children[day].range == expected.children[day].range
+    assert moved.children[day].children[0].nl_summary == expected.children[day].children[0].nl_summary
+
+    print(f'randomize_datetimes of {args.days} days as episodes:')
+    _measure('view', lambda: randomize_datetimes(history.children, rng=Random(0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import time
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode, recursive_apply
+from llm_emv.token_budget import TokenBudgetRenderer, estimate_tokens
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _set_simplified_repr(node):
+    node._simplified_repr = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rendering a busy history for the prompt with a token budget')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--goals-per-day', type=int, default=100)
+    parser.add_argument('--budget', type=int, default=20000)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(args.days, args.goals_per_day)
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    recursive_apply(tree, _set_simplified_repr)
+    # An agent expanding several busy days, one goal and event after another
+    tree.expand()
+    for day in tree.children[:10]:
+        day.expand()
+        for goal in day.children[::10]:
+            goal.expand()
+    last_goal = tree.children[3].children[42]
+    tree.children[3].expand(42)
+    last_goal.expand(0)
+
+    full = repr(tree)
+    renderer = TokenBudgetRenderer(args.budget)
+    start = time.perf_counter()
+    rendered = renderer(tree)
+    elapsed = time.perf_counter() - start
+    print(f'full render: ~{estimate_tokens(full)} tokens; with a budget of {args.budget}: '
+          f'~{estimate_tokens(rendered)} tokens in {elapsed * 1000:.1f}ms, {len(renderer._elided)} nodes elided')
+    start = time.perf_counter()
+    assert renderer(tree) == rendered, 'not deterministic'
+    print(f'unchanged tree rendered again: {(time.perf_counter() - start) * 1000:.1f}ms, same prompt')
+    tree.children[2].children[1].expand()
+    start = time.perf_counter()
+    renderer(tree)
+    print(f'after expanding one more goal: {(time.perf_counter() - start) * 1000:.1f}ms')
+    visible = not last_goal._elided and not tree.children[3]._elided
+    print(f'most recently expanded goal {"shown" if visible else "elided"}')
+    assert estimate_tokens(rendered) <= args.budget
+
+
+if __name__ == '__main__':
+    main()
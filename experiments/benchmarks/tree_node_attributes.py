@@ -0,0 +1,41 @@
+import argparse
+import timeit
+
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+class _DirForwardingTreeNode(ExpandableTreeNode):
+    # The previous implementation: dir(self) on every access of a public attribute
+    __dir__ = object.__dir__
+
+    def __getattribute__(self, __name):
+        if '__' in __name or __name.startswith('_') or __name in dir(self):
+            return super().__getattribute__(__name)
+        return getattr(self._wrapped, __name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attribute access on interactive tree nodes')
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    history = make_synthetic_history(1, 10)
+    for cls in (_DirForwardingTreeNode, ExpandableTreeNode):
+        node = cls(history, get_children, _no_similarity)
+        print(f'{cls.__name__}:')
+        for attribute in ('nl_summary', 'range', 'children', 'expand', '_wrapped'):
+            seconds = timeit.timeit(f'node.{attribute}', globals=dict(node=node), number=args.number)
+            print(f'  .{attribute}: {seconds / args.number * 1e9:.0f}ns')
+        assert node.nl_summary == node._wrapped.nl_summary and node.range == node._wrapped.range
+
+
+if __name__ == '__main__':
+    main()
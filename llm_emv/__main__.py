@@ -1,9 +1,10 @@
 import argparse
-import pickle
 import sys
 import traceback
 
+from em.history_store import open_history
 from llm_emv.setup import setup_llm_emv
+from lmp.embedding_service import all_embedding_service_stats
 from lmp.repl.code_execution import ReplExecutionEnvironment
 
 
@@ -20,10 +21,15 @@ def _safe_run(lmp, command):
         lmp.reset()
 
 
-def _load_history():
+def _history_path():
     from pathlib import Path
-    history_cache = Path(__file__).parent.parent / 'data' / 'armarx_lt_mem' / f'2024-a7a-merged-summary.pkl'
-    return pickle.loads(history_cache.read_bytes())
+    return Path(__file__).parent.parent / 'data' / 'armarx_lt_mem' / f'2024-a7a-merged-summary.pkl'
+
+
+def _load_history():
+    # Through the history store next to the pickle if it was converted (python -m em.history_store <pickle>), then
+    # only the subtrees the agent accesses are loaded
+    return open_history(_history_path())
 
 
 def main(config: str):
@@ -37,7 +43,7 @@ def main(config: str):
         print('Answer:', text)
         raise StopIteration((ReplExecutionEnvironment.RETURN_FN_SIGNAL, None))
 
-    lmp = setup_llm_emv(config, history=_load_history(), tts=_exit_lmp_tts)
+    lmp = setup_llm_emv(config, history=_load_history(), tts=_exit_lmp_tts, history_path=_history_path())
     with langchain_community.callbacks.get_openai_callback() as cb:
         try:
             while True:
@@ -46,6 +52,7 @@ def main(config: str):
                 _safe_run(lmp, t)
         finally:
             print(cb)
+            print('Embedding services:', all_embedding_service_stats())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+import json
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class VectorIndex:
+    """Maximum inner product search over a fixed set of L2-normalized vectors."""
+
+    backend = None
+
+    def search(self, query: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (ids, similarities) of up to n vectors, sorted by descending similarity."""
+        raise NotImplementedError
+
+    def save(self, path: Path, digest: str):
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, path: Path, digest: str) -> Optional['VectorIndex']:
+        """Returns None if there is no index at path, or it was built for different vectors."""
+        raise NotImplementedError
+
+
+def _top_n(ids: np.ndarray, sims: np.ndarray, n: int):
+    if len(sims) > n:
+        best = np.argpartition(-sims, n - 1)[:n]
+        ids, sims = ids[best], sims[best]
+    order = np.argsort(-sims, kind='stable')
+    return ids[order], sims[order]
+
+
+class ExactVectorIndex(VectorIndex):
+    backend = 'exact'
+
+    def __init__(self, vectors: np.ndarray):
+        super().__init__()
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def search(self, query, n):
+        return _top_n(np.arange(len(self.vectors)), self.vectors @ query, n)
+
+    def save(self, path, digest):
+        pass  # Nothing to precompute
+
+    @classmethod
+    def load(cls, path, digest):
+        return None
+
+
+class IvfVectorIndex(VectorIndex):
+    """
+    Inverted file index in pure NumPy. The vectors are clustered with spherical k-means, a query only scans the
+    vectors of the n_probe clusters whose centroids are most similar to it.
+    """
+
+    backend = 'ivf'
+
+    def __init__(self, vectors: np.ndarray, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray,
+                 n_probe=8):
+        super().__init__()
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.centroids = centroids
+        self.list_offsets = list_offsets  # Vectors of list i are list_ids[list_offsets[i]:list_offsets[i + 1]]
+        self.list_ids = list_ids
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: int = None, n_iter=10, n_probe=8, max_train_per_list=64, seed=0):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(seed)
+        # Like faiss, train the centroids on a subsample only
+        train = vectors[rng.permutation(len(vectors))[:max_train_per_list * n_lists]]
+        centroids = train[:n_lists]
+        for _ in range(n_iter):
+            assignment = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, train)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        list_ids = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.searchsorted(assignment[list_ids], np.arange(n_lists + 1)).astype(np.int64)
+        return cls(vectors, centroids, list_offsets, list_ids, n_probe=n_probe)
+
+    def search(self, query, n):
+        n_probe = min(self.n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        ids = np.concatenate([self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists])
+        return _top_n(ids, self.vectors[ids] @ query, n)
+
+    def save(self, path, digest):
+        np.savez(path, digest=digest, vectors=self.vectors, centroids=self.centroids,
+                 list_offsets=self.list_offsets, list_ids=self.list_ids)
+
+    @classmethod
+    def load(cls, path, digest, n_probe=8):
+        if not Path(path).is_file():
+            return None
+        data = np.load(path)
+        if str(data['digest']) != digest:
+            return None
+        return cls(data['vectors'], data['centroids'], data['list_offsets'], data['list_ids'], n_probe=n_probe)
+
+
+class FaissVectorIndex(VectorIndex):
+    backend = 'faiss'
+
+    def __init__(self, index, n_probe=8):
+        super().__init__()
+        self.index = index
+        self.index.nprobe = n_probe
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, n_lists: int = None, n_probe=8, **kwargs):
+        import faiss
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n_lists = min(n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(vectors.shape[1]), vectors.shape[1], n_lists,
+                                   faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        return cls(index, n_probe=n_probe)
+
+    def search(self, query, n):
+        sims, ids = self.index.search(np.ascontiguousarray(query[None], dtype=np.float32), n)
+        valid = ids[0] >= 0
+        return ids[0][valid], sims[0][valid]
+
+    def save(self, path, digest):
+        import faiss
+        faiss.write_index(self.index, str(path))
+        Path(str(path) + '.json').write_text(json.dumps({'digest': digest}))
+
+    @classmethod
+    def load(cls, path, digest, n_probe=8):
+        import faiss
+        meta = Path(str(path) + '.json')
+        if not Path(path).is_file() or not meta.is_file() or json.loads(meta.read_text())['digest'] != digest:
+            return None
+        return cls(faiss.read_index(str(path)), n_probe=n_probe)
+
+
+_BACKENDS = {
+    'exact': (ExactVectorIndex, None),
+    'ivf': (IvfVectorIndex, '.ivf.npz'),
+    'faiss': (FaissVectorIndex, '.faiss'),
+}
+
+
+def load_or_build_vector_index(vectors: np.ndarray, digest: str, backend='auto', path_prefix: Path = None,
+                               **kwargs) -> VectorIndex:
+    """
+    Loads the index persisted at path_prefix + backend suffix if it was built for the same vectors (same digest),
+    otherwise builds it and persists it there.
+    backend 'auto' uses faiss if it is installed and falls back to the pure NumPy IVF index.
+    """
+    if backend == 'auto':
+        try:
+            import faiss  # noqa
+            backend = 'faiss'
+        except ImportError:
+            backend = 'ivf'
+    cls, suffix = _BACKENDS[backend]
+    if cls is ExactVectorIndex:
+        return ExactVectorIndex(vectors)
+
+    path = Path(str(path_prefix) + suffix) if path_prefix is not None else None
+    if path is not None:
+        index = cls.load(path, digest, n_probe=kwargs.get('n_probe', 8))
+        if index is not None:
+            return index
+    print(f'Building {backend} search index over {len(vectors)} vectors...')
+    index = cls.build(vectors, **kwargs)
+    if path is not None:
+        index.save(path, digest)
+    return index
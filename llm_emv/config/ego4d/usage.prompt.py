@@ -4,9 +4,11 @@ Usage examples:
 >>> history.expand(now() - timedelta(hours=6), now() - timedelta(hours=4))  # Expand all children that overlap with the given range (in this example "about 5 hours ago")
 >>> history.expand((now() - timedelta(days=2)).date())  # Expand all children that overlap with the day before yesterday
 >>> history[0].expand()  # Shows child node 0 with all its child nodes expanded
+>>> history[0].expand(page=1)  # For nodes with very many children: expands only the matching children 100-199 (pages of 100, the first is page=0). Runs of collapsed children are summarized as "... <count> <kind> (<first>-<last>: <time range>)"
 >>> history.search("green booklet") # Semantic index search. Expands the most relevant children according to similarity of the natural language query and the node's (recursively defined) index content.
 >>> history[1].search("riding the bike") # Semantic index search on some node further down the tree. Expands the children of node 1 most relevant to the search term
 >>> history[1][12].search("riding the bike"); history[1][42].search("riding the bike") # Semantic index search on some nodes further down the tree
+>>> history.deep_search("green booklet", k=3)  # Semantic index search over all levels of the tree at once. Expands only the paths to the 3 most relevant nodes and returns them, e.g. [(1, 42, 0), (3, 2)] for history[1][42][0] and history[3][2]. Prefer this over searching level by level.
 >>> history[3].collapse_all_but(1); history[3][1].expand()  # Zooms into details of child node 3.1 while collapsing all other childs of node 3
 >>> history[5][2].collapse_all_but(4); history[5][2][4].expand()  # Zooms into details of child node 5.2.4 while collapsing all other childs of node 5.2
 >>> vqa("What color is the ... in these images?",
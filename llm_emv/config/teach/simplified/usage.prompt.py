@@ -6,8 +6,10 @@ Usage examples:
 >>> history.expand(0)  # Shows child node 0
 >>> history[0].expand()  # Expands all child nodes of node 0 (node 0 must be expanded already to see them)
 >>> history[5][2].expand()  # Shows child node 2 of child node 5 with all its child nodes expanded
+>>> history[5][2].expand(page=1)  # For nodes with very many children: expands only the matching children 100-199 (pages of 100, the first is page=0). Runs of collapsed children are summarized as "... <count> <kind> (<first>-<last>: <time range>)"
 >>> history.search("green cup") # Semantic index search. Expands the most relevant children according to similarity of the natural language query and the node's (recursively defined) index content.
 >>> history[1][42].search("bicycle") # Semantic index search on some node further down the tree. Expands the children of node 1.42 most relevant to the search term
+>>> history.deep_search("green cup", k=3)  # Semantic index search over all levels of the tree at once. Expands only the paths to the 3 most relevant nodes and returns them, e.g. [(1, 42, 0), (3, 2)] for history[1][42][0] and history[3][2]. Prefer this over searching level by level.
 >>> history[3].collapse_all_but(1); history[3][1].expand()  # Zooms into details of child node 3.1 while collapsing all other childs of node 3
 >>> vqa("What color is the ... in this image?",
 ...     history[2][4][-1][0].image)  # Invoke a model to answer a visual question about image(s) of some leaf (!) node(s)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Iterable
+
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class MmapEmbeddingStore:
+    """
+    Persistent, append-only embedding cache.
+
+    Layout of the store directory:
+      - meta.json: embedding dimension and the current file generation
+      - embeddings.<gen>.f32: row-major float32 matrix, one row per text. Rows are only ever appended.
+      - index.<gen>.tsv: one "<text hash>\\t<row>" line per row. A line is only written after its row is on disk.
+
+    Only the index is read at startup. The matrix is memory-mapped, so only rows that are actually looked up are paged
+    in. A crash during an append leaves at most a partial trailing row or index line, both are ignored when loading.
+    Compaction writes a new generation and switches to it by atomically replacing meta.json.
+    """
+
+    def __init__(self, directory: Path, dim: int, compact_if_wasted_fraction=0.5):
+        super().__init__()
+        self.directory = Path(directory)
+        self.dim = dim
+        self._row_bytes = 4 * dim
+        self._lock = threading.RLock()
+        self._index: Dict[str, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self._num_rows = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_file = self.directory / 'meta.json'
+        if meta_file.is_file():
+            meta = json.loads(meta_file.read_text())
+            if meta['dim'] != dim:
+                raise ValueError(f'Embedding store {self.directory} has dimension {meta["dim"]}, expected {dim}')
+            self._generation = meta['generation']
+        else:
+            self._generation = 0
+            self._write_meta(self._generation)
+        self._remove_stale_generations()
+        self._load()
+
+        if self._num_rows > 0 and 1 - len(self._index) / self._num_rows > compact_if_wasted_fraction:
+            self.compact()
+
+    @property
+    def _data_file(self):
+        return self.directory / f'embeddings.{self._generation}.f32'
+
+    @property
+    def _index_file(self):
+        return self.directory / f'index.{self._generation}.tsv'
+
+    def _write_meta(self, generation: int):
+        tmp = self.directory / 'meta.json.tmp'
+        tmp.write_text(json.dumps({'dim': self.dim, 'dtype': 'float32', 'generation': generation}))
+        _fsync_file(tmp)
+        os.replace(tmp, self.directory / 'meta.json')
+
+    def _remove_stale_generations(self):
+        for f in list(self.directory.glob('embeddings.*.f32')) + list(self.directory.glob('index.*.tsv')):
+            if f.name.split('.')[1] != str(self._generation):
+                f.unlink()  # Left over from an interrupted or finished compaction
+
+    def _load(self):
+        self._data_file.touch()
+        self._index_file.touch()
+        data_size = self._data_file.stat().st_size
+        if data_size % self._row_bytes:
+            # Partial trailing row from an interrupted append. It never got an index entry.
+            with self._data_file.open('r+b') as f:
+                f.truncate(data_size - data_size % self._row_bytes)
+        self._num_rows = data_size // self._row_bytes
+
+        index_bytes = self._index_file.read_bytes()
+        complete_size = index_bytes.rfind(b'\n') + 1
+        if complete_size < len(index_bytes):
+            # Partial trailing line from an interrupted append, remove it so that new lines are not appended to it
+            with self._index_file.open('r+b') as f:
+                f.truncate(complete_size)
+        for line in index_bytes[:complete_size].decode('ascii').splitlines():
+            h, row = line.split('\t')
+            row = int(row)
+            if row < self._num_rows:
+                self._index[h] = row
+        self._mmap = None
+
+    def _matrix(self) -> np.ndarray:
+        if self._num_rows == 0:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if self._mmap is None or len(self._mmap) < self._num_rows:
+            # (Re-)map after the file has grown
+            self._mmap = np.memmap(self._data_file, dtype=np.float32, mode='r', shape=(self._num_rows, self.dim))
+        return self._mmap
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, text: str):
+        return text_hash(text) in self._index
+
+    def lookup(self, texts: Sequence[str]) -> List[Optional[int]]:
+        """Returns the row of each text, or None if it is not stored yet."""
+        with self._lock:
+            return [self._index.get(text_hash(t)) for t in texts]
+
+    def rows(self, rows: Sequence[int]) -> np.ndarray:
+        with self._lock:
+            return np.array(self._matrix()[np.asarray(rows, dtype=np.int64)], dtype=np.float32)
+
+    def get(self, texts: Sequence[str]) -> np.ndarray:
+        rows = self.lookup(texts)
+        if any(r is None for r in rows):
+            raise KeyError([t for t, r in zip(texts, rows) if r is None])
+        return self.rows(rows)
+
+    def append(self, texts: Sequence[str], embeddings: np.ndarray) -> List[int]:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(texts), self.dim)
+        with self._lock:
+            first_row = self._num_rows
+            with self._data_file.open('ab') as f:
+                f.write(embeddings.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._num_rows += len(texts)
+
+            new_rows = list(range(first_row, first_row + len(texts)))
+            lines = []
+            for t, row in zip(texts, new_rows):
+                h = text_hash(t)
+                self._index[h] = row
+                lines.append(f'{h}\t{row}\n')
+            with self._index_file.open('a', encoding='ascii') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            return new_rows
+
+    def compact(self, keep_texts: Iterable[str] = None):
+        """
+        Rewrites the store without orphaned or superseded rows.
+        If keep_texts is given, only the embeddings of these texts are kept.
+        """
+        with self._lock:
+            if keep_texts is None:
+                entries = sorted(self._index.items(), key=lambda x: x[1])
+            else:
+                keep_hashes = {text_hash(t) for t in keep_texts}
+                entries = sorted(((h, r) for h, r in self._index.items() if h in keep_hashes), key=lambda x: x[1])
+
+            new_generation = self._generation + 1
+            new_data_file = self.directory / f'embeddings.{new_generation}.f32'
+            new_index_file = self.directory / f'index.{new_generation}.tsv'
+            matrix = self._matrix()
+            chunk_size = 4096
+            with new_data_file.open('wb') as f:
+                for i in range(0, len(entries), chunk_size):
+                    rows = [r for _, r in entries[i:i + chunk_size]]
+                    f.write(np.ascontiguousarray(matrix[rows], dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with new_index_file.open('w', encoding='ascii') as f:
+                f.write(''.join(f'{h}\t{new_row}\n' for new_row, (h, _) in enumerate(entries)))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Switching generations is atomic. A crash before this point keeps the old generation.
+            self._mmap = None
+            self._write_meta(new_generation)
+            self._generation = new_generation
+            self._remove_stale_generations()
+            self._index = {}
+            self._load()
+
+    def import_dict(self, cache: Dict[str, np.ndarray]):
+        new = [(t, e) for t, e in cache.items() if t not in self]
+        if new:
+            self.append([t for t, _ in new], np.stack([np.asarray(e, dtype=np.float32) for _, e in new]))
+
+
+def _fsync_file(f: Path):
+    with f.open('rb') as handle:
+        os.fsync(handle.fileno())
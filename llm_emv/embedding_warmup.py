@@ -0,0 +1,120 @@
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from .search_index import SearchEmbeddingIndex
+
+logger = logging.getLogger(__name__)
+
+
+def _log_progress(done: int, total: int):
+    # Logged, not printed: the thread runs while the agent's code prints its output to the console
+    logger.info('Search embedding warm-up: %d/%d strings', done, total)
+
+
+class EmbeddingWarmup:
+    """
+    Embeds all strings of a SearchEmbeddingIndex on a background thread, in large batches.
+
+    Strings are scheduled level by level (root first), since searches usually start at the top of the tree.
+    prioritize(node) moves the strings of a subtree to the front of the queue, e.g. when the agent expands it.
+    Searches never wait for the warm-up: SearchEmbeddingIndex embeds whatever is still missing on demand.
+    close() stops the thread after the current batch.
+    """
+
+    def __init__(self, index: SearchEmbeddingIndex, batch_size=512,
+                 progress_fn: Optional[Callable[[int, int], None]] = _log_progress, progress_steps=10):
+        super().__init__()
+        self._index = index
+        self._batch_size = batch_size
+        self._progress_fn = progress_fn
+        self._progress_steps = progress_steps
+
+        layout = index.layout
+        by_depth = np.argsort(layout.depths, kind='stable')
+        own_ids = [layout.occurrences[layout.occ_start[n]:layout.own_end[n]] for n in by_depth]
+        order = np.concatenate([np.empty(0, dtype=np.int32)] + own_ids)
+        _, first = np.unique(order, return_index=True)
+        self._order = order[np.sort(first)]
+        self._position = 0  # Strings before this position in _order were scheduled already
+        self._urgent = deque()  # Strings of prioritized subtrees, the latest first
+        self._prioritized = np.zeros(len(layout.strings), dtype=bool)  # Queued once, not on every expansion
+        self._total = len(self._order)
+
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='embedding-warmup', daemon=True)
+
+    def start(self):
+        if self._total == 0 or not self._index.can_embed:
+            self._done.set()
+            return self
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self, timeout: float = None):
+        self.cancel()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def progress(self):
+        return self._index.num_embedded, self._total
+
+    def prioritize(self, node: Any):
+        n = self._index.layout.number_of(getattr(node, '_wrapped', node))
+        # The subtree of the root is the whole tree, which is in the queue already, level by level
+        if n is None or n == 0 or self.done:
+            return
+        ids = self._index.layout.index_content_ids(n)
+        with self._lock:
+            ids = np.unique(ids[~self._prioritized[ids]])
+            self._prioritized[ids] = True
+            ids = ids[~self._index.is_embedded(ids)]
+            if len(ids) > 0:
+                self._urgent.appendleft(ids)
+
+    def _next_batch(self):
+        with self._lock:
+            parts, size = [], 0
+            while self._urgent and size < self._batch_size:
+                ids = self._urgent.popleft()
+                if len(ids) > self._batch_size - size:
+                    ids, rest = ids[:self._batch_size - size], ids[self._batch_size - size:]
+                    self._urgent.appendleft(rest)
+                parts.append(ids)
+                size += len(ids)
+            if size < self._batch_size:
+                end = min(self._position + self._batch_size - size, len(self._order))
+                parts.append(self._order[self._position:end])
+                self._position = end
+            return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def _run(self):
+        try:
+            next_report = 0
+            while not self._cancelled.is_set():
+                batch = self._next_batch()
+                if len(batch) == 0:
+                    break
+                self._index.ensure_embedded(batch)
+                done, total = self.progress
+                if self._progress_fn is not None and (done >= next_report or done == total):
+                    self._progress_fn(done, total)
+                    next_report = done + total / self._progress_steps
+        finally:
+            self._done.set()
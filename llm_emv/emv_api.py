@@ -1,20 +1,48 @@
+import weakref
 from datetime import datetime
-from functools import partial
-from typing import Dict, Callable, Literal, List
+from pathlib import Path
+from typing import Dict, Callable, Literal, List, Tuple
 
 import torch
 from PIL.Image import Image
 from langchain_core.messages import HumanMessage
-from sentence_transformers import util
 
-from em.em_tree import HigherLevelSummary, type_to_children_property_map, HighestPredefinedSummaryLevel, AnyTreeNode
+from em.em_tree import HigherLevelSummary, HighestPredefinedSummaryLevel, AnyTreeNode, get_children
+from em.node_registry import NodeRegistry
+from em.tree_layout import layout_of
 from lmp.api_visibility_wrapper import group
 from lmp.namespace import comment
 from lmp.repl.semantic_hint_error import SemanticHintError
-from .interactive_tree import ExpandableTreeNode, ExpandableList, create_expandable_tree_node_filter_fn
+from .embedding_warmup import EmbeddingWarmup
+from .interactive_tree import ExpandableTreeNode, ExpandableList, create_expandable_tree_node_filter_fn, \
+    search_similarity_to_filter_fn
+from .lexical_index import LexicalIndex
+from .search_index import SearchEmbeddingIndex, ApproximateLeafSearch
 from .vlm import VLM
 
 
+# Warm-up of the latest API per history. A new API for the same history, e.g. one per question in the evaluation,
+# stops the previous warm-up instead of embedding the tree once more in parallel.
+# Keyed by id (history nodes are unhashable dataclasses), the weak reference makes sure an entry belongs to this
+# very history and not to a collected one that had the same address. Entries are removed when their API is closed
+_warmups: Dict[int, Tuple[weakref.ref, EmbeddingWarmup]] = {}
+
+
+def _replace_warmup(history: AnyTreeNode, warmup: EmbeddingWarmup):
+    key = id(history)
+    previous = _warmups.pop(key, None)
+    if previous is not None and previous[0]() is history:
+        previous[1].close()
+    _warmups[key] = (weakref.ref(history), warmup)
+
+
+def _close_warmup(history_id: int, warmup: EmbeddingWarmup):
+    warmup.close()
+    entry = _warmups.get(history_id)
+    if entry is not None and entry[1] is warmup:
+        del _warmups[history_id]
+
+
 class EMVerbalizationAPI:
 
     def __init__(
@@ -26,19 +54,34 @@ class EMVerbalizationAPI:
             hierarchy_level: Literal['none', 'predefined', 'predefined+', 'deep'] = 'deep',
             vlm: VLM = None,
             search_embedding_fn: Callable[[List[str]], torch.Tensor] = None,
-            search_filter_kwargs=None
+            search_filter_kwargs=None,
+            # Approximate nearest neighbour search for hierarchy_level='none', see ApproximateLeafSearch
+            search_ann_kwargs: dict = None,
+            history_path: Path = None,  # ANN indices are persisted next to the history if given
+            # BM25 stage: narrows down the candidates of close_match searches and of ordinary ones with many hits
+            search_lexical_index=False,
+            # Embeds the whole history in the background. By default not for history stores, which would be read
+            # completely instead of only the subtrees the agent accesses (see em.history_store)
+            search_warmup: bool = None
     ) -> None:
         super().__init__()
         self._vlm = vlm
         self._wait_for_trigger = wait_for_trigger
         self._tts = tts
         self._now_time = now_time
+        # One embedding matrix for the whole history, shared by all interactive nodes
+        self._search_index = SearchEmbeddingIndex(layout_of(history), search_embedding_fn)
+        # Embeds the whole history in the background, nodes expanded by the agent go first
+        self._search_warmup = EmbeddingWarmup(self._search_index)
+        self._lexical_index = LexicalIndex(self._search_index.layout) if search_lexical_index else None
+        tree_kwargs = dict(search_index=self._search_index, on_expand=self._search_warmup.prioritize,
+                           lexical_index=self._lexical_index)
         if hierarchy_level == 'deep': # 完整的整棵记忆树
             self._history: ExpandableTreeNode = make_tree_interactive(history, search_embedding_fn,
-                                                                      search_filter_kwargs)
+                                                                      search_filter_kwargs, **tree_kwargs)
         elif hierarchy_level.startswith('predefined'): # 只显示预定义的节点，即关键总结节点
             # noinspection PyTypeChecker
-            nodes = [make_tree_interactive(x, search_embedding_fn, search_filter_kwargs)
+            nodes = [make_tree_interactive(x, search_embedding_fn, search_filter_kwargs, **tree_kwargs)
                      for x in (find_all_predefined_summary_nodes
                                if hierarchy_level == 'predefined'
                                else find_all_parents_of_predefined_summary_nodes)(history)]
@@ -49,15 +92,29 @@ class EMVerbalizationAPI:
                 search_filter_fn=nodes[0]._search_filter_fn if len(nodes) > 0 else None,
             )
         else: # 只显示叶子节点，即原始数据
-            self._history = make_tree_interactive(history, search_embedding_fn, search_filter_kwargs).all_leaves
+            self._history = make_tree_interactive(history, search_embedding_fn, search_filter_kwargs,
+                                                  **tree_kwargs).all_leaves
+            if search_ann_kwargs is not None and search_embedding_fn is not None:
+                leaf_search = ApproximateLeafSearch(self._search_index, self._history.children,
+                                                    persist_path_prefix=history_path, **search_ann_kwargs)
+                self._history._search_filter_fn = search_similarity_to_filter_fn(
+                    leaf_search.similarities,
+                    lexical_search_fn=self._lexical_index.search if self._lexical_index is not None else None,
+                    **(search_filter_kwargs or {}))
 
-        try:
-            print('Initializing search embeddings eagerly...')
-            self._history.search('')
-        except SemanticHintError:
-            pass
-        finally:
-            self._history.collapse_deep()
+        # Searches embed missing strings on demand, so the first question does not need to wait for this
+        if search_warmup is None:
+            search_warmup = getattr(history, '_store', None) is None
+        _replace_warmup(history, self._search_warmup.start() if search_warmup else self._search_warmup)
+        # Also called at exit, so the thread does not outlive the interpreter
+        self._close_warmup = weakref.finalize(self, _close_warmup, id(history), self._search_warmup)
+        # Stable node IDs, e.g. for provenance of answers or to restore the expansion state in a later session
+        self._registry = NodeRegistry(history, self._search_index.layout)
+        self._hierarchy_level = hierarchy_level
+
+    def close(self):
+        # Stops the background warm-up. Not part of the agent API
+        self._close_warmup()
 
     #########################
     # dialog
@@ -110,6 +167,33 @@ class EMVerbalizationAPI:
     def history(self):
         return self._history
 
+    #########################
+    # Session state (not part of the LLM API)
+
+    @property
+    def registry(self) -> NodeRegistry:
+        return self._registry
+
+    def expansion_state(self) -> List[str]:
+        # IDs of all expanded nodes
+        self._check_deep_hierarchy()
+        return [self._registry.id_of(self._registry.node_at(path)) for path in self._history.expanded_paths()]
+
+    def restore_expansion_state(self, node_ids: List[str]):
+        # Unknown IDs, e.g. of nodes that were summarized again since, are ignored
+        self._check_deep_hierarchy()
+        paths = []
+        for node_id in node_ids:
+            try:
+                paths.append(self._registry.path_of(self._registry.node(node_id)))
+            except KeyError:
+                pass
+        self._history.expand_paths(paths)
+
+    def _check_deep_hierarchy(self):
+        if self._hierarchy_level != 'deep':
+            raise NotImplementedError('Expansion states can only be stored for hierarchy_level="deep"')
+
     #########################
     # External tools
     @group('tools')
@@ -136,13 +220,19 @@ class EMVerbalizationAPI:
 # 它本身不做递归，只包装当前这一层
 def make_tree_interactive(history: HigherLevelSummary,
                           embedding_fn: Callable[[List[str]], torch.Tensor] = None,
-                          search_filter_kwargs=None):
+                          search_filter_kwargs=None,
+                          search_index: SearchEmbeddingIndex = None,
+                          on_expand: Callable[[AnyTreeNode], None] = None,
+                          lexical_index: LexicalIndex = None):
+    if search_index is None:
+        search_index = SearchEmbeddingIndex(layout_of(history), embedding_fn)
     return ExpandableTreeNode(
         history,
-        children_extractor=lambda c:
-        getattr(c, type_to_children_property_map[type(c)])
-        if type(c) in type_to_children_property_map else None,
-        search_similarity_fn=partial(history_search_similarity, embedding_fn),
+        children_extractor=get_children,
+        search_similarity_fn=search_index.similarities,
+        deep_search_fn=search_index.deep_search,
+        on_expand=on_expand,
+        lexical_search_fn=lexical_index.search if lexical_index is not None else None,
         search_filter_kwargs=search_filter_kwargs
     )
 
@@ -165,23 +255,3 @@ def find_all_parents_of_predefined_summary_nodes(history: HigherLevelSummary):
         else:
             result.extend(find_all_parents_of_predefined_summary_nodes(node))
     return result
-
-# 给定一个查询字符串 query，和记忆树上的某个节点 node，这个节点跟查询的语义相似度是多少？（返回一个 0.0 ~ 1.0 的浮点数）
-def history_search_similarity(embedding_fn: Callable[[List[str]], torch.Tensor],  # returns 1xH tensor
-                              query: str, node: AnyTreeNode):
-    if embedding_fn is None:
-        return 0.0
-
-    if hasattr(node, '_embedding_cache'): # 如果节点已经缓存了嵌入向量，直接使用缓存
-        embedding = getattr(node, '_embedding_cache')
-    else: # 首次计算节点的 embedding 并缓存
-        embedding = embedding_fn([s for s in node.index_content if s])
-        setattr(node, '_embedding_cache', embedding)
-
-    query_emb = embedding_fn([query])
-
-    # 计算余弦相似度，并取最大值
-    # 设计者希望：只要节点里哪怕只有一句话跟用户查询高度相关，这个节点就应该被排到前面。
-    # 这在记忆回溯场景中非常合理（比如用户问“我什么时候提过离婚”，即使节点里只有一句相关，其他都是日常聊天，也应该被召回）。
-    similarity = util.cos_sim(embedding, query_emb).max().item()
-    return similarity
@@ -3,7 +3,6 @@ import pickle
 from abc import ABC
 from argparse import Namespace
 from collections import OrderedDict
-from copy import deepcopy
 from datetime import datetime
 from functools import cache, cached_property
 from hashlib import md5
@@ -11,7 +10,7 @@ from pathlib import Path
 from random import Random
 from typing import Iterator, Dict, List, Any, Tuple, Iterable, Optional, Union
 
-from em.em_tree import HigherLevelSummary
+from em.em_tree import HigherLevelSummary, TreeMutationWatcher, interning
 from em.em_util import move_history_to_start_date
 from em.llm_summary import LLMBasedSummarizer
 from em.randomize_episodes import gen_random_date_from_seed, randomize_datetimes
@@ -51,6 +50,7 @@ class DeChantQaDataset(EpisodicQADataset, ABC):
     def _parse_datetime_from_trial_id(self, trial_id: Tuple[str, ...]) -> datetime:
         raise NotImplementedError
 
+    @interning()  # The episodes of a multi-episode history share one table
     def _load_history(self, batch: Dict[str, Any], start_time: datetime) -> Optional[HigherLevelSummary]:
         raise NotImplementedError
 
@@ -80,22 +80,32 @@ class DeChantQaDataset(EpisodicQADataset, ABC):
             history = self._load_history(batch, start_time)
             if history is None:
                 continue
-
-            for key, value in batch.items():
-                if key in self._non_question_keys():
-                    continue
-                if self._filter_by_question_types is not None and key not in self._filter_by_question_types:
-                    continue
-                assert (isinstance(value, dict)
-                        and 'text_input' in value
-                        and 'target_output' in value), f'key={key}, value={value}'
-                q, a = value['text_input'], value['target_output']
-                sample_id = f'{"-".join(trial_ids)}-{b}-{key}'
-                if 'now_time_stamp' in batch:
-                    q_time = batch['now_time_stamp']
-                else:
-                    q_time = pick_random_question_date_after_history(history, Random(sample_id))
-                yield EpisodicQASample(sample_id, q, q_time, a, deepcopy(history))
+            watcher = TreeMutationWatcher(history)
+            try:
+                for key, value in batch.items():
+                    if key in self._non_question_keys():
+                        continue
+                    if self._filter_by_question_types is not None and key not in self._filter_by_question_types:
+                        continue
+                    assert (isinstance(value, dict)
+                            and 'text_input' in value
+                            and 'target_output' in value), f'key={key}, value={value}'
+                    q, a = value['text_input'], value['target_output']
+                    sample_id = f'{"-".join(trial_ids)}-{b}-{key}'
+                    # All questions share the history. Models only read it, the interactive tree keeps its expansion
+                    # state itself. Should a model have modified the tree anyway, the next question gets a freshly
+                    # loaded one.
+                    if watcher.modified:
+                        watcher.close()
+                        history = self._load_history(batch, start_time)
+                        watcher = TreeMutationWatcher(history)
+                    if 'now_time_stamp' in batch:
+                        q_time = batch['now_time_stamp']
+                    else:
+                        q_time = pick_random_question_date_after_history(history, Random(sample_id))
+                    yield EpisodicQASample(sample_id, q, q_time, a, history)
+            finally:
+                watcher.close()
 
     @cache
     def __len__(self):
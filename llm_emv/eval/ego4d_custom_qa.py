@@ -1,13 +1,12 @@
 import ast
 import json
-import pickle
 from argparse import ArgumentParser, Namespace
 from datetime import datetime
 from pathlib import Path
 from random import Random
 from typing import Iterator, Dict, Any, Callable
 
-from em.em_tree import HigherLevelSummary
+from em.em_tree import HigherLevelSummary, unpickle_history
 from em.em_util import move_history_to_start_date
 from llm_emv.eval.qa_eval import EpisodicQADataset, EpisodicQASample
 from llm_emv.eval.util import pick_random_question_date_after_history, make_llm_summarizer_from_cfg
@@ -49,7 +48,7 @@ class Ego4dCustomQADataset(EpisodicQADataset):
         for spec in history_spec:
             pkl_file = self.history_pkl_dir / f'{spec["video_id"]}.history.{self.pkl_suffix}'
             start_time = datetime.strptime(spec['start_time'], '%Y-%m-%d %H:%M:%S')
-            history = pickle.loads(pkl_file.read_bytes())
+            history = unpickle_history(pkl_file.read_bytes())
             history = move_history_to_start_date(history, start_time)
             histories.append(history)
 
@@ -14,7 +14,7 @@ class EpisodicQASample:
     question: str
     question_time: datetime  # What "now" means in the question
     answer: str
-    history: History
+    history: History  # Shared between the samples of the same history, must not be modified
 
 
 @dataclass
@@ -1,11 +1,11 @@
 import json
-import pickle
 from argparse import ArgumentParser, Namespace
 from datetime import datetime
 from pathlib import Path
 from random import Random
 from typing import Iterator, Dict, Any
 
+from em.em_tree import unpickle_history
 from llm_emv.eval.qa_eval import EpisodicQADataset, EpisodicQASample
 from llm_emv.eval.util import pick_random_question_date_after_history
 
@@ -40,7 +40,7 @@ class SimpleHistoryQADataset(EpisodicQADataset):
             question = sample['q']
             answer = sample.get('a', None)
             history_file = self.pickled_histories_base_dir / f'{sample["history"]}.pkl'
-            history = pickle.loads(history_file.read_bytes())
+            history = unpickle_history(history_file.read_bytes())
             q_time = (datetime.strptime(sample['q_time'], '%Y-%m-%d %H:%M:%S')
                       if 'q_time' in sample else pick_random_question_date_after_history(history, Random(q_id)))
             if history.range[-1] > q_time:
@@ -0,0 +1,77 @@
+from typing import Callable, List, Optional, Set, Tuple
+
+from em.em_tree import mutation_epoch
+from llm_emv.interactive_tree import ExpandableList, ExpandableTreeNode, INDENT_SIZE, format_datetime_range, \
+    quote_nl_summary, indent_following_lines
+
+Path = Tuple[int, ...]
+
+
+def format_path(path: Path, name='history') -> str:
+    return name + ''.join(f'[{i}]' for i in path)
+
+
+def render_node_header(node) -> str:
+    # The node without its children, as in the simplified rendering
+    if not isinstance(node, ExpandableTreeNode) or len(node.children) == 0:
+        return repr(node)
+    return (format_datetime_range(*node._wrapped.range) + ': '
+            + quote_nl_summary(node._wrapped.nl_summary, num_spaces=0))
+
+
+def describe_changes(tree: ExpandableList, old_paths: Set[Path], new_paths: Set[Path], name='history') -> str:
+    """
+    Structural diff of two expansion states (the visible expanded nodes, see ExpandableList.expanded_paths).
+    Newly expanded nodes are listed with their content in tree order, collapsed ones by path only.
+    """
+    lines = []
+    for path in sorted(new_paths - old_paths):
+        node = tree
+        for i in path:
+            node = node.children[i]
+        lines.append(f'Expanded {format_path(path, name)}: '
+                     + indent_following_lines(render_node_header(node), num_spaces=INDENT_SIZE))
+    closed = old_paths - new_paths
+    # Nodes below a collapsed node are hidden anyway
+    closed = [path for path in sorted(closed) if path[:-1] not in closed]
+    if len(closed) > 0:
+        lines.append('Collapsed ' + ', '.join(format_path(path, name) for path in closed))
+    return '\n'.join(lines) if len(lines) > 0 else 'No changes.'
+
+
+class HistoryStateMessages:
+    """
+    History state messages of an agent conversation. The first message is the full rendering of the history, the
+    following ones only describe the changes since the previous message. The messages stay in the conversation, so
+    the prompt prefix is unchanged and only the changes are new in each round. The full rendering is sent again and
+    the previous messages are dropped after resync_interval change messages, or if the EM tree itself changed.
+
+    Messages are (position, is_full, text), where the position is chosen by the caller, e.g. the index in the
+    execution history at which the state was sent. Requesting the state at the same position again returns the same
+    messages, so prompts can be rebuilt.
+    """
+
+    def __init__(self, render: Callable[[ExpandableList], str], resync_interval: int, name='history'):
+        super().__init__()
+        self._render = render
+        self._resync_interval = resync_interval
+        self._name = name
+        self._messages: List[Tuple[int, bool, str]] = []
+        self._paths: Optional[Set[Path]] = None
+        self._epoch = None
+
+    def reset(self):
+        self._messages = []
+        self._paths = None
+
+    def update(self, tree: ExpandableList, position: int) -> List[Tuple[int, bool, str]]:
+        if len(self._messages) > 0 and self._messages[-1][0] == position:
+            return self._messages
+        paths = set(tree.expanded_paths())
+        if self._paths is None or len(self._messages) > self._resync_interval or self._epoch != mutation_epoch():
+            self._messages = [(position, True, self._render(tree))]
+        else:
+            self._messages.append((position, False, describe_changes(tree, self._paths, paths, self._name)))
+        self._paths = paths
+        self._epoch = mutation_epoch()
+        return self._messages
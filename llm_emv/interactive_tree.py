@@ -1,15 +1,26 @@
-from datetime import datetime, date
+from bisect import bisect_left, bisect_right
+from datetime import datetime, date, time, timedelta
 from functools import cached_property
-from itertools import chain
-from typing import Any, Callable, List, Tuple
+from itertools import count, islice
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import torch
 
+from em.em_tree import node_class, mutation_epoch, HigherLevelSummary, GoalBasedSummary, EventBasedSummary, \
+    SceneGraphInstant
 from lmp.repl.semantic_hint_error import SemanticHintError
 
 PRETTY_PRINT = False
 USE_DASH_IN_SIMPLIFIED_REPR = False
 INDENT_SIZE = 2
+# Children per page of expand(page=...), for nodes with too many children to expand all of them
+PAGE_SIZE = 100
+# Longer runs of collapsed children are rendered with their count and time range instead of just '...'
+MIN_SUMMARIZED_RUN = 10
+
+# Numbers the actions on the tree, for the recency of expanded nodes (see llm_emv.token_budget)
+_actions = count(1)
 
 
 def _overlaps_date(query: date, date_range: Tuple[datetime, datetime]):
@@ -47,36 +58,109 @@ def _overlaps_datetime_range(query_start: datetime, query_end: datetime, date_ra
     return query_start <= end and start <= query_end
 
 
+class _IntervalIndex:
+    """Child ranges sorted by start, to find the children overlapping a time window without checking all of them."""
+
+    def __init__(self, ranges: List[Tuple[datetime, datetime]]):
+        super().__init__()
+        self.epoch = mutation_epoch()
+        self.ranges = ranges
+        self.order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+        self.starts = [ranges[i][0] for i in self.order]
+        self.max_ends = []  # Running max of the ends, which is sorted even if the ends are not
+        for i in self.order:
+            self.max_ends.append(max(self.max_ends[-1], ranges[i][1]) if self.max_ends else ranges[i][1])
+
+    def candidates(self, window_start: datetime, window_end: datetime) -> List[int]:
+        # Superset of the children with start <= window_end and end >= window_start
+        return sorted(self.order[bisect_left(self.max_ends, window_start):bisect_right(self.starts, window_end)])
+
+
+class ExpansionState:
+    """
+    Expansion states of all nodes of an interactive tree in one array. Every node gets a block of slots for its
+    children when their states are first needed. A slot is expanded if it was set in the current epoch, so starting
+    a new epoch collapses all nodes at once.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.epoch = 1
+        self._expanded_in = np.zeros(64, dtype=np.int64)  # Epoch in which the slot was expanded, 0 for never
+        self._size = 0
+
+    def allocate(self, n: int) -> int:
+        if self._size + n > len(self._expanded_in):
+            grown = np.zeros(max(2 * len(self._expanded_in), self._size + n), dtype=np.int64)
+            grown[:self._size] = self._expanded_in[:self._size]
+            self._expanded_in = grown
+        first = self._size
+        self._size += n
+        return first
+
+    def set(self, slot: int, state: bool):
+        self._expanded_in[slot] = self.epoch if state else 0
+
+    def block(self, first: int, n: int) -> np.ndarray:
+        return self._expanded_in[first:first + n] == self.epoch
+
+    def collapse_all(self):
+        self.epoch += 1
+
+    def expanded_slots(self) -> np.ndarray:
+        return np.flatnonzero(self._expanded_in[:self._size] == self.epoch)
+
+
+def _range_filter_fn(range_predicate: Callable[[Tuple[datetime, datetime]], bool],
+                     window_start: datetime, window_end: datetime):
+    # Only children overlapping the window can match. Lets ExpandableList skip the others using its _IntervalIndex
+    filter_fn = lambda c, i: range_predicate(c.range)
+    filter_fn.range_predicate = range_predicate
+    filter_fn.time_window = (window_start, window_end)
+    return filter_fn
+
+
+def _index_filter_fn(indices: range):
+    # Only the given children can match. Lets ExpandableList visit just these, and take pages of them directly
+    filter_fn = lambda c, i: i in indices
+    filter_fn.indices = indices
+    return filter_fn
+
+
 def create_index_only_filter_fn(length, args):
     if len(args) == 1:
         a = args[0]
         if isinstance(a, int):
             if a < 0:
-                a = length - a # 负索引转正，例如 -1 → 9（当 length=10）
-            return lambda c, i: i == a
+                a = length + a # 负索引转正，例如 -1 → 9（当 length=10）
+            return _index_filter_fn(range(length)[a:a + 1] if a >= 0 else range(0))
         elif isinstance(a, range):
-            return lambda c, i: i in a
+            return _index_filter_fn(range(length)[a.start:a.stop:a.step])
         else:
             raise NotImplementedError
     elif len(args) == 2:
         # TODO
         raise NotImplementedError
-    return lambda c, i: True
+    return _index_filter_fn(range(length))
 
 
 def create_expandable_tree_node_filter_fn(length, args):
     if len(args) == 0:
-        return lambda c, i: True
+        return _index_filter_fn(range(length))
     elif len(args) == 1:
         a = args[0]
         if isinstance(a, datetime):
-            return lambda c, i: _overlaps_datetime(a, c.range)
+            # An hour on either side covers the rounding of _overlaps_datetime
+            return _range_filter_fn(lambda r: _overlaps_datetime(a, r), a - timedelta(hours=1), a + timedelta(hours=1))
         elif isinstance(a, date):
-            return lambda c, i: _overlaps_date(a, c.range)
+            return _range_filter_fn(lambda r: _overlaps_date(a, r),
+                                    datetime.combine(a, time.min), datetime.combine(a, time.max))
         elif isinstance(a, int):
             if a < 0:
-                a = length - a
-            return lambda c, i: i == a
+                a = length + a
+            return _index_filter_fn(range(length)[a:a + 1] if a >= 0 else range(0))
+        elif isinstance(a, range):
+            return _index_filter_fn(range(length)[a.start:a.stop:a.step])
         else:
             raise TypeError('expand function cannot handle', type(a))
     elif len(args) == 2:
@@ -84,15 +168,12 @@ def create_expandable_tree_node_filter_fn(length, args):
         if type(a) is not type(b):
             raise TypeError('Both arguments to expand must be of the same type. Got:', type(a), '!=', type(b))
         elif isinstance(a, int):
-            if a < 0:
-                a = length - a
-            if b < 0:
-                b = length - b
-            return lambda c, i: i in range(a, b)
+            return _index_filter_fn(range(length)[a:b])
         elif isinstance(a, datetime):
-            return lambda c, i: _overlaps_datetime_range(a, b, c.range)
+            return _range_filter_fn(lambda r: _overlaps_datetime_range(a, b, r), a, b)
         elif isinstance(a, date):
-            return lambda c, i: _overlaps_date_range(a, b, c.range)
+            return _range_filter_fn(lambda r: _overlaps_date_range(a, b, r),
+                                    datetime.combine(a, time.min), datetime.combine(b, time.max))
         else:
             raise TypeError('expand function cannot handle', type(a))
     else:
@@ -117,6 +198,14 @@ def format_datetime_range(start: datetime, end: datetime):
             end_str = '%Y/%m/%d ' + end_str
     return start.strftime(start_str) + ' - ' + end.strftime(end_str)
 
+
+def quote_nl_summary(nl_summary: str, num_spaces: int):
+    nl_summary = indent_following_lines(nl_summary, num_spaces)
+    if len(nl_summary.splitlines()) > 1:
+        return f'"""{nl_summary}"""'
+    return f'"{nl_summary}"'
+
+
 # 把字符串中除了第一行以外的所有行前面都加上指定数量的空格。
 # 常用于让 repr() 的多行输出看起来像缩进的子树。
 def indent_following_lines(s: str, num_spaces: int):
@@ -125,7 +214,8 @@ def indent_following_lines(s: str, num_spaces: int):
 # 核心类
 class ExpandableList:
     def __init__(self,
-                 children: List[Any],
+                 # Or a function creating the children, called when they are first needed
+                 children: Union[List[Any], Callable[[], List[Any]]],
 
                  # Generates a filter function. Receives:
                  #  - int length: total number of children, for handling negative indices
@@ -137,14 +227,100 @@ class ExpandableList:
                  search_filter_fn: Callable[[str, List[Any], ...], List[int]]
                  ) -> None:
         super().__init__()
-        self.children = children
-        self._children_states = [False] * len(self.children)  # 每个子项的展开状态：默认全折叠
+        self._children = children
+        # Shared with the whole tree, see ExpansionState. Slots of the children start at _first_slot
+        self._expansion: Optional[ExpansionState] = None
+        self._first_slot: Optional[int] = None
         self._filter_fn_generator = filter_fn_generator
         self._search_filter_fn = search_filter_fn
-        self._simplified_repr = False
-
-    def expand(self, *args):
-        self._set_expanded(True, *args)             # 设置指定子项的展开状态为 True
+        self._simplified = False
+        self._interval_index: Optional[_IntervalIndex] = None
+        # (render settings and tree mutation epoch, repr). Reset for this node and its ancestors by _mark_dirty
+        self._render_cache: Optional[Tuple[tuple, str]] = None
+        self._parent: Optional[ExpandableList] = None
+        # (number of the last action that expanded this node, search rank), higher is more relevant
+        self._relevance = (0, 0)
+        # Rendered as collapsed with a note, to fit a token budget. Set by llm_emv.token_budget
+        self._elided_flag = False
+        if not callable(children):
+            self._adopt(children)
+
+    @property
+    def children(self) -> List[Any]:
+        if callable(self._children):
+            self._children = self._children()
+            self._adopt(self._children)
+        return self._children
+
+    def _adopt(self, children):
+        if not isinstance(children, list):
+            return  # Lazy sequences (LeafSequence) hold tree nodes, not interactive ones
+        for c in children:
+            if isinstance(c, ExpandableList):
+                c._parent = self
+                c._simplified_repr = self._simplified_repr
+
+    @property
+    def _simplified_repr(self) -> bool:
+        return self._simplified
+
+    @_simplified_repr.setter
+    def _simplified_repr(self, value: bool):
+        if value != self._simplified:
+            self._simplified = value
+            self._mark_dirty()
+
+    @property
+    def _elided(self) -> bool:
+        return self._elided_flag
+
+    @_elided.setter
+    def _elided(self, value: bool):
+        if value != self._elided_flag:
+            self._elided_flag = value
+            self._mark_dirty()
+
+    def _touch(self, action: int, rank: int = None):
+        # Search results rank above the other children expanded by the same action
+        self._relevance = (action, 0) if rank is None else (action, 1, -rank)
+
+    def _mark_dirty(self):
+        # Only expanded children are rendered into their parent's cache, so a node without a cache either has no
+        # cached ancestors or is collapsed in its parent. Either way, nothing above it needs to be reset.
+        node = self
+        while node is not None and node._render_cache is not None:
+            node._render_cache = None
+            node = node._parent
+
+    @property
+    def _expansion_state(self) -> ExpansionState:
+        if self._expansion is None:
+            self._expansion = self._parent._expansion_state if self._parent is not None else ExpansionState()
+        return self._expansion
+
+    def _slot(self, i: int) -> int:
+        if self._first_slot is None:
+            self._first_slot = self._expansion_state.allocate(len(self.children))  # 每个子项的展开状态：默认全折叠
+        return self._first_slot + i
+
+    def _set_child_state(self, i: int, state: bool):
+        self._expansion_state.set(self._slot(i), state)
+
+    @property
+    def _children_states(self) -> np.ndarray:
+        # Read only, states are changed with _set_child_state
+        if self._first_slot is None:
+            return np.zeros(len(self.children), dtype=bool)
+        return self._expansion_state.block(self._first_slot, len(self.children))
+
+    def _expanded_indices(self) -> List[int]:
+        if self._first_slot is None:
+            return []
+        return np.flatnonzero(self._children_states).tolist()
+
+    def expand(self, *args, page: Optional[int] = None, page_size: int = PAGE_SIZE):
+        # All matching children, or only one page of them, which is cheap no matter how many children there are
+        self._set_expanded(True, *args, page=None if page is None else (page, page_size))  # 设置指定子项的展开状态为 True
         return self                                 # 返回自身，方便链式调用
 
     def collapse(self, *args):                      # 设置指定子项的展开状态为 False
@@ -157,7 +333,10 @@ class ExpandableList:
         return self                                 # 返回自身，方便链式调用
 
     def collapse_deep(self):                        
-        self._set_expanded(False, recursive=True)   # 递归全部收起（包括子 ExpandableList）
+        if self._parent is None:
+            self._expansion_state.collapse_all()    # The whole tree: all states at once
+        else:
+            self._set_expanded(False, recursive=True)   # 递归全部收起（包括子 ExpandableList）
 
     def search(self, query, **kwargs):
         self.collapse()              
@@ -171,19 +350,94 @@ class ExpandableList:
                     'No children matching search query. Expanded all nodes so you can check manually.',
                     critical=False)
         # 只展开匹配的            
-        for i in indices:
-            self._children_states[i] = True     
+        action = next(_actions)
+        self._touch(action)
+        for rank, i in enumerate(indices):
+            self._set_child_state(i, True)
+            if isinstance(self.children[i], ExpandableList):
+                self.children[i]._touch(action, rank)
+        self._mark_dirty()
         return self
 
     # 根据用户给的参数（args），生成一个裁判 → 遍历所有子项 → 让裁判决定哪些子项要改状态 → 
     # 如果子项自己也是可展开的，就递归下去
-    def _set_expanded(self, state, *args, recursive=False):
-        filter_fn = self._filter_fn_generator(len(self.children), args)
-        for i, c in enumerate(self.children):
-            if filter_fn(c, i):
-                self._children_states[i] = state
-                if recursive and isinstance(c, ExpandableList):
-                    c._set_expanded(state, *args, recursive=True)
+    def _set_expanded(self, state, *args, recursive=False, page: Tuple[int, int] = None):
+        children = self.children
+        filter_fn = self._filter_fn_generator(len(children), args)
+        items = enumerate(children)
+        indices = getattr(filter_fn, 'indices', None)
+        window = getattr(filter_fn, 'time_window', None)
+        if not state and not recursive:
+            # Only expanded children can be collapsed
+            items = ((i, children[i]) for i in self._expanded_indices())
+        elif indices is not None:
+            if page is not None:
+                indices = indices[page[0] * page[1]:(page[0] + 1) * page[1]]
+                page = None
+            items = ((i, children[i]) for i in indices)
+        elif window is not None and isinstance(children, LeafSequence):
+            # Leaves are in time order, so the ones in the window are found by binary search
+            range_predicate, candidates = filter_fn.range_predicate, children.index_range(*window)
+            items = zip(candidates, children[candidates.start:candidates.stop])
+            filter_fn = lambda c, i: range_predicate(_time_range(c))
+        elif window is not None and self._get_interval_index() is not None:
+            # Check the candidates against the ranges stored in the index, c.range is slow on ExpandableTreeNode
+            index, range_predicate = self._interval_index, filter_fn.range_predicate
+            items = ((i, children[i]) for i in index.candidates(*window))
+            filter_fn = lambda c, i: range_predicate(index.ranges[i])
+        matches = ((i, c) for i, c in items if filter_fn(c, i))
+        if page is not None:
+            matches = islice(matches, page[0] * page[1], (page[0] + 1) * page[1])
+        matches = list(matches)
+        action = next(_actions) if state else None
+        if state:
+            self._touch(action)
+        states = self._children_states[[i for i, _ in matches]].tolist()
+        for (i, c), s in zip(matches, states):
+            if s != state:
+                self._set_child_state(i, state)
+                self._mark_dirty()
+                if state and isinstance(c, ExpandableList):
+                    c._touch(action)
+            # Children that were never created can't be expanded, so collapsing doesn't need to create them
+            if recursive and isinstance(c, ExpandableList) and (state or not callable(c._children)):
+                c._set_expanded(state, *args, recursive=True)
+
+    def expanded_paths(self) -> List[Tuple[int, ...]]:
+        # Child index paths of all expanded nodes in pre-order, e.g. to restore them later with expand_paths
+        result = []
+        stack = [(self, ())]
+        while stack:
+            node, path = stack.pop()
+            if path:
+                result.append(path)
+            if isinstance(node, ExpandableList):
+                stack.extend((node.children[i], path + (i,)) for i in reversed(node._expanded_indices()))
+        return result
+
+    def expand_paths(self, paths: List[Tuple[int, ...]]):
+        # Expands the nodes at the given child index paths, and all nodes on the way to them.
+        # The paths are ranked like search results
+        action = next(_actions)
+        for rank, path in reversed(list(enumerate(paths))):
+            node = self
+            for i in path:
+                node._set_child_state(i, True)
+                node._mark_dirty()
+                node = node.children[i]
+                if isinstance(node, ExpandableList):
+                    node._touch(action, rank)
+        return self
+
+    def _get_interval_index(self) -> Optional[_IntervalIndex]:
+        # Rebuilt when the tree was mutated, e.g. the last child got new events. None if children have no range
+        if self._interval_index is None or self._interval_index.epoch != mutation_epoch():
+            try:
+                ranges = [c.range for c in self.children]
+                self._interval_index = _IntervalIndex(ranges)
+            except (AttributeError, TypeError):
+                return None
+        return self._interval_index
 
     def __len__(self):
         return len(self.children)
@@ -197,25 +451,38 @@ class ExpandableList:
         return self.children[item]
 
     def __repr__(self):
+        # Unchanged nodes are not rendered again, after a local change only the path to it is
+        key = (PRETTY_PRINT, USE_DASH_IN_SIMPLIFIED_REPR, INDENT_SIZE, mutation_epoch(), self._expansion_state.epoch)
+        if self._render_cache is None or self._render_cache[0] != key:
+            self._render_cache = (key, self._render())
+        return self._render_cache[1]
+
+    def _render(self):
         if len(self.children) == 0:
             return '[]'
 
         pretty = PRETTY_PRINT or self._simplified_repr
         pretty_not_simplified = PRETTY_PRINT and not self._simplified_repr
         dash = '- ' * self._simplified_repr * USE_DASH_IN_SIMPLIFIED_REPR
-        any_expanded = any(s for s in self._children_states)
-        if any_expanded:
-            prev_expanded = True
+        expanded = self._expanded_indices()
+        any_expanded = len(expanded) > 0
+        if any_expanded and self._elided:
+            children_str = dash + format_elided(len(expanded))
+            any_expanded = False
+        elif any_expanded:
+            # Only the expanded children and the runs of collapsed ones between them, however many children there are
+            children = self.children
+            start = lambda i: ('' if i == 0 or self._simplified_repr else ', ') + (
+                    ('\n' + ' ' * INDENT_SIZE * pretty_not_simplified) * pretty)
             children_str = ''
-            for i, (c, s) in enumerate(zip(self.children, self._children_states)):
-                start = ('' if i == 0 or self._simplified_repr else ', ') + (
-                        ('\n' + ' ' * INDENT_SIZE * pretty_not_simplified) * pretty)
-                if s:
-                    children_str += start + dash + f'{i}: ' + indent_following_lines(
-                        repr(c), num_spaces=INDENT_SIZE * pretty_not_simplified)
-                elif prev_expanded:
-                    children_str += start + dash + '...'
-                prev_expanded = s
+            run_start = 0
+            for i in expanded + [len(children)]:
+                if run_start < i:
+                    children_str += start(run_start) + dash + format_collapsed_run(children, run_start, i)
+                if i < len(children):
+                    children_str += start(i) + dash + f'{i}: ' + indent_following_lines(
+                        repr(children[i]), num_spaces=INDENT_SIZE * pretty_not_simplified)
+                run_start = i + 1
         else:
             children_str = dash + '...'
 
@@ -229,57 +496,84 @@ class ExpandableTreeNode(ExpandableList):
     def __init__(self,
                  wrapped: Any,
                  children_extractor: Callable[[Any], List[Any]],
-                 search_similarity_fn: Callable[[str, Any], float],
-                 search_filter_kwargs=None
+                 # Receives (query, items), returns a 1D tensor with one similarity score per item
+                 search_similarity_fn: Callable[[str, List[Any]], torch.Tensor],
+                 search_filter_kwargs=None,
+                 # Receives (query, wrapped node, k), returns the child index paths of the k best nodes of all levels
+                 deep_search_fn: Callable[[str, Any, int], List[Tuple[int, ...]]] = None,
+                 # Called with the wrapped node whenever the node is expanded
+                 on_expand: Callable[[Any], None] = None,
+                 # See search_similarity_to_filter_fn
+                 lexical_search_fn: Callable[[str, List[Any]], Optional[Tuple[torch.Tensor, torch.Tensor]]] = None
                  ) -> None:
         search_filter_kwargs = search_filter_kwargs or {}
-        children = children_extractor(wrapped) or []
 
-        # 如果这是一个非叶子节点（有孩子），那么它包装的对象（wrapped）必须满足以下所有条件，否则就是程序 bug，应该立刻报错
-        if len(children) > 0:  # non-leaf node must have attributes for rendering. leaf nodes just use __repr__
-            assert hasattr(wrapped, 'range'), str(wrapped)
-            assert isinstance(wrapped.range, Tuple), str(wrapped)
-            assert len(wrapped.range) == 2 and all(isinstance(x, datetime) for x in wrapped.range), str(wrapped)
-            assert hasattr(wrapped, 'nl_summary'), str(wrapped)
-            assert isinstance(wrapped.nl_summary, str), str(wrapped)
+        # Children are wrapped when they are first needed, so only the visited part of the tree is accessed.
+        # Subtrees of a history store (see em.history_store) are not even loaded before.
+        def wrap_children():
+            children = children_extractor(wrapped) or []
+
+            # 如果这是一个非叶子节点（有孩子），那么它包装的对象（wrapped）必须满足以下所有条件，否则就是程序 bug，应该立刻报错
+            if len(children) > 0:  # non-leaf node must have attributes for rendering. leaf nodes just use __repr__
+                assert hasattr(wrapped, 'range'), str(wrapped)
+                assert isinstance(wrapped.range, Tuple), str(wrapped)
+                assert len(wrapped.range) == 2 and all(isinstance(x, datetime) for x in wrapped.range), str(wrapped)
+                assert hasattr(wrapped, 'nl_summary'), str(wrapped)
+                assert isinstance(wrapped.nl_summary, str), str(wrapped)
+
+            return [ExpandableTreeNode(c, children_extractor, search_similarity_fn, deep_search_fn=deep_search_fn,
+                                       on_expand=on_expand, lexical_search_fn=lexical_search_fn)
+                    for c in children]
 
         self._wrapped = wrapped
-        search_filter_fn = search_similarity_to_filter_fn(search_similarity_fn, **search_filter_kwargs)
-        super().__init__(children=[
-            ExpandableTreeNode(c, children_extractor, search_similarity_fn)
-            for c in children
-        ], filter_fn_generator=create_expandable_tree_node_filter_fn,
-            search_filter_fn=search_filter_fn)
+        self._children_extractor = children_extractor
+        self._deep_search_fn = deep_search_fn
+        self._on_expand = on_expand
+        search_filter_fn = search_similarity_to_filter_fn(search_similarity_fn, lexical_search_fn=lexical_search_fn,
+                                                          **search_filter_kwargs)
+        super().__init__(children=wrap_children, filter_fn_generator=create_expandable_tree_node_filter_fn,
+                         search_filter_fn=search_filter_fn)
 
         self._all_leaves = None
 
+    def expand(self, *args, **kwargs):
+        if self._on_expand is not None:
+            self._on_expand(self._wrapped)
+        return super().expand(*args, **kwargs)
+
+    def deep_search(self, query, k=3):
+        # Searches all levels below this node at once. Only the paths to the k best nodes are expanded.
+        paths = self._deep_search_fn(query, self._wrapped, k) if self._deep_search_fn is not None else []
+        if len(paths) == 0:
+            raise SemanticHintError('No nodes matching search query. Use search(...) to search level by level.',
+                                    critical=False)
+        self.collapse_deep()
+        self.expand_paths(paths)
+        return paths
+
     @cached_property
     def all_leaves(self):
         if len(self.children) == 0:
             return [self._wrapped]
         return ExpandableList(
-            list(chain(*(c.all_leaves for c in self.children))),
-            create_index_only_filter_fn,
+            LeafSequence(self._wrapped, self._children_extractor),
+            create_expandable_tree_node_filter_fn,
             self._search_filter_fn
         )
 
-    def __repr__(self):
+    def _render(self):
         if len(self.children) == 0:
             return repr(self._wrapped)  # leaf node
         pretty = PRETTY_PRINT or self._simplified_repr  # Simplified depends on spacing
 
-        cls_name = self._wrapped.__class__.__name__
+        cls_name = node_class(self._wrapped).__name__
         range_str = format_datetime_range(*self._wrapped.range)
-        children_str = super().__repr__()[1:-1].strip()  # strip away the [] and whitespace
+        children_str = super()._render()[1:-1].strip()  # strip away the [] and whitespace
         children_str = indent_following_lines(children_str, num_spaces=INDENT_SIZE * pretty)
         children_str = ((('\n' + ' ' * INDENT_SIZE * (1 if self._simplified_repr else 2)) * pretty)
                         + children_str + (('\n' + ' ' * INDENT_SIZE) * pretty))
 
-        nl_summary = indent_following_lines(self._wrapped.nl_summary, num_spaces=INDENT_SIZE * pretty)
-        if len(nl_summary.splitlines()) > 1:
-            nl_summary = f'"""{nl_summary}"""'
-        else:
-            nl_summary = f'"{nl_summary}"'
+        nl_summary = quote_nl_summary(self._wrapped.nl_summary, num_spaces=INDENT_SIZE * pretty)
 
         ____ = ' ' * INDENT_SIZE * pretty
         _n = '\n' if pretty else ''
@@ -298,15 +592,170 @@ class ExpandableTreeNode(ExpandableList):
                 f')'
         )
 
-    def __getattribute__(self, __name):
-        if '__' in __name or __name.startswith('_') or __name in dir(self):
-            return super().__getattribute__(__name)
+    def __getattr__(self, __name):
+        # Only called when the normal lookup failed. Attributes of this class (e.g. a property that raised
+        # AttributeError) are not forwarded, looking them up again raises the original error.
+        # Other attributes are forwarded to the wrapped node. Those its class defines get a descriptor from now on,
+        # others (typos, hasattr probes) don't, so they can't pile up on the class
+        if __name.startswith('_') or hasattr(type(self), __name):
+            return object.__getattribute__(self, __name)
+        wrapped_type = type(self._wrapped)
+        if hasattr(wrapped_type, __name) or __name in getattr(wrapped_type, '__dataclass_fields__', ()):
+            setattr(ExpandableTreeNode, __name, _Forwarded(__name))
         return getattr(self._wrapped, __name)
 
+    def __dir__(self):
+        # Own attributes only, like before the forwarding descriptors (shown to the LLM for attribute errors)
+        return [name for name in super().__dir__() if not isinstance(getattr(type(self), name, None), _Forwarded)]
+
+
+class _Forwarded:
+    # Attribute of the wrapped node. Non-data descriptor, so instance attributes still take precedence
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance._wrapped, self.name)
+
+
+_RUN_NOUNS = {HigherLevelSummary: 'summaries', GoalBasedSummary: 'goals', EventBasedSummary: 'actions',
+              SceneGraphInstant: 'scenes'}
+
+
+def collapsed_run_info(children: Sequence, start: int, end: int) -> Tuple[str, Optional[Tuple[datetime, datetime]]]:
+    # What the children start to end - 1 are (e.g. 'goals') and their time range, None if they have no time
+    first, last = (getattr(c, '_wrapped', c) for c in (children[start], children[end - 1]))
+    noun = _RUN_NOUNS.get(node_class(first), 'entries')
+    try:
+        return noun, (_time_range(first)[0], _time_range(last)[1])
+    except (AttributeError, TypeError):
+        return noun, None
+
+
+def format_elided(num_expanded: int) -> str:
+    return f'... ({num_expanded} expanded entries not shown to save space, call expand() to see them)'
+
+
+def format_collapsed_run(children: Sequence, start: int, end: int) -> str:
+    # E.g. '... 1,240 actions (100-1339: 2024/07/01 09:12 - 17:45)' for the collapsed children start to end - 1
+    if end - start < MIN_SUMMARIZED_RUN:
+        return '...'
+    noun, time_range = collapsed_run_info(children, start, end)
+    time_str = ': ' + format_datetime_range(*time_range) if time_range is not None else ''
+    return f'... {end - start:,} {noun} ({start}-{end - 1}{time_str})'
+
+
+def _time_range(node) -> Tuple[datetime, datetime]:
+    if hasattr(node, 'range'):
+        return node.range
+    return node.raw.timestamp, node.raw.timestamp
+
+
+class LeafSequence(Sequence):
+    """
+    The leaves of a tree in order, as a lazy read-only sequence. The prefix sums of the leaf counts of the children
+    are computed once per inner node, so leaf i is found by descending from the root with a binary search per level,
+    without a list of all leaves. Recomputed if the tree was mutated.
+    """
+
+    def __init__(self, root: Any, children_extractor: Callable[[Any], List[Any]]):
+        super().__init__()
+        self._root = root
+        self._children_extractor = children_extractor
+        # id(node) -> (node, [0, leaves of child 0, leaves of children 0 and 1, ...])
+        self._prefix_counts: Dict[int, Tuple[Any, List[int]]] = {}
+        self._epoch = mutation_epoch()
+
+    def _children(self, node) -> List[Any]:
+        return self._children_extractor(node) or []
+
+    def _counts(self, node, children: List[Any]) -> List[int]:
+        if self._epoch != mutation_epoch():
+            self._prefix_counts.clear()
+            self._epoch = mutation_epoch()
+        entry = self._prefix_counts.get(id(node))
+        if entry is None:
+            counts = [0]
+            for c in children:
+                counts.append(counts[-1] + self._count(c))
+            entry = self._prefix_counts[id(node)] = (node, counts)
+        return entry[1]
+
+    def _count(self, node) -> int:
+        children = self._children(node)
+        return self._counts(node, children)[-1] if len(children) > 0 else 1
+
+    def __len__(self):
+        return self._count(self._root)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return list(islice(self._iter_from(start), max(0, stop - start)))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return next(self._iter_from(i))
+
+    def __iter__(self):
+        return self._iter_from(0)
+
+    def _iter_from(self, i: int):
+        # Descends to leaf i, then continues depth-first with the stack of the descent
+        stack = []
+        node = self._root
+        children = self._children(node)
+        while len(children) > 0:
+            counts = self._counts(node, children)
+            k = bisect_right(counts, i) - 1
+            i -= counts[k]
+            stack.append((children, k + 1))
+            node = children[k]
+            children = self._children(node)
+        yield node
+        while stack:
+            children, k = stack.pop()
+            if k < len(children):
+                stack.append((children, k + 1))
+                node = children[k]
+                children = self._children(node)
+                while len(children) > 0:
+                    stack.append((children, 1))
+                    node = children[0]
+                    children = self._children(node)
+                yield node
+
+    def index_range(self, start: datetime, end: datetime) -> range:
+        # Indices of the leaves overlapping [start, end]. Children must be in time order, like in EM trees
+        return range(self._first_index(lambda r: r[1] >= start), self._first_index(lambda r: r[0] > end))
+
+    def _first_index(self, predicate: Callable[[Tuple[datetime, datetime]], bool]) -> int:
+        # First leaf whose time range satisfies the predicate, which must be monotonic in time.
+        # Searches the leaves themselves: the first leaf satisfying it can be in a child before the first child doing so
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if predicate(_time_range(self[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
 
 def recursive_apply(node, fn):
+    # Applied to the interactive nodes only, not to the wrapped tree nodes of all_leaves.
+    # Children that were not created yet are skipped, they inherit _simplified_repr from their parent when created.
+    if not isinstance(node, ExpandableList):
+        return
     fn(node)
-    if hasattr(node, 'children'):
+    if not callable(node._children):
         for c in node.children:
             recursive_apply(c, fn)
 
@@ -317,24 +766,64 @@ def recursive_apply(node, fn):
 # 在这些候选中，再用 min_cos_sim 硬阈值过滤
 # close_match 模式下阈值更严格（top_p 更小，min_cos_sim 更高）
 
+# 可选的词法检索 (lexical_search_fn, 例如 BM25):
+# close_match 查询只对包含所有查询词的节点计算 embedding 相似度，没有这样的节点时照常搜索所有节点
+# 普通查询在词法命中足够多时用它们剪枝候选，再只对候选计算 embedding 相似度
+# close_match_lexical_only 时，有包含所有查询词的节点的 close_match 查询只按 BM25 分数排序，完全不调用 embedding 模型
 def search_similarity_to_filter_fn(
-        search_similarity_fn: Callable[[str, Any], float],
+        search_similarity_fn: Callable[[str, List[Any]], torch.Tensor],
         top_p=0.5,
         min_cos_sim=0.2,
         close_match_top_p=0.4,
         close_match_min_cos_sim=0.7,
+        # Receives (query, items), returns (lexical score per item, whether the item contains all query terms),
+        # or None if the query cannot be answered lexically
+        lexical_search_fn: Callable[[str, List[Any]], Optional[Tuple[torch.Tensor, torch.Tensor]]] = None,
+        lexical_prune=True,
+        # Fewer hits than this are too few to rule out the other items, which may match by meaning only
+        lexical_prune_min_hits=100,
+        # Answers close_match searches with items containing all query terms by their BM25 scores alone, without
+        # the embedding model. Other close_match searches still use it
+        close_match_lexical_only=False,
 ) -> Callable[[str, List[Any], ...], List[int]]:
+    def select(scores: torch.Tensor, _top_p: float) -> torch.Tensor:
+        normalized_scores = torch.softmax(scores, dim=0)
+        sorted_scores, indices = torch.sort(normalized_scores, descending=True, stable=True)  # Ties in item order
+        cum_scores = torch.cumsum(sorted_scores, dim=0)
+        # noinspection PyTypeChecker
+        top_k = torch.count_nonzero(cum_scores < _top_p) + 1
+        return indices[:top_k]
+
     def search(query: str, items: List[Any], close_match=False):
         _top_p = close_match_top_p if close_match else top_p
         _min_cos_sim = close_match_min_cos_sim if close_match else min_cos_sim
 
-        similarities = torch.tensor([search_similarity_fn(query, item) for item in items])
-        normalized_scores = torch.softmax(similarities, dim=0)
-        sorted_scores, indices = torch.sort(normalized_scores, descending=True)
-        cum_scores = torch.cumsum(sorted_scores, dim=0)
-        # noinspection PyTypeChecker
-        top_k = torch.count_nonzero(cum_scores < _top_p) + 1
-        top_indices = indices[:top_k]
+        if len(items) == 0:
+            return []
+        lexical = lexical_search_fn(query, items) if lexical_search_fn is not None else None
+        candidates = None
+        if lexical is not None and close_match and close_match_lexical_only and lexical[1].any():
+            bm25_scores = torch.where(lexical[1], lexical[0], torch.tensor(-torch.inf))
+            return select(bm25_scores, _top_p).tolist()
+        elif lexical is not None and close_match:
+            # Only items with all query terms are scored by the embedding model. If there are none, e.g. for the
+            # query "moving the joints" and an item "MoveJoints", all items are
+            all_terms_matched = torch.nonzero(lexical[1]).squeeze(1)
+            if len(all_terms_matched) > 0:
+                candidates = all_terms_matched
+        elif lexical is not None and lexical_prune:
+            any_term_matched = torch.nonzero(lexical[0]).squeeze(1)
+            if lexical_prune_min_hits <= len(any_term_matched) < len(items):
+                # Only items with at least one query term are scored by the embedding model
+                candidates = any_term_matched
+
+        if candidates is not None:
+            similarities = torch.full((len(items),), -torch.inf)
+            similarities[candidates] = torch.as_tensor(
+                search_similarity_fn(query, [items[i] for i in candidates.tolist()]), dtype=torch.float)
+        else:
+            similarities = torch.as_tensor(search_similarity_fn(query, items), dtype=torch.float)
+        top_indices = select(similarities, _top_p)
         top_raw_scores = similarities[top_indices]
         return top_indices[top_raw_scores > _min_cos_sim].tolist()
 
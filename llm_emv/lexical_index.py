@@ -0,0 +1,107 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from em.tree_layout import TreeLayout
+
+_WORD_RE = re.compile(r'[A-Za-z0-9]+')
+# Splits CamelCase identifiers like LoadDishwasher or NavigateToNamedLocation
+_WORD_PART_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'at', 'for', 'with', 'from', 'by', 'is', 'are', 'was',
+    'were', 'be', 'been', 'did', 'do', 'does', 'i', 'you', 'me', 'my', 'your', 'it', 'its', 'what', 'when', 'where',
+    'which', 'who', 'how', 'that', 'this', 'there', 'after', 'before', 'any', 'some',
+}
+
+
+def _normalize(token: str) -> str:
+    token = token.lower()
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        token = token[:-1]  # Poor man's stemming, enough for plural object names
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        parts = _WORD_PART_RE.findall(word)
+        tokens.extend(_normalize(p) for p in parts)
+        if len(parts) > 1:
+            tokens.append(_normalize(word))  # Also index the full identifier, e.g. "loaddishwasher"
+    return [t for t in tokens if t not in _STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    BM25 over the deduplicated strings of a TreeLayout, with an inverted list from token to strings.
+    Like the embedding search, a node scores the max over the strings of its (recursive) index content.
+    Built on the first search, since it reads all strings (e.g. of a history store, see em.history_store).
+    """
+
+    def __init__(self, layout: TreeLayout, k1=1.2, b=0.75):
+        super().__init__()
+        self.layout = layout
+        self._k1 = k1
+        self._b = b
+        self._vocabulary: Optional[Dict[str, int]] = None
+
+    def _build(self):
+        layout, k1, b = self.layout, self._k1, self._b
+        vocabulary = {}
+        postings: List[Dict[int, int]] = []  # token -> {string id: term frequency}
+        lengths = np.zeros(len(layout.strings), dtype=np.float32)
+        for i, s in enumerate(layout.strings):
+            tokens = tokenize(s)
+            lengths[i] = len(tokens)
+            for t in tokens:
+                tid = vocabulary.setdefault(t, len(vocabulary))
+                if tid == len(postings):
+                    postings.append({})
+                postings[tid][i] = postings[tid].get(i, 0) + 1
+
+        # CSR layout: strings containing token t are _posting_ids[_posting_offsets[t]:_posting_offsets[t + 1]]
+        self._posting_offsets = np.cumsum([0] + [len(p) for p in postings]).astype(np.int64)
+        self._posting_ids = np.array([i for p in postings for i in p.keys()], dtype=np.int64)
+        tf = np.array([f for p in postings for f in p.values()], dtype=np.float32)
+        num_docs = max(len(layout.strings), 1)
+        doc_freq = np.diff(self._posting_offsets).astype(np.float32)
+        self._idf = np.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = max(lengths.mean(), 1) if len(lengths) else 1
+        doc_lengths = lengths[self._posting_ids] if len(self._posting_ids) else np.zeros(0, dtype=np.float32)
+        # Per-posting BM25 term weight without the idf, precomputed since the strings never change
+        self._posting_weights = tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_lengths / avg_length))
+        self._vocabulary = vocabulary
+
+    def string_scores(self, query: str) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Returns BM25 score and number of matched query tokens per string, and the number of query tokens."""
+        if self._vocabulary is None:
+            self._build()
+        scores = np.zeros(len(self.layout.strings), dtype=np.float32)
+        matched = np.zeros(len(self.layout.strings), dtype=np.int32)
+        query_tokens = set(tokenize(query))
+        for t in query_tokens:
+            tid = self._vocabulary.get(t)
+            if tid is None:
+                continue
+            start, end = self._posting_offsets[tid], self._posting_offsets[tid + 1]
+            ids = self._posting_ids[start:end]
+            scores[ids] += self._idf[tid] * self._posting_weights[start:end]
+            matched[ids] += 1
+        return scores, matched, len(query_tokens)
+
+    def search(self, query: str, items: List[Any]) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Returns per item the best BM25 score of its strings, and whether one of its strings contains all query tokens.
+        Returns None if the query has no searchable tokens or some item is not part of the layout.
+        """
+        numbers = [self.layout.number_of(getattr(item, '_wrapped', item)) for item in items]
+        if any(n is None for n in numbers):
+            return None
+        scores, matched, num_query_tokens = self.string_scores(query)
+        if num_query_tokens == 0:
+            return None
+        item_scores = self.layout.segment_max(scores, numbers)
+        item_matched = self.layout.segment_max(matched, numbers)
+        return torch.from_numpy(item_scores), torch.from_numpy(item_matched == num_query_tokens)
@@ -0,0 +1,189 @@
+import hashlib
+import threading
+from typing import Any, Callable, List, Tuple
+
+import numpy as np
+import torch
+
+from em.tree_layout import TreeLayout
+from .ann_index import load_or_build_vector_index
+
+
+class SearchEmbeddingIndex:
+    """
+    One embedding matrix for the whole history.
+
+    Row i of the matrix is the (L2-normalized) embedding of layout.strings[i]. Strings are embedded lazily, the first
+    time a node containing them is searched. Nodes do not hold embeddings themselves, only their range into
+    layout.occurrences, so a string shared by many nodes (and by all ancestors of a node) is stored exactly once.
+    """
+
+    def __init__(self, layout: TreeLayout, embedding_fn: Callable[[List[str]], torch.Tensor]):
+        super().__init__()
+        self.layout = layout
+        self._embedding_fn = embedding_fn
+        self._embeddings: torch.Tensor = None  # (number of strings, H), allocated with the first embedding
+        self._embedded = np.zeros(len(layout.strings), dtype=bool)
+        self._num_embedded = 0
+        self._lock = threading.Lock()  # Strings may be embedded by a background warm-up concurrently
+
+    @property
+    def can_embed(self):
+        return self._embedding_fn is not None
+
+    @property
+    def num_embedded(self):
+        return self._num_embedded
+
+    def is_embedded(self, string_ids: np.ndarray) -> np.ndarray:
+        return self._embedded[string_ids]
+
+    @property
+    def embeddings(self) -> torch.Tensor:
+        return self._embeddings
+
+    @property
+    def nbytes(self):
+        matrix_bytes = 0 if self._embeddings is None else self._embeddings.element_size() * self._embeddings.nelement()
+        return matrix_bytes + self._embedded.nbytes + self.layout.nbytes
+
+    def ensure_embedded(self, string_ids: np.ndarray):
+        string_ids = np.unique(string_ids)
+        missing = string_ids[~self._embedded[string_ids]]
+        if len(missing) == 0:
+            return
+        # Embedding happens outside the lock, so a search does not wait for a running warm-up batch
+        embeddings = self._embed([self.layout.strings[i] for i in missing])
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = torch.zeros(len(self.layout.strings), embeddings.shape[1])
+            new = ~self._embedded[missing]
+            self._embeddings[torch.from_numpy(missing[new]).long()] = embeddings[torch.from_numpy(new)]
+            self._embedded[missing] = True
+            self._num_embedded += int(new.sum())
+
+    def _embed(self, texts: List[str]) -> torch.Tensor:
+        embeddings = torch.as_tensor(self._embedding_fn(texts)).detach().float().cpu()
+        return torch.nn.functional.normalize(embeddings, dim=-1)
+
+    def embed_query(self, query: str) -> torch.Tensor:
+        return self._embed([query])[0]
+
+    def string_similarities(self, query: str) -> torch.Tensor:
+        # Cosine similarity of the query to every string. Strings that are not embedded yet score 0.
+        return self._embeddings @ self.embed_query(query)
+
+    def similarities(self, query: str, items: List[Any]) -> torch.Tensor:
+        """Max cosine similarity between the query and the index content of each item."""
+        if self._embedding_fn is None or len(items) == 0:
+            return torch.zeros(len(items))
+
+        numbers = [self.layout.number_of(getattr(item, '_wrapped', item)) for item in items]
+        ranges = [self.layout.index_content_ids(n) if n is not None else None for n in numbers]
+        indexed = [r for r in ranges if r is not None and len(r) > 0]
+        if indexed:
+            self.ensure_embedded(np.concatenate(indexed))
+
+        result = torch.zeros(len(items))
+        if indexed:
+            string_sims = self.string_similarities(query)
+            lengths = torch.tensor([len(r) for r in indexed])
+            max_sims = torch.segment_reduce(string_sims[torch.from_numpy(np.concatenate(indexed)).long()], 'max',
+                                            lengths=lengths)
+            mask = torch.tensor([r is not None and len(r) > 0 for r in ranges])
+            result[mask] = max_sims
+
+        for i, (item, n) in enumerate(zip(items, numbers)):
+            if n is None:
+                # Not part of the indexed tree, embed directly without caching
+                texts = [s for s in item.index_content if s]
+                if texts:
+                    result[i] = (self._embed(texts) @ self.embed_query(query)).max()
+        return result
+
+    def deep_search(self, query: str, node: Any, k: int) -> List[Tuple[int, ...]]:
+        """
+        Scores every node below `node` (at all levels) by the max similarity of its own index content to the query.
+        Returns the child index paths (relative to `node`) of the k best nodes, best first. Ties go to the more
+        recent node.
+        """
+        layout = self.layout
+        root = layout.number_of(getattr(node, '_wrapped', node))
+        if self._embedding_fn is None or root is None:
+            return []
+        first_occ, last_occ = layout.occ_start[root], layout.occ_end[root]
+        if first_occ == last_occ:
+            return []
+        self.ensure_embedded(layout.occurrences[first_occ:last_occ])
+        occ_sims = self.string_similarities(query).numpy()[layout.occurrences[first_occ:last_occ]]
+
+        # The own ranges of consecutive nodes are adjacent, so one reduceat over the non-empty ones gives all own maxima
+        numbers = np.arange(root + 1, layout.subtree_end[root])
+        numbers = numbers[layout.own_end[numbers] > layout.occ_start[numbers]]
+        if len(numbers) == 0:
+            return []
+        scores = np.maximum.reduceat(occ_sims, layout.occ_start[numbers] - first_occ)
+        best = np.lexsort((-numbers, -scores))[:k]
+        return [layout.path_to(n, root) for n in numbers[best]]
+
+
+class ApproximateLeafSearch:
+    """
+    Search over a fixed flat list of leaves (e.g. all_leaves) that only looks at the leaves containing one of the
+    n_candidates strings most similar to the query. These strings are found with an approximate nearest neighbour
+    index (see ann_index), the leaves containing them with an inverted list from string to leaf.
+
+    Leaves without any candidate string score -inf, so they are never search results. For all other leaves, the
+    score equals the exact one as long as the nearest neighbour search does not miss a closer string.
+    """
+
+    def __init__(self, index: SearchEmbeddingIndex, leaves: List[Any], n_candidates=256, backend='auto',
+                 persist_path_prefix=None, **backend_kwargs):
+        super().__init__()
+        layout = index.layout
+        self._index = index
+        self._leaves = leaves
+        self._n_candidates = n_candidates
+
+        numbers = np.array([layout.number_of(leaf) for leaf in leaves], dtype=np.int64)
+        lengths = layout.occ_end[numbers] - layout.occ_start[numbers]
+        string_ids = np.concatenate([np.empty(0, dtype=np.int32)] + [layout.index_content_ids(n) for n in numbers])
+        leaf_positions = np.repeat(np.arange(len(leaves)), lengths)
+
+        self._string_ids, local_ids = np.unique(string_ids, return_inverse=True)
+        # Inverted list: leaves containing local string i are _postings[_posting_offsets[i]:_posting_offsets[i + 1]]
+        order = np.argsort(local_ids, kind='stable')
+        self._postings = leaf_positions[order]
+        self._posting_offsets = np.searchsorted(local_ids[order], np.arange(len(self._string_ids) + 1))
+
+        self._vector_index = None
+        if len(self._string_ids) == 0:
+            return
+        index.ensure_embedded(self._string_ids)
+        vectors = np.ascontiguousarray(index.embeddings[torch.from_numpy(self._string_ids).long()].numpy())
+        # A persisted index is only reused for the same strings and the same embedding model
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update('\n'.join(layout.strings[i] for i in self._string_ids).encode('utf-8'))
+        digest.update(vectors.tobytes())
+        self._vector_index = load_or_build_vector_index(vectors, digest.hexdigest(), backend, persist_path_prefix,
+                                                        **backend_kwargs)
+
+    def _is_own_leaf_list(self, items: List[Any]):
+        return len(items) == len(self._leaves) and (len(items) == 0 or (
+                items[0] is self._leaves[0] and items[-1] is self._leaves[-1]))
+
+    def similarities(self, query: str, items: List[Any]) -> torch.Tensor:
+        if not self._is_own_leaf_list(items):
+            return self._index.similarities(query, items)
+        if self._vector_index is None:
+            return torch.zeros(len(items))
+        query_emb = self._index.embed_query(query).numpy()
+        local_ids, sims = self._vector_index.search(query_emb, self._n_candidates)
+        if len(local_ids) == 0:
+            return torch.zeros(len(items))
+
+        starts, ends = self._posting_offsets[local_ids], self._posting_offsets[local_ids + 1]
+        positions = np.concatenate([self._postings[s:e] for s, e in zip(starts, ends)])
+        result = np.full(len(items), -np.inf, dtype=np.float32)
+        np.maximum.at(result, positions, np.repeat(sims.astype(np.float32), ends - starts))
+        return torch.from_numpy(result)
@@ -1,18 +1,18 @@
 import datetime
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Dict
 
 import torch
 from langchain_core.language_models import BaseChatModel
-from sentence_transformers import SentenceTransformer
 
 from em.em_tree import HigherLevelSummary
 from lmp.api_visibility_wrapper import ApiVisibilityWrapper
+from lmp.embedding_service import get_embedding_service
 from lmp.namespace import DynamicNamespaceDict
 from lmp.repl.code_execution import ReplExecutionEnvironment
 from lmp.setup import load_config, setup_lmp, instantiate_llm, instantiate_error_handlers
+from .embedding_store import MmapEmbeddingStore
 from .emv_api import EMVerbalizationAPI
 from .simplified_agent.simple_coding_emv import SimplifiedCodingEMV
 from .vlm import OpenAiVision
@@ -47,13 +47,14 @@ def setup_llm_emv(cfg_path='teach/simplified/full',
                   history: HigherLevelSummary = None,
                   now_time: datetime.datetime = None,
                   wait_for_trigger_callback=lambda: {'type': 'dialog', 'text': input('User:')},
-                  tts=lambda s: print('System:', s)):
+                  tts=lambda s: print('System:', s),
+                  history_path: Path = None):
     if history is None:
         raise ValueError('history == None')
     full_cfg_path = Path(__file__).parent / 'config' / f'{cfg_path}.yaml'
     cfg = load_config(full_cfg_path, ((None, ('base', 'loop_prevention', 'suffix')),
                                       ('simplified_coding',
-                                       ('system', 'usage', 'user_question', 'history', 'final_try'))))
+                                       ('system', 'usage', 'user_question', 'history', 'history_diff', 'final_try'))))
 
     # 直接用一个 LLM 做一次性的 semi-flat QA（可能是把历史压平后问大模型）
     # 返回的是已经绑定了 history 的偏函数 → 调用时只需要给问题即可                                
@@ -65,7 +66,12 @@ def setup_llm_emv(cfg_path='teach/simplified/full',
         return partial(model, history)
 
     vlm = _instantiate_vlm(cfg.pop('question_vlm', None))
-    search_emb, filter_kwargs = create_search_embedding_and_cfg(cfg.pop('search', None))
+    search_cfg = cfg.pop('search', None)
+    search_ann_kwargs = search_cfg.pop('ann', None) if search_cfg is not None else None
+    # Opt-in BM25 stage in front of the embedding search, see search_similarity_to_filter_fn
+    search_lexical_index = search_cfg.pop('lexical', False) if search_cfg is not None else False
+    search_warmup = search_cfg.pop('warmup', None) if search_cfg is not None else None
+    search_emb, filter_kwargs = create_search_embedding_and_cfg(search_cfg)
     # noinspection PyTypeChecker
     api = EMVerbalizationAPI(
         wait_for_trigger=wait_for_trigger_callback, 
@@ -75,7 +81,11 @@ def setup_llm_emv(cfg_path='teach/simplified/full',
         hierarchy_level=cfg.pop('hierarchy_level', 'deep'),
         vlm=vlm, 
         search_embedding_fn=search_emb, 
-        search_filter_kwargs=filter_kwargs)
+        search_filter_kwargs=filter_kwargs,
+        search_ann_kwargs=search_ann_kwargs,
+        search_lexical_index=search_lexical_index,
+        search_warmup=search_warmup,
+        history_path=history_path)
 
     # 用来控制哪些方法/属性暴露给 LLM（防止 prompt 里误调用危险函数）
     api = ApiVisibilityWrapper(api, **cfg.pop('api'))
@@ -124,44 +134,38 @@ def create_search_embedding_and_cfg(search_cfg: Optional[dict]):
         return None, None
 
     embedding_model_name = search_cfg.pop('embedding', 'all-MiniLM-L6-v2')
-    embedding_model = SentenceTransformer(embedding_model_name)
-    cache = {}
-    cache_file = Path('search-embedding-cache.pt')
-    if cache_file.is_file():
-        cache = torch.load(cache_file, map_location=embedding_model.device)
-    write_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-emb-cache-writer')
+    embedding_service = get_embedding_service(embedding_model_name, **search_cfg.pop('service', {}))
+    store = MmapEmbeddingStore(
+        Path(search_cfg.pop('cache_dir', 'search-embedding-cache')) / embedding_model_name.replace('/', '__'),
+        dim=embedding_service.dimension)
+    legacy_cache_file = Path('search-embedding-cache.pt')
+    if len(store) == 0 and legacy_cache_file.is_file():
+        print('Importing', legacy_cache_file, 'into', store.directory)
+        store.import_dict({text: emb.cpu().numpy()
+                           for text, emb in torch.load(legacy_cache_file, map_location='cpu').items()})
 
     def _embed_cached(texts: Tuple[str, ...]):
-        result = torch.empty(len(texts), embedding_model.get_sentence_embedding_dimension(),
-                             device=embedding_model.device)
-        todo_texts, todo_indices = [], []
-        for i, text in enumerate(texts):
-            if text in cache:
-                result[i] = cache[text]
-            else:
-                todo_texts.append(text)
-                todo_indices.append(i)
+        result = torch.empty(len(texts), embedding_service.dimension, device=embedding_service.device)
+        rows = store.lookup(texts)
+        cached_indices = [i for i, r in enumerate(rows) if r is not None]
+        todo_indices = [i for i, r in enumerate(rows) if r is None]
+        todo_texts = [texts[i] for i in todo_indices]
 
         print('Embedding', len(texts), ', new:', len(todo_texts))
+        if cached_indices:
+            result[cached_indices] = torch.from_numpy(
+                store.rows([rows[i] for i in cached_indices])).to(embedding_service.device)
         if todo_indices:
-            new_embeddings = embedding_model.encode(list(todo_texts), convert_to_tensor=True)
+            # Only single texts (search queries) go through the LRU, bulk index content would just evict them
+            new_embeddings = embedding_service.encode(todo_texts, lru=len(todo_texts) == 1)
             result[todo_indices] = new_embeddings
-            for text, emb in zip(todo_texts, new_embeddings):
-                cache[text] = emb
-            write_cache_executor.submit(lambda: torch.save(dict(cache), cache_file))
+            store.append(todo_texts, new_embeddings.float().cpu().numpy())
         return result
 
     def _embed(texts: List[str]):
-        original_to_unique_indices = []
-        unique_entries: List[str] = []
-        for text in texts:
-            try:
-                idx = unique_entries.index(text)
-                original_to_unique_indices.append(idx)
-            except ValueError:
-                original_to_unique_indices.append(len(unique_entries))
-                unique_entries.append(text)
+        unique_entries: Dict[str, int] = {}
+        original_to_unique_indices = [unique_entries.setdefault(text, len(unique_entries)) for text in texts]
         embeddings = _embed_cached(tuple(unique_entries))
-        return torch.index_select(embeddings, 0, torch.tensor(original_to_unique_indices))
+        return torch.index_select(embeddings, 0, torch.tensor(original_to_unique_indices, device=embeddings.device))
 
     return _embed, search_cfg.pop('filter_kwargs', {})
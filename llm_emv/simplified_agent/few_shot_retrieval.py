@@ -2,13 +2,13 @@ import re
 from types import SimpleNamespace
 from typing import List, Callable
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_core.example_selectors import SemanticSimilarityExampleSelector
 from langchain_core.messages import HumanMessage, BaseMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate
 
+from lmp.embedding_service import get_embedding_service, EmbeddingServiceLangchainAdapter
 from lmp.setup import instantiate_llm
 
 
@@ -48,9 +48,7 @@ class SimpleFewShotRetriever:
             else:
                 self.question_modifier_chain = None
 
-            embeddings = HuggingFaceEmbeddings(
-                model_name=sentence_similarity_model
-            )
+            embeddings = EmbeddingServiceLangchainAdapter(get_embedding_service(sentence_similarity_model))
             self.example_selector = SemanticSimilarityExampleSelector.from_examples(
                 examples=example_db,
                 input_keys=['question' if question_modifier_llm is None else 'modified_question'],
@@ -7,7 +7,10 @@ from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from langchain_openai import ChatOpenAI
 
 from llm_emv.interactive_tree import ExpandableList, recursive_apply
+from llm_emv.history_diff import HistoryStateMessages
 from llm_emv.simplified_agent.few_shot_retrieval import SimpleFewShotRetriever
+from llm_emv.token_budget import TokenBudgetRenderer
+from llm_emv.tree_renderers import HISTORY_FORMATS
 from lmp.code_execution import CodeExecutionEnvironment
 from lmp.repl.code_execution import ReplExecutionEnvironment
 from lmp.repl.error_handlers import ErrorHandler
@@ -25,7 +28,14 @@ class SimplifiedCodingEMV:
             error_handlers: List[ErrorHandler],
             max_rounds=10,
             exclude_imports=None,
-            force_initial_command=None
+            force_initial_command=None,
+            # Max. number of tokens of the rendered history in the prompt, less relevant subtrees are elided to fit
+            history_token_budget=None,
+            # If set, the full history is only sent in the first round and then every n rounds,
+            # the other rounds only send the changes (see llm_emv.history_diff)
+            history_diff_resync_interval=None,
+            # How the history is rendered into the prompt, a key of llm_emv.tree_renderers.HISTORY_FORMATS
+            history_format='repr',
     ):
         super().__init__()
         self._force_initial_command = force_initial_command
@@ -46,6 +56,18 @@ class SimplifiedCodingEMV:
         else:
             self._tokenizer = None
 
+        if history_format not in HISTORY_FORMATS:
+            raise ValueError(f'Unknown history_format {history_format}, expected one of {list(HISTORY_FORMATS)}')
+        if history_token_budget is not None:
+            self._render_history = TokenBudgetRenderer(
+                history_token_budget,
+                (lambda text: len(self._tokenizer.encode(text))) if self._tokenizer else None,
+                render=HISTORY_FORMATS[history_format])
+        else:
+            self._render_history = HISTORY_FORMATS[history_format]
+        self._history_states = HistoryStateMessages(self._render_history, history_diff_resync_interval) \
+            if history_diff_resync_interval is not None else None
+
         self._retriever = SimpleFewShotRetriever(prompt_db=prompt_cfg.pop('prompt_db', []),
                                                  **prompt_cfg.get('retrieval', {}))
         # noinspection PyTypeChecker
@@ -63,8 +85,16 @@ class SimplifiedCodingEMV:
         question = self._exec_hist.items[0]
         assert isinstance(question, ExecutionHistory.ExecutionResult)
 
+        # With diffs, the state messages of the previous rounds stay in the conversation, before the command of the
+        # round they were sent in. The trailing input prompt is where the command of this round will be
+        state_msgs = []
+        if self._history_states is not None and not loop_detected:
+            state_msgs = self._history_states.update(self._history, len(self._exec_hist.items) - 1)
+
         history_msgs = []
-        for i, item in enumerate(self._exec_hist.items[1:]):
+        for i, item in enumerate(self._exec_hist.items[1:], start=1):
+            history_msgs.extend(self._format_state_message(is_full, text)
+                                for position, is_full, text in state_msgs if position == i)
             if isinstance(item, ExecutionHistory.Command):
                 history_msgs.append(AIMessage(item.code))
             elif isinstance(item, ExecutionHistory.ExecutionResult):
@@ -74,9 +104,8 @@ class SimplifiedCodingEMV:
         user_question_msg = HumanMessage(
             self._prompt_cfg['user_question_prompt'].format(question=question.content)
         )
-        state_msg = HumanMessage(
-            self._prompt_cfg['history_prompt'].format(history=repr(self._history))
-        )
+        state_msg = self._format_state_message(True, self._render_history(self._history)) \
+            if len(state_msgs) == 0 else None
         result = [
             SystemMessage(self._prompt_cfg['final_try_prompt']),
             user_question_msg,
@@ -91,7 +120,7 @@ class SimplifiedCodingEMV:
             *self._retriever(question.content),
             user_question_msg,
             *history_msgs,
-            state_msg,
+            *([state_msg] if state_msg is not None else []),
         ]
         if self._tokenizer:
             token_count = 3  # every reply is primed with <|start|>assistant<|message|>
@@ -102,8 +131,15 @@ class SimplifiedCodingEMV:
 
         return result
 
+    def _format_state_message(self, is_full: bool, text: str):
+        if is_full:
+            return HumanMessage(self._prompt_cfg['history_prompt'].format(history=text))
+        return HumanMessage(self._prompt_cfg['history_diff_prompt'].format(changes=text))
+
     def __call__(self, question: str):
         self._history.collapse_deep()
+        if self._history_states is not None:
+            self._history_states.reset()
         self._exec_hist.items.clear()
         self._exec_hist.items.append(ExecutionHistory.ExecutionResult(question))
 
@@ -127,10 +163,11 @@ class SimplifiedCodingEMV:
                 code, _ = self._llm_to_python_console_helper(loop_detected_flag=steps == self._max_rounds)
                 self._exec_hist.items.append(ExecutionHistory.Command(code))
 
-                previous_history = repr(self._history)
+                # Compared as shown in the prompt: expanding an elided node makes it visible without changing the tree
+                previous_history = self._render_history(self._history)
                 results = self.code_execution_env(code)
                 if (len(results) == 1 and isinstance(results[0], ExpandableList)
-                        and repr(self._history) == previous_history):
+                        and self._render_history(self._history) == previous_history):
                     no_change_counter += 1
                     if no_change_counter > 2:
                         results = [
@@ -0,0 +1,130 @@
+from typing import Callable, List, Optional
+
+from llm_emv.interactive_tree import ExpandableList
+
+
+def estimate_tokens(text: str) -> int:
+    # About 4 characters per token for English text, if the tokenizer of the model is not known
+    return (len(text) + 3) // 4
+
+
+class TokenBudgetRenderer:
+    """
+    Renders an interactive tree like render (repr by default, see llm_emv.tree_renderers), but elides the children
+    of the least relevant expanded nodes until the rendering fits into max_tokens. Elided nodes are rendered as
+    collapsed, with a note how many expanded entries are not shown. Relevance is the recency of the action that
+    expanded a node (search results ranked by their score), and a node is as relevant as the most relevant node below
+    it. Among equally relevant nodes, deeper and earlier ones are elided first.
+    The result only depends on the state of the tree, so unchanged trees render to the same prompt.
+    Only the elision flags that change are set, so the render cache of the rest of the tree stays valid.
+    """
+
+    def __init__(self, max_tokens: int, count_tokens: Callable[[str], int] = None,
+                 render: Callable[[ExpandableList], str] = repr):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or estimate_tokens
+        self.render = render
+        self._elided: List[ExpandableList] = []
+        self._last = None  # (tree, its render cache, elision candidates, max_tokens) of the last call
+
+    def __call__(self, tree: ExpandableList) -> str:
+        candidates = sorted(_elision_candidates(tree), key=lambda c: c[0])
+        if self._is_unchanged(tree, candidates):
+            rendered = self.render(tree)
+            if tree._render_cache is self._last[1]:
+                return rendered
+
+        # Elision is decided from scratch, the render caches of the current state are restored afterwards
+        cached = [(node, node._render_cache) for node in _visible_nodes(tree)]
+        previous = self._elided
+        for node in previous:
+            node._elided = False
+        self._elided = []
+        self._elide(tree, list(candidates))
+        for node, cache in cached:
+            node._render_cache = cache
+        previous_ids, elided_ids = {id(node) for node in previous}, {id(node) for node in self._elided}
+        for node in previous + self._elided:
+            if (id(node) in previous_ids) != (id(node) in elided_ids):
+                node._mark_dirty()
+
+        rendered = self.render(tree)
+        self._last = (tree, tree._render_cache, candidates, self.max_tokens)
+        return rendered
+
+    def _is_unchanged(self, tree: ExpandableList, candidates) -> bool:
+        # Same tree state as in the last call: the render cache of the root was not reset, and the nodes are equally
+        # relevant. Only known for repr, which fills the render cache
+        if self._last is None:
+            return False
+        last_tree, last_cache, last_candidates, last_max_tokens = self._last
+        return (last_tree is tree and last_cache is not None and tree._render_cache is last_cache
+                and last_max_tokens == self.max_tokens
+                and len(candidates) == len(last_candidates)
+                and all(a[1] is b[1] for a, b in zip(candidates, last_candidates)))
+
+    def _elide(self, tree: ExpandableList, candidates):
+        num_tokens = self.count_tokens(self.render(tree))
+        while num_tokens > self.max_tokens and len(candidates) > 0:
+            # Token counts of the subtrees are estimates of what eliding saves, the result is counted again
+            for i, (_, node) in enumerate(candidates):
+                if num_tokens <= self.max_tokens:
+                    break
+                if _has_elided_ancestor(node):
+                    continue
+                before = self.count_tokens(self.render(node))
+                node._elided = True
+                self._elided.append(node)
+                num_tokens -= before - self.count_tokens(self.render(node))
+            else:
+                i = len(candidates)
+            candidates = candidates[i:]
+            num_tokens = self.count_tokens(self.render(tree))
+
+
+def _expanded_children(node) -> list:
+    if not isinstance(node, ExpandableList):
+        return []
+    children = node.children
+    return [children[i] for i in node._expanded_indices() if isinstance(children[i], ExpandableList)]
+
+
+def _visible_nodes(tree: ExpandableList) -> List[ExpandableList]:
+    result = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        stack.extend(_expanded_children(node))
+    return result
+
+
+def _elision_candidates(tree: ExpandableList):
+    # (sort key, node) of all visible nodes with expanded children, below the root
+    result = []
+    order = 0
+
+    def visit(node, depth) -> tuple:
+        nonlocal order
+        order += 1
+        relevance = node._relevance + (order,)
+        children = _expanded_children(node)
+        for c in children:
+            relevance = max(relevance, visit(c, depth + 1))
+        if depth > 0 and len(children) > 0:
+            result.append(((relevance, -depth), node))
+        return relevance
+
+    for child in _expanded_children(tree):
+        visit(child, 1)
+    return result
+
+
+def _has_elided_ancestor(node: ExpandableList) -> bool:
+    parent: Optional[ExpandableList] = node._parent
+    while parent is not None:
+        if parent._elided:
+            return True
+        parent = parent._parent
+    return False
@@ -0,0 +1,183 @@
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from em.em_tree import SceneGraphInstant, node_class
+from llm_emv.interactive_tree import ExpandableList, ExpandableTreeNode, INDENT_SIZE, MIN_SUMMARIZED_RUN, \
+    collapsed_run_info, format_collapsed_run, format_datetime_range, format_elided, indent_following_lines
+
+# Renders an interactive tree, or a subtree of it, for the prompt. repr is the Python-like default
+TreeRenderer = Callable[[ExpandableList], str]
+
+
+def _visible_children(node: ExpandableList) -> Iterator[Tuple[int, int, Any]]:
+    # (start, end, child) of the expanded children, (start, end, None) of the runs of collapsed ones between them
+    children = node.children
+    run_start = 0
+    for i in node._expanded_indices() + [len(children)]:
+        if run_start < i:
+            yield run_start, i, None
+        if i < len(children):
+            yield i, i + 1, children[i]
+        run_start = i + 1
+
+
+def _single_day(time_range: Tuple[datetime, datetime]) -> Optional[date]:
+    return time_range[0].date() if time_range[0].date() == time_range[1].date() else None
+
+
+def _format_range(time_range: Tuple[datetime, datetime], day: Optional[date]) -> str:
+    # Without the date if the parent is on the same day, and only one time if start and end look the same
+    range_str = format_datetime_range(*time_range)
+    if day is not None and _single_day(time_range) == day:
+        range_str = range_str[len('2000/01/01 '):]
+    start_str, end_str = range_str.split(' - ')
+    return start_str if start_str.endswith(end_str) else range_str
+
+
+def _format_time(timestamp: datetime, day: Optional[date]) -> str:
+    return timestamp.strftime('%H:%M:%S' if timestamp.date() == day else '%Y/%m/%d %H:%M:%S')
+
+
+def _format_call(name: str, parameters: Optional[dict], state: Optional[str]) -> str:
+    # Like the goal and action summaries, e.g. 'HandOverObjectToHuman(arm=0) <Running>'
+    if isinstance(parameters, dict):
+        parameters = parameters.get('parameters', parameters)
+        if isinstance(parameters, dict) and len(parameters) > 0:
+            name += '(' + ', '.join(f'{k}={v}' for k, v in parameters.items()) + ')'
+    return name + (f' <{state}>' if state else '')
+
+
+def scene_fields(scene: SceneGraphInstant) -> Dict[str, Any]:
+    # The content of a scene, without the dataclass repr of the scene and its raw data
+    raw = scene.raw
+    fields = {}
+    if raw.current_goal:
+        fields['goal'] = _format_call(raw.current_goal, None, raw.current_goal_state)
+    if raw.current_action:
+        fields['action'] = _format_call(raw.current_action, raw.current_action_parameters, raw.current_action_state)
+    if raw.asr_recognition:
+        fields['heard'] = raw.asr_recognition
+    if scene.objects:
+        fields['objects'] = ', '.join(f'{o.obj_class} [{o.state}]' if o.state else o.obj_class for o in scene.objects)
+    relations = scene.nl_graph_summary.splitlines()[1:]  # The first line lists the objects
+    if relations:
+        fields['relations'] = '; '.join(relations)
+    if raw.image is not None:
+        fields['image'] = True
+    return fields
+
+
+def _outline_leaf(leaf, day: Optional[date]) -> str:
+    if node_class(leaf) is not SceneGraphInstant:
+        return repr(leaf)
+    fields = scene_fields(leaf)
+    image = fields.pop('image', False)
+    text = '; '.join(f'{k}: "{v}"' if k == 'heard' else f'{k}: {v}' for k, v in fields.items())
+    return _format_time(leaf.raw.timestamp, day) + ': ' + text + (' [image]' if image else '')
+
+
+def render_outline(tree: ExpandableList) -> str:
+    """
+    Indented outline of the visible nodes, one line per node: 'index: time range: summary'. Collapsed nodes end with
+    the number of their children, scenes are shown by their goal, action, speech and objects.
+    """
+    lines = []
+    _outline(tree, None, 0, None, lines)
+    return '\n'.join(lines)
+
+
+def _outline(node, index: Optional[int], depth: int, day: Optional[date], lines: List[str]):
+    indent = ' ' * INDENT_SIZE * depth
+    prefix = indent + (f'{index}: ' if index is not None else '')
+    if not isinstance(node, ExpandableList):
+        lines.append(prefix + indent_following_lines(_outline_leaf(node, day), len(indent) + INDENT_SIZE))
+        return
+    header = None
+    if isinstance(node, ExpandableTreeNode):
+        if len(node.children) == 0:
+            lines.append(prefix + indent_following_lines(_outline_leaf(node._wrapped, day), len(indent) + INDENT_SIZE))
+            return
+        header = _format_range(node._wrapped.range, day)
+        if node._wrapped.nl_summary:
+            header += ': ' + indent_following_lines(node._wrapped.nl_summary, len(indent) + INDENT_SIZE)
+        day = _single_day(node._wrapped.range)
+
+    expanded = node._expanded_indices()
+    if header is None and index is None:
+        child_depth = depth  # Root list without a node of its own, e.g. all_leaves
+    else:
+        lines.append(prefix + (header or '') + ('' if expanded else f' [{len(node.children)} collapsed]'))
+        child_depth = depth + 1
+    child_indent = ' ' * INDENT_SIZE * child_depth
+    if len(expanded) == 0:
+        if header is None and index is None:
+            lines.append(child_indent + f'[{len(node.children)} collapsed]')
+    elif node._elided:
+        lines.append(child_indent + format_elided(len(expanded)))
+    else:
+        children = node.children
+        for start, end, child in _visible_children(node):
+            if child is None:
+                lines.append(child_indent + format_collapsed_run(children, start, end))
+            else:
+                _outline(child, start, child_depth, day, lines)
+
+
+def render_json_lines(tree: ExpandableList) -> str:
+    """
+    One JSON object per visible node, in tree order. Nodes have their child index path, runs of collapsed children
+    the path of their parent and the first and last index.
+    """
+    lines = []
+    _json_lines(tree, (), lines)
+    return '\n'.join(json.dumps(line, ensure_ascii=False, separators=(',', ':'), default=str) for line in lines)
+
+
+def _json_leaf(leaf, path: Tuple[int, ...]) -> Dict[str, Any]:
+    if node_class(leaf) is not SceneGraphInstant:
+        return {'path': list(path), 'repr': repr(leaf)}
+    return {'path': list(path), 'time': leaf.raw.timestamp.isoformat(timespec='seconds'), **scene_fields(leaf)}
+
+
+def _json_lines(node, path: Tuple[int, ...], lines: List[Dict[str, Any]]):
+    if not isinstance(node, ExpandableList):
+        lines.append(_json_leaf(node, path))
+        return
+    line = {'path': list(path)}
+    if isinstance(node, ExpandableTreeNode):
+        if len(node.children) == 0:
+            lines.append(_json_leaf(node._wrapped, path))
+            return
+        start, end = node._wrapped.range
+        line.update(range=[start.isoformat(timespec='seconds'), end.isoformat(timespec='seconds')],
+                    summary=node._wrapped.nl_summary)
+
+    expanded = node._expanded_indices()
+    if len(expanded) == 0:
+        line['collapsed'] = len(node.children)
+    elif node._elided:
+        line['elided'] = len(expanded)
+    lines.append(line)
+    if len(expanded) == 0 or node._elided:
+        return
+    children = node.children
+    for start, end, child in _visible_children(node):
+        if child is not None:
+            _json_lines(child, path + (start,), lines)
+            continue
+        run = {'parent': list(path), 'collapsed': [start, end - 1]}
+        if end - start >= MIN_SUMMARIZED_RUN:
+            kind, time_range = collapsed_run_info(children, start, end)
+            run['kind'] = kind
+            if time_range is not None:
+                run['range'] = [t.isoformat(timespec='seconds') for t in time_range]
+        lines.append(run)
+
+
+# Selected with history_format in the agent config
+HISTORY_FORMATS: Dict[str, TreeRenderer] = {
+    'repr': repr,
+    'outline': render_outline,
+    'jsonl': render_json_lines,
+}
@@ -0,0 +1,192 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+import torch
+from langchain_core.embeddings import Embeddings
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    submitted: float = field(default_factory=time.perf_counter)
+    future: Future = field(default_factory=Future)
+
+
+class EmbeddingService:
+    """
+    One sentence embedding model shared by all callers in the process.
+
+    - encode() first looks up every text in an LRU cache (unless lru=False, e.g. for bulk indexing)
+    - the remaining texts are queued. A worker thread collects all requests arriving within max_batch_wait_s
+      (up to max_batch_texts texts) and runs them through the model in a single forward pass.
+    - stats() reports cache hit rate, batching and queue latency for tuning these parameters.
+    """
+
+    def __init__(self, model, lru_size=4096, max_batch_wait_s=0.002, max_batch_texts=1024):
+        super().__init__()
+        self.model = model
+        self._lru_size = lru_size
+        self._max_batch_wait_s = max_batch_wait_s
+        self._max_batch_texts = max_batch_texts
+        self._lru: 'OrderedDict[str, torch.Tensor]' = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._queue: 'queue.Queue[_Request]' = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._lru_hits = 0
+        self._lru_misses = 0
+        self._forward_passes = 0
+        self._texts_encoded = 0
+        self._requests_coalesced = 0
+        self._queue_latency_total = 0.
+        self._queue_latency_max = 0.
+        self._encode_time_total = 0.
+
+        self._worker = threading.Thread(target=self._run, name='embedding-service', daemon=True)
+        self._worker.start()
+
+    @property
+    def device(self):
+        return self.model.device
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], lru=True) -> torch.Tensor:
+        texts = list(texts)
+        if len(texts) == 0:
+            return torch.empty(0, self.dimension, device=self.device)
+
+        result: List[torch.Tensor] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        hits = 0
+        with self._lru_lock:
+            for i, t in enumerate(texts):
+                embedding = self._lru.get(t) if lru else None
+                if embedding is None:
+                    missing.setdefault(t, []).append(i)
+                else:
+                    self._lru.move_to_end(t)
+                    result[i] = embedding
+                    hits += 1
+        with self._stats_lock:
+            self._requests += 1
+            if lru:
+                self._lru_hits += hits
+                self._lru_misses += len(texts) - hits
+
+        if missing:
+            request = _Request(list(missing))
+            self._queue.put(request)
+            embeddings = request.future.result()
+            for t, embedding in zip(request.texts, embeddings):
+                for i in missing[t]:
+                    result[i] = embedding
+            if lru:
+                with self._lru_lock:
+                    for t, embedding in zip(request.texts, embeddings):
+                        self._lru[t] = embedding
+                    while len(self._lru) > self._lru_size:
+                        self._lru.popitem(last=False)
+        return torch.stack(result)
+
+    def _collect_batch(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        num_texts = len(batch[0].texts)
+        deadline = time.perf_counter() + self._max_batch_wait_s
+        while num_texts < self._max_batch_texts:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            num_texts += len(batch[-1].texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = list(dict.fromkeys(t for r in batch for t in r.texts))
+            start = time.perf_counter()
+            try:
+                embeddings = self.model.encode(texts, convert_to_tensor=True)
+            except BaseException as e:
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            with self._stats_lock:
+                self._forward_passes += 1
+                self._texts_encoded += len(texts)
+                self._requests_coalesced += len(batch)
+                self._encode_time_total += end - start
+                for r in batch:
+                    self._queue_latency_total += start - r.submitted
+                    self._queue_latency_max = max(self._queue_latency_max, start - r.submitted)
+
+            row_of_text = {t: i for i, t in enumerate(texts)}
+            for r in batch:
+                r.future.set_result(embeddings[[row_of_text[t] for t in r.texts]])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lru_lookups = self._lru_hits + self._lru_misses
+            return dict(
+                requests=self._requests,
+                lru_hit_rate=self._lru_hits / lru_lookups if lru_lookups else 0.,
+                lru_size=len(self._lru),
+                forward_passes=self._forward_passes,
+                texts_per_pass=self._texts_encoded / self._forward_passes if self._forward_passes else 0.,
+                requests_per_pass=self._requests_coalesced / self._forward_passes if self._forward_passes else 0.,
+                mean_queue_latency_ms=(1000 * self._queue_latency_total / self._requests_coalesced
+                                       if self._requests_coalesced else 0.),
+                max_queue_latency_ms=1000 * self._queue_latency_max,
+                mean_encode_ms=1000 * self._encode_time_total / self._forward_passes if self._forward_passes else 0.,
+            )
+
+
+class EmbeddingServiceLangchainAdapter(Embeddings):
+    """Lets langchain vector stores use the shared model instead of loading their own copy."""
+
+    def __init__(self, service: EmbeddingService):
+        super().__init__()
+        self.service = service
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.encode(texts, lru=False).cpu().tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.encode([text])[0].cpu().tolist()
+
+
+_services: Dict[Tuple[str, str], EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str, device: str = None, **kwargs) -> EmbeddingService:
+    """Returns the service for the given SentenceTransformer model, loading the model only once per process."""
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    name = model_name.lower()
+    if name.startswith('sentence-transformers/'):
+        name = name[len('sentence-transformers/'):]  # Both spellings load the same model
+    key = (name, device)
+    with _services_lock:
+        if key not in _services:
+            from sentence_transformers import SentenceTransformer
+            _services[key] = EmbeddingService(SentenceTransformer(model_name, device=device), **kwargs)
+        return _services[key]
+
+
+def all_embedding_service_stats() -> Dict[str, dict]:
+    with _services_lock:
+        return {name: service.stats() for (name, _), service in _services.items()}
@@ -7,7 +7,9 @@ from pathlib import Path
 from typing import Tuple, List
 
 import torch
-from sentence_transformers import util, SentenceTransformer
+from sentence_transformers import util
+
+from lmp.embedding_service import get_embedding_service
 
 END_OF_TASK = 'wait_for_trigger()'
 WAIT_FOR_USER_INPUT = re.compile(r"ask\(('[^']+'|\"[^\"]+\")\)|" + re.escape(END_OF_TASK))
@@ -43,9 +45,9 @@ class DynamicPromptBuilder:
         print('No custom prompt db' if self.custom_prompt_db_file is None else self.custom_prompt_db_file.resolve())
         self.custom_prompt_db = (json.loads(self.custom_prompt_db_file.read_text())
                                  if custom_prompt_db_file and self.custom_prompt_db_file.exists() else [])
-        self.sim_model = SentenceTransformer(sentence_similarity_model)
-        if device:
-            self.sim_model.to(device)
+        # Shared with all other users of the same model in this process
+        self.embedding_service = get_embedding_service(sentence_similarity_model, device=device or None)
+        self.sim_model = self.embedding_service.model
 
     @cached_property
     def prompt_db(self) -> List[Tuple[str, List[dict]]]:
@@ -112,7 +114,7 @@ class DynamicPromptBuilder:
                     flattened.append(r['query'])
                 else:
                     raise NotImplementedError(r)
-        return self.sim_model.encode(flattened, convert_to_tensor=True), idx_map
+        return self.embedding_service.encode(flattened), idx_map
 
     @cached_property
     def _prompt_embeddings_cache(self):
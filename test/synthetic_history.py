@@ -0,0 +1,102 @@
+import re
+import time
+import zlib
+from datetime import datetime, timedelta
+from random import Random
+from typing import List
+
+import torch
+
+from em.em_tree import HigherLevelSummary, GoalBasedSummary, EventBasedSummary, SceneGraphInstant, RawDataInstant, \
+    ObjectNode
+
+_OBJECT_CLASSES = ['cup', 'milk', 'plate', 'bowl', 'sponge', 'fridge', 'dishwasher', 'table', 'counter', 'apple',
+                   'knife', 'bread', 'mug', 'sink', 'spoon', 'chair', 'door', 'drawer', 'towel', 'bottle']
+_ACTIONS = ['Pickup', 'Place', 'Open', 'Close', 'Navigate', 'Say', 'HandOver', 'LoadDishwasher', 'LookAt']
+_SPEECH_WORDS = ['please', 'bring', 'me', 'the', 'can', 'you', 'where', 'is', 'my', 'put', 'away', 'thanks',
+                 'later', 'today', 'yesterday', 'kitchen', 'living', 'room', 'clean', 'hungry', 'coffee', 'tea',
+                 'breakfast', 'lunch', 'dinner', 'again', 'now', 'there', 'here', 'what', 'did', 'do'] + _OBJECT_CLASSES
+
+
+def make_synthetic_goals(n_goals: int, events_per_goal=2, scenes_per_event=3, start=datetime(2024, 6, 1, 8),
+                         seed=0, speech_fraction=0.0) -> List[GoalBasedSummary]:
+    """
+    Creates a list of L3 nodes with roughly the shape of the ArmarX/TEACh histories.
+    A speech_fraction of the scenes get a random utterance, which makes most of their strings unique.
+    """
+    rng = Random(seed)
+    ts = start
+    goals = []
+    for g in range(n_goals):
+        goal_name = f'{rng.choice(_ACTIONS)}({rng.choice(_OBJECT_CLASSES)})'
+        events = []
+        for e in range(events_per_goal):
+            action = f'{rng.choice(_ACTIONS)}({rng.choice(_OBJECT_CLASSES)})'
+            scenes = []
+            for s in range(scenes_per_event):
+                ts += timedelta(seconds=rng.randint(1, 30))
+                objects = [ObjectNode(c, f'{c}_0') for c in rng.sample(_OBJECT_CLASSES, 4)]
+                speech = None
+                if speech_fraction and rng.random() < speech_fraction:
+                    speech = ' '.join(rng.choices(_SPEECH_WORDS, k=rng.randint(3, 8)))
+                scenes.append(SceneGraphInstant(
+                    objects=objects,
+                    relations=[(0, 1, 'on'), (2, 3, 'in')],
+                    raw=RawDataInstant(ts, asr_recognition=speech, current_action=action,
+                                       current_action_state='Succeeded',
+                                       current_goal=goal_name, current_goal_state='Succeeded')
+                ))
+            events.append(EventBasedSummary(scenes))
+        goals.append(GoalBasedSummary(events, explicit_goal=goal_name))
+    return goals
+
+
+def make_synthetic_history(n_days: int, goals_per_day: int, seed=0, **kwargs) -> HigherLevelSummary:
+    days = []
+    for d in range(n_days):
+        goals = make_synthetic_goals(goals_per_day, start=datetime(2024, 6, 1, 8) + timedelta(days=d),
+                                     seed=seed * 1000 + d, **kwargs)
+        days.append(HigherLevelSummary(f'Day {d}: I did {goals_per_day} things.', goals))
+    return HigherLevelSummary('', days)
+
+
+class HashingEmbedding:
+    """
+    Deterministic stand-in for a SentenceTransformer: every text is mapped to a fixed random unit vector.
+    With bag_of_words, the vectors of the words of a text are summed instead, so texts sharing words are similar.
+    Optionally simulates the per-call latency of a real encoder forward pass.
+    """
+
+    def __init__(self, dim=384, encode_latency_s=0.0, bag_of_words=False):
+        super().__init__()
+        self.dim = dim
+        self.encode_latency_s = encode_latency_s
+        self.bag_of_words = bag_of_words
+        self.num_calls = 0
+
+    def _random_vector(self, text: str) -> torch.Tensor:
+        generator = torch.Generator().manual_seed(zlib.crc32(text.encode()))
+        return torch.randn(self.dim, generator=generator)
+
+    def _embed_one(self, text: str) -> torch.Tensor:
+        if self.bag_of_words:
+            words = re.findall(r'\w+', text.lower()) or [text]
+            return torch.nn.functional.normalize(sum(self._random_vector(w) for w in words), dim=0)
+        return torch.nn.functional.normalize(self._random_vector(text), dim=0)
+
+    # SentenceTransformer-like interface, e.g. for EmbeddingService
+    device = torch.device('cpu')
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts: List[str], convert_to_tensor=True) -> torch.Tensor:
+        return self(texts)
+
+    def __call__(self, texts: List[str]) -> torch.Tensor:
+        self.num_calls += 1
+        if self.encode_latency_s:
+            time.sleep(self.encode_latency_s)
+        if len(texts) == 0:
+            return torch.empty(0, self.dim)
+        return torch.stack([self._embed_one(t) for t in texts])
@@ -0,0 +1,89 @@
+import gc
+import pickle
+import weakref
+from datetime import datetime
+
+from em.em_tree import RawDataInstant, EventBasedSummary, HigherLevelSummary, SceneGraphInstant, get_children, \
+    interning, mutation_epoch, unpickle_history
+from test.synthetic_history import make_synthetic_goals, make_synthetic_history
+
+
+def test_construction_does_not_change_epoch():
+    epoch = mutation_epoch()
+    RawDataInstant(datetime(2024, 6, 1, 8))
+    EventBasedSummary([])
+    make_synthetic_history(2, 3)
+    assert mutation_epoch() == epoch
+
+
+def test_mutations_change_epoch():
+    raw = RawDataInstant(datetime(2024, 6, 1, 8))
+    epoch = mutation_epoch()
+    raw.asr_recognition = 'hello'
+    assert mutation_epoch() > epoch
+
+    event = EventBasedSummary([])
+    epoch = mutation_epoch()
+    event.audio_description = 'a door slams'
+    assert mutation_epoch() > epoch
+
+    epoch = mutation_epoch()
+    event.scenes.append(None)
+    assert mutation_epoch() > epoch
+
+
+def test_memoized_properties_follow_mutations():
+    goals = make_synthetic_goals(4)
+    tree = HigherLevelSummary('summary', goals[:2])
+    assert tree.range == (goals[0].range[0], goals[1].range[1])
+    tree.children.extend(goals[2:])
+    assert tree.range == (goals[0].range[0], goals[3].range[1])
+    tree.nl_summary = 'other'
+    assert tree.index_content[0] == 'other'
+
+
+def test_new_attribute_of_initialized_node_changes_epoch():
+    goal = make_synthetic_goals(1)[0]
+    epoch = mutation_epoch()
+    goal.nl_summary = 'overridden'
+    assert mutation_epoch() > epoch
+    assert goal.nl_summary == 'overridden'
+
+
+def _scenes(node):
+    if isinstance(node, SceneGraphInstant):
+        yield node
+    for c in get_children(node) or []:
+        yield from _scenes(c)
+
+
+def test_values_are_shared_within_one_load():
+    data = pickle.dumps(make_synthetic_history(2, 5))
+    scenes = list(_scenes(unpickle_history(data)))
+    relations = {id(s.relations) for s in scenes}
+    assert len(relations) == 1
+    other_scenes = list(_scenes(unpickle_history(data)))
+    # Another load has its own table
+    assert other_scenes[0].relations == scenes[0].relations
+    assert other_scenes[0].relations is not scenes[0].relations
+
+
+def test_intern_table_is_released_after_building():
+    with interning() as table:
+        history = make_synthetic_history(2, 5)
+    relations = weakref.ref(next(_scenes(history)).relations)
+    assert len(table.values) > 0
+    del history, table
+    gc.collect()
+    assert relations() is None
+
+
+def test_unpickled_lists_are_forgotten_after_load():
+    data = pickle.dumps(make_synthetic_history(2, 5))
+    with interning() as table:
+        history = pickle.loads(data)
+    assert len(table.unpickled_lists) == 0
+    relations = weakref.ref(next(_scenes(history)).relations)
+    del history, table
+    gc.collect()
+    assert relations() is None
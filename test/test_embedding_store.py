@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from llm_emv.embedding_store import MmapEmbeddingStore
+
+DIM = 8
+
+
+def _embeddings(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def test_reopened_store_returns_appended_embeddings(tmp_path):
+    store = MmapEmbeddingStore(tmp_path, DIM)
+    texts = [f'text {i}' for i in range(10)]
+    store.append(texts[:4], _embeddings(4))
+    store.append(texts[4:], _embeddings(6, seed=1))
+    reopened = MmapEmbeddingStore(tmp_path, DIM)
+    assert len(reopened) == 10
+    assert np.array_equal(reopened.get(texts), np.concatenate([_embeddings(4), _embeddings(6, seed=1)]))
+    assert reopened.lookup(['unknown']) == [None]
+    with pytest.raises(ValueError):
+        MmapEmbeddingStore(tmp_path, DIM + 1)
+
+
+def test_recovers_from_interrupted_append(tmp_path):
+    store = MmapEmbeddingStore(tmp_path, DIM)
+    store.append(['a', 'b'], _embeddings(2))
+    # Crash while appending 'c': its row is only partially written, and so is the index line of a later append
+    with store._data_file.open('ab') as f:
+        f.write(_embeddings(1, seed=2).tobytes()[:10])
+    with store._index_file.open('a') as f:
+        f.write('0123')
+
+    recovered = MmapEmbeddingStore(tmp_path, DIM)
+    assert len(recovered) == 2
+    assert np.array_equal(recovered.get(['a', 'b']), _embeddings(2))
+    recovered.append(['c'], _embeddings(1, seed=2))
+    reopened = MmapEmbeddingStore(tmp_path, DIM)
+    assert np.array_equal(reopened.get(['a', 'b', 'c']), np.concatenate([_embeddings(2), _embeddings(1, seed=2)]))
+
+
+def test_index_lines_without_row_are_ignored(tmp_path):
+    store = MmapEmbeddingStore(tmp_path, DIM)
+    store.append(['a', 'b'], _embeddings(2))
+    # The data file lost the last row, e.g. it was not synced before a power loss
+    with store._data_file.open('r+b') as f:
+        f.truncate(DIM * 4 + 3)
+    recovered = MmapEmbeddingStore(tmp_path, DIM)
+    assert 'a' in recovered and 'b' not in recovered
+
+
+def test_compaction(tmp_path):
+    store = MmapEmbeddingStore(tmp_path, DIM)
+    store.append(['a', 'b', 'c'], _embeddings(3))
+    store.append(['b'], _embeddings(1, seed=1))  # Supersedes the first row of 'b'
+    store.compact(keep_texts=['b', 'c'])
+    reopened = MmapEmbeddingStore(tmp_path, DIM)
+    assert 'a' not in reopened
+    assert np.array_equal(reopened.get(['b', 'c']), np.stack([_embeddings(1, seed=1)[0], _embeddings(3)[2]]))
+    assert sorted(f.name for f in tmp_path.iterdir()) == ['embeddings.1.f32', 'index.1.tsv', 'meta.json']
+
+
+def test_interrupted_compaction_keeps_old_generation(tmp_path):
+    store = MmapEmbeddingStore(tmp_path, DIM)
+    store.append(['a'], _embeddings(1))
+    # Files of a compaction that crashed before switching meta.json
+    (tmp_path / 'embeddings.1.f32').write_bytes(b'\0' * 7)
+    (tmp_path / 'index.1.tsv').write_text('partial')
+    reopened = MmapEmbeddingStore(tmp_path, DIM)
+    assert np.array_equal(reopened.get(['a']), _embeddings(1))
+    assert not (tmp_path / 'embeddings.1.f32').exists() and not (tmp_path / 'index.1.tsv').exists()
@@ -0,0 +1,75 @@
+import gc
+import logging
+import weakref
+
+from em.tree_layout import TreeLayout
+from llm_emv.embedding_warmup import EmbeddingWarmup
+from llm_emv.emv_api import EMVerbalizationAPI, _warmups
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import HashingEmbedding, make_synthetic_history
+
+
+def _warmup(history, encode_latency_s=0.0, **kwargs):
+    index = SearchEmbeddingIndex(TreeLayout(history), HashingEmbedding(encode_latency_s=encode_latency_s))
+    return EmbeddingWarmup(index, progress_fn=None, **kwargs)
+
+
+def test_embeds_all_strings():
+    warmup = _warmup(make_synthetic_history(2, 5, speech_fraction=0.5), batch_size=16).start()
+    assert warmup.wait(30)
+    done, total = warmup.progress
+    assert done == total == len(warmup._index.layout.strings)
+
+
+def test_progress_is_logged(caplog, capsys):
+    index = SearchEmbeddingIndex(TreeLayout(make_synthetic_history(1, 5)), HashingEmbedding())
+    with caplog.at_level(logging.INFO, logger='llm_emv.embedding_warmup'):
+        assert EmbeddingWarmup(index, batch_size=16).start().wait(30)
+    assert caplog.records[-1].getMessage().endswith(f'{len(index.layout.strings)}/{len(index.layout.strings)} strings')
+    assert capsys.readouterr().out == ''
+
+
+def test_prioritize_queues_subtree_once():
+    history = make_synthetic_history(2, 5, speech_fraction=0.5)
+    warmup = _warmup(history, batch_size=8)
+    warmup.prioritize(history)  # The root, queued level by level already
+    assert len(warmup._urgent) == 0
+    goal = history.children[1].children[2]
+    warmup.prioritize(goal)
+    warmup.prioritize(goal)
+    warmup.prioritize(history.children[1])
+    queued = [ids for ids in warmup._urgent]
+    assert sum(len(ids) for ids in queued) == len(set(warmup._index.layout.index_content_ids(
+        warmup._index.layout.number_of(history.children[1]))))
+    assert warmup._next_batch().tolist() == queued[0][:8].tolist()  # The latest expansion goes first
+
+
+def test_close_stops_thread():
+    warmup = _warmup(make_synthetic_history(3, 10, speech_fraction=0.5), encode_latency_s=0.05, batch_size=4).start()
+    warmup.close()
+    assert not warmup._thread.is_alive()
+    assert warmup.progress[0] < warmup.progress[1]
+
+
+def test_one_warmup_per_history():
+    history = make_synthetic_history(3, 10, speech_fraction=0.5)
+    apis = [EMVerbalizationAPI(None, None, history, search_embedding_fn=HashingEmbedding(encode_latency_s=0.05))
+            for _ in range(3)]
+    threads = [api._search_warmup._thread for api in apis]
+    assert [t.is_alive() for t in threads] == [False, False, True]
+    del apis
+    gc.collect()
+    assert not threads[-1].is_alive()
+
+
+def test_warmup_of_another_history_at_the_same_id_is_not_closed():
+    history, other = make_synthetic_history(3, 10, speech_fraction=0.5), make_synthetic_history(1, 2)
+    api = EMVerbalizationAPI(None, None, other, search_embedding_fn=HashingEmbedding(encode_latency_s=0.05))
+    # As if other had been collected and history allocated at its address
+    _warmups[id(history)] = (weakref.ref(other), _warmups.pop(id(other))[1])
+    new_api = EMVerbalizationAPI(None, None, history, search_embedding_fn=HashingEmbedding())
+    assert not api._search_warmup._cancelled.is_set()
+    assert _warmups[id(history)][1] is new_api._search_warmup
+    api.close()
+    new_api.close()
+
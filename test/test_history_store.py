@@ -0,0 +1,77 @@
+import pickle
+
+import numpy as np
+import torch
+
+from em.em_tree import get_children
+from em.history_store import HistoryStore, open_history, write_history_store, SUFFIX
+from em.node_registry import NodeRegistry
+from em.tree_layout import TreeLayout, layout_of
+from llm_emv.interactive_tree import ExpandableTreeNode
+from llm_emv.lexical_index import LexicalIndex
+from test.synthetic_history import make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _store(tmp_path, history):
+    path = tmp_path / ('history' + SUFFIX)
+    write_history_store(history, path)
+    return HistoryStore(path)
+
+
+def test_store_renders_like_eager_tree(tmp_path):
+    history = make_synthetic_history(3, 4, speech_fraction=0.3)
+    store = _store(tmp_path, history)
+    assert store.num_loaded == 1
+    trees = [ExpandableTreeNode(h, get_children, _no_similarity) for h in (history, store.root)]
+    for tree in trees:
+        tree._set_expanded(True, recursive=True)
+    assert repr(trees[0]) == repr(trees[1])
+
+
+def test_store_layout_matches_eager_layout(tmp_path):
+    history = make_synthetic_history(3, 4, speech_fraction=0.3)
+    store = _store(tmp_path, history)
+    eager = TreeLayout(history)
+    assert layout_of(store.root) is store.layout
+    for name in TreeLayout.ARRAYS:
+        assert np.array_equal(getattr(eager, name), getattr(store.layout, name)), name
+    assert list(store.layout.strings) == list(eager.strings)
+
+
+def test_registry_on_partially_loaded_store(tmp_path):
+    history = make_synthetic_history(3, 4)
+    store = _store(tmp_path, history)
+    registry = NodeRegistry(store.root, store.layout)
+    eager_registry = NodeRegistry(history)
+    path = (1, 2, 0, 1)
+    node = registry.node_at(path)
+    assert registry.path_of(node) == path
+    assert registry.id_of(node) == eager_registry.id_of(eager_registry.node_at(path))
+    parent = registry.parent(node)
+    assert registry.path_of(parent) == path[:-1]
+    assert registry.parent(store.root) is None
+
+
+def test_lexical_index_is_built_on_first_search(tmp_path):
+    store = _store(tmp_path, make_synthetic_history(2, 3))
+    lexical = LexicalIndex(store.layout)
+    assert lexical._vocabulary is None
+    scores, matched, num_tokens = lexical.string_scores('cup')
+    assert num_tokens == 1 and matched.any()
+
+
+def test_open_history_does_not_convert_pickles(tmp_path):
+    history = make_synthetic_history(2, 3)
+    pickle_path = tmp_path / 'history.pkl'
+    pickle_path.write_bytes(pickle.dumps(history))
+    loaded = open_history(pickle_path)
+    assert not pickle_path.with_suffix(SUFFIX).exists()
+    assert repr(loaded) == repr(history)
+
+    write_history_store(history, pickle_path.with_suffix(SUFFIX))
+    stored = open_history(pickle_path)
+    assert getattr(stored, '_store', None) is not None
@@ -0,0 +1,98 @@
+import timeit
+from datetime import timedelta
+from random import Random
+
+import pytest
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode, _Forwarded, create_expandable_tree_node_filter_fn
+from test.synthetic_history import make_synthetic_goals, make_synthetic_history
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _tree():
+    return ExpandableTreeNode(make_synthetic_history(2, 3), get_children, _no_similarity)
+
+
+def test_attributes_are_forwarded():
+    tree = _tree()
+    history = tree._wrapped
+    assert tree.nl_summary == history.nl_summary
+    assert tree.range == history.range
+    goal = tree.children[0].children[1]
+    assert goal.explicit_goal == goal._wrapped.explicit_goal
+    assert goal.latest_raw is goal._wrapped.latest_raw
+    assert goal.index_content == goal._wrapped.index_content
+    # Through the descriptor installed by the first access, for other instances too
+    assert isinstance(ExpandableTreeNode.__dict__['nl_summary'], _Forwarded)
+    assert tree.children[1].nl_summary == history.children[1].nl_summary
+
+
+def test_missing_attributes_are_not_installed():
+    tree = _tree()
+    with pytest.raises(AttributeError):
+        tree.nl_sumary
+    assert not hasattr(tree, 'no_such_attribute')
+    assert 'nl_sumary' not in ExpandableTreeNode.__dict__
+    assert 'no_such_attribute' not in ExpandableTreeNode.__dict__
+
+
+def test_forwarded_attributes_are_not_listed():
+    tree = _tree()
+    tree.nl_summary
+    assert 'nl_summary' not in dir(tree)
+    assert 'expand' in dir(tree)
+
+
+def test_attribute_access_does_not_scale_with_dir():
+    # Micro-benchmark: forwarding used to call dir(self) on every access, so the cost grew with the number of
+    # attributes of the node class. Compare against a subclass with a very long dir()
+    wide_node_type = type('WideTreeNode', (ExpandableTreeNode,), {f'extra_{i}': i for i in range(5000)})
+    history = make_synthetic_history(1, 3)
+    timings = []
+    for cls in (ExpandableTreeNode, wide_node_type):
+        node = cls(history, get_children, _no_similarity)
+        assert node.nl_summary == history.nl_summary
+        timings.append(min(timeit.repeat('node.nl_summary; node.range', globals=dict(node=node),
+                                         number=2000, repeat=5)))
+    # 宽松的界限, 以前的实现在这里慢四十倍左右
+    assert timings[1] < 5 * timings[0] + 1e-3
+
+
+def _time_queries(node, rng):
+    for _ in range(30):
+        t = rng.choice(node.children).range[rng.randrange(2)] + timedelta(seconds=rng.randint(-600, 600))
+        yield t.date(),
+        yield t.replace(second=0, microsecond=0),
+        yield t.replace(minute=0, second=0, microsecond=0),
+        yield t, t + timedelta(minutes=rng.randint(0, 120))
+        yield t.date(), t.date() + timedelta(days=rng.randint(0, 1))
+
+
+def _linear_matches(node, args):
+    filter_fn = create_expandable_tree_node_filter_fn(len(node.children), args)
+    return [i for i, c in enumerate(node.children) if filter_fn(c, i)]
+
+
+def test_interval_index_matches_linear_filter():
+    tree = ExpandableTreeNode(make_synthetic_history(3, 40), get_children, _no_similarity)
+    rng = Random(0)
+    for node in (tree, tree.children[1], tree.children[2].children[5]):
+        for args in _time_queries(node, rng):
+            node.collapse()
+            node.expand(*args)
+            assert node._expanded_indices() == _linear_matches(node, args), args
+
+    # The index is rebuilt after the history was extended, here by new events of the last goal
+    day = tree.children[-1]
+    day.expand(day.range[1].date())
+    goal = day._wrapped.children[-1]
+    goal.events.extend(make_synthetic_goals(1, start=goal.range[1] + timedelta(hours=2), seed=3)[0].events)
+    new_time = goal.events[-1].range[0]
+    day.collapse()
+    day.expand(new_time)
+    assert day._expanded_indices() == _linear_matches(day, (new_time,)) == [len(day.children) - 1]
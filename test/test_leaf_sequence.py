@@ -0,0 +1,83 @@
+import pickle
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode, LeafSequence, _time_range
+from test.synthetic_history import make_synthetic_history
+
+ARMARX_SUMMARY = Path(__file__).parents[1] / 'data' / 'armarx_lt_mem' / '2024-07-a7a-summary.pkl'
+
+
+def _histories():
+    yield make_synthetic_history(5, 20)
+    if ARMARX_SUMMARY.exists():
+        yield pickle.loads(ARMARX_SUMMARY.read_bytes())
+
+
+def _linear_leaves(node):
+    children = get_children(node) or []
+    if len(children) == 0:
+        return [node]
+    return [leaf for c in children for leaf in _linear_leaves(c)]
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+@pytest.mark.parametrize('history', list(_histories()))
+def test_leaf_sequence_matches_linear_leaves(history):
+    leaves = LeafSequence(history, get_children)
+    expected = _linear_leaves(history)
+    assert len(leaves) == len(expected)
+    assert all(a is b for a, b in zip(leaves, expected))
+    assert all(leaves[i] is expected[i] for i in range(0, len(expected), 37))
+    assert leaves[-1] is expected[-1]
+    assert all(a is b for a, b in zip(leaves[10:50], expected[10:50]))
+
+
+@pytest.mark.parametrize('history', list(_histories()))
+def test_index_range_matches_linear_filter(history):
+    leaves = LeafSequence(history, get_children)
+    times = [_time_range(leaf)[0] for leaf in leaves]
+    windows = [(times[100], times[200]), (times[0], times[0]), (times[-1], times[-1]),
+               (times[0] - timedelta(days=1), times[5]), (times[-5], times[-1] + timedelta(days=1)),
+               (times[0] - timedelta(days=2), times[0] - timedelta(days=1)), (times[len(times) // 2], times[-3])]
+    for start, end in windows:
+        expected = [i for i, t in enumerate(times) if start <= t <= end]
+        assert list(leaves.index_range(start, end)) == expected, (start, end)
+
+
+@pytest.mark.parametrize('history', list(_histories()))
+def test_all_leaves_date_filter(history):
+    tree = ExpandableTreeNode(history, get_children, _no_similarity)
+    all_leaves = tree.all_leaves
+    times = [_time_range(leaf)[0] for leaf in all_leaves.children]
+    day = times[len(times) // 2].date()
+    all_leaves.expand(day)
+    assert all_leaves._expanded_indices() == [i for i, t in enumerate(times) if t.date() == day]
+
+    all_leaves.collapse()
+    start, end = times[100], times[150]
+    all_leaves.expand(start, end)
+    assert all_leaves._expanded_indices() == [i for i, t in enumerate(times) if start <= t <= end]
+
+    all_leaves.collapse()
+    all_leaves.expand(datetime.combine(day, datetime.min.time()) - timedelta(days=400))
+    assert all_leaves._expanded_indices() == []
+
+
+@pytest.mark.parametrize('history', list(_histories()))
+def test_all_leaves_pages(history):
+    all_leaves = ExpandableTreeNode(history, get_children, _no_similarity).all_leaves
+    n = len(all_leaves.children)
+    all_leaves.expand()
+    assert len(all_leaves._expanded_indices()) == n
+    all_leaves.collapse().expand(page=1, page_size=50)
+    assert all_leaves._expanded_indices() == list(range(50, 100))
+    all_leaves.collapse().expand(-1)
+    assert all_leaves._expanded_indices() == [n - 1]
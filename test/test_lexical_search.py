@@ -0,0 +1,81 @@
+import pytest
+
+from em.tree_layout import TreeLayout
+from llm_emv.interactive_tree import search_similarity_to_filter_fn
+from llm_emv.lexical_index import LexicalIndex
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import HashingEmbedding, make_synthetic_history
+
+FILTER_KWARGS = dict(top_p=0.5, min_cos_sim=0.0, close_match_top_p=0.4, close_match_min_cos_sim=0.0)
+
+
+@pytest.fixture(scope='module')
+def setup():
+    history = make_synthetic_history(1, 40, speech_fraction=0.3)
+    layout = TreeLayout(history)
+    index = SearchEmbeddingIndex(layout, HashingEmbedding(bag_of_words=True))
+    lexical = LexicalIndex(layout)
+    items = history.children[0].children
+    return index, lexical, items
+
+
+def _hits(lexical, query, items, all_terms):
+    scores, all_terms_matched = lexical.search(query, items)
+    return set(((all_terms_matched if all_terms else scores > 0).nonzero().squeeze(1)).tolist())
+
+
+def test_close_match_without_all_terms_uses_embeddings(setup):
+    index, lexical, items = setup
+    embedding_only = search_similarity_to_filter_fn(index.similarities, **FILTER_KWARGS)
+    hybrid = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search, **FILTER_KWARGS)
+    query = 'picking up cups'  # "picking" is in no item
+    assert len(_hits(lexical, query, items, all_terms=True)) == 0
+    assert hybrid(query, items, close_match=True) == embedding_only(query, items, close_match=True)
+    assert len(hybrid(query, items, close_match=True)) > 0
+
+
+def test_close_match_ranks_hits_by_embedding(setup):
+    index, lexical, items = setup
+    embedding_only = search_similarity_to_filter_fn(index.similarities, **FILTER_KWARGS)
+    hybrid = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search, **FILTER_KWARGS)
+    hits = sorted(_hits(lexical, 'cup', items, all_terms=True))
+    assert len(hits) > 3
+    result = hybrid('cup', items, close_match=True)
+    # Like an embedding search over the hits only, so the close_match top-p caps the number of results
+    assert result == [hits[i] for i in embedding_only('cup', [items[h] for h in hits], close_match=True)]
+    assert len(result) < len(hits)
+
+
+def test_few_lexical_hits_do_not_prune(setup):
+    index, lexical, items = setup
+    embedding_only = search_similarity_to_filter_fn(index.similarities, **FILTER_KWARGS)
+    hybrid = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search, **FILTER_KWARGS)
+    for query in ('milk', 'bring me the cup', 'hand over the cup'):
+        assert hybrid(query, items) == embedding_only(query, items)
+
+
+def test_many_lexical_hits_prune(setup):
+    index, lexical, items = setup
+    hybrid = search_similarity_to_filter_fn(index.similarities, lexical_search_fn=lexical.search,
+                                            lexical_prune_min_hits=1, **FILTER_KWARGS)
+    hits = _hits(lexical, 'milk', items, all_terms=False)
+    assert 0 < len(hits) < len(items)
+    assert set(hybrid('milk', items)) <= hits
+
+
+def test_close_match_lexical_only_does_not_embed(setup):
+    index, lexical, items = setup
+    embedding_fn = HashingEmbedding(bag_of_words=True)
+    lexical_only = search_similarity_to_filter_fn(SearchEmbeddingIndex(index.layout, embedding_fn).similarities,
+                                                  lexical_search_fn=lexical.search, close_match_lexical_only=True,
+                                                  **FILTER_KWARGS)
+    for query in ('cup', 'milk'):
+        hits = _hits(lexical, query, items, all_terms=True)
+        result = lexical_only(query, items, close_match=True)
+        assert 0 < len(result) and set(result) <= hits
+        scores = lexical.search(query, items)[0][result].tolist()
+        assert scores == sorted(scores, reverse=True)
+    assert embedding_fn.num_calls == 0
+    # Without items containing all terms, the embedding model ranks all items as before
+    assert len(lexical_only('picking up cups', items, close_match=True)) > 0
+    assert embedding_fn.num_calls > 0
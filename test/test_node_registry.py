@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+import pytest
+
+from em.history_store import HistoryStore, write_history_store, SUFFIX
+from em.node_registry import NodeRegistry
+from em.time_shift import shift_time
+from test.synthetic_history import make_synthetic_goals, make_synthetic_history
+
+PATHS = [(), (1,), (1, 2), (1, 2, 0), (2, 3, 1, 0)]
+
+
+def test_ids_survive_redating():
+    history = make_synthetic_history(3, 4)
+    registry = NodeRegistry(history)
+    shifted_registry = NodeRegistry(shift_time(history, timedelta(days=30)))
+    for path in PATHS:
+        node_id = registry.id_of(registry.node_at(path))
+        assert shifted_registry.id_of(shifted_registry.node_at(path)) == node_id
+        assert shifted_registry.path_of(shifted_registry.node(node_id)) == path
+
+
+def test_ids_survive_extension_at_the_end():
+    history = make_synthetic_history(3, 4)
+    ids = [NodeRegistry(history).id_of(NodeRegistry(history).node_at(path)) for path in PATHS]
+    last_day = history.children[-1]
+    last_day.children.extend(make_synthetic_goals(2, start=last_day.range[1] + timedelta(minutes=1), seed=7))
+    registry = NodeRegistry(history)
+    for path, node_id in zip(PATHS, ids):
+        assert registry.node(node_id) is registry.node_at(path)
+
+
+def test_replaced_and_unknown_nodes():
+    history = make_synthetic_history(3, 4)
+    registry = NodeRegistry(history)
+    node_id = registry.id_of(registry.node_at((1, 2)))
+    history.children[1].children[2].explicit_goal = 'something else'
+    registry = NodeRegistry(history)
+    for unknown in (node_id, '1.99#00000000', '9#00000000', 'x#y'):
+        with pytest.raises(KeyError):
+            registry.node(unknown)
+
+
+def test_lookup_does_not_load_store(tmp_path):
+    history = make_synthetic_history(3, 4)
+    path = tmp_path / ('history' + SUFFIX)
+    write_history_store(history, path)
+    store = HistoryStore(path)
+    registry = NodeRegistry(store.root, store.layout)
+    node_id = NodeRegistry(history).id_of(NodeRegistry(history).node_at((2, 3)))
+    with pytest.raises(KeyError):
+        registry.node(node_id[:-1] + ('0' if node_id[-1] != '0' else '1'))
+    assert store.num_loaded == 1
+    assert registry.path_of(registry.node(node_id)) == (2, 3)
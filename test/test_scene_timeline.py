@@ -0,0 +1,40 @@
+import pickle
+from datetime import timedelta
+
+import torch
+
+from em.em_tree import SceneGraphInstant, get_children
+from em.scene_timeline import SceneTimeline
+from experiments.benchmarks.scene_timeline import _reference_keyframe_indices
+from llm_emv.interactive_tree import ExpandableTreeNode
+from test.synthetic_history import make_synthetic_history
+
+
+def _scenes(node):
+    if isinstance(node, SceneGraphInstant):
+        yield node
+    for c in get_children(node) or []:
+        yield from _scenes(c)
+
+
+def test_views_render_like_history():
+    history = make_synthetic_history(2, 3, speech_fraction=0.3)
+    columnar_history, timeline = SceneTimeline.from_history(history)
+    trees = [ExpandableTreeNode(h, get_children, lambda q, i: torch.zeros(len(i)))
+             for h in (history, columnar_history)]
+    for tree in trees:
+        tree._set_expanded(True, recursive=True)
+    assert repr(trees[0]) == repr(trees[1])
+    assert repr(pickle.loads(pickle.dumps(columnar_history))) == repr(columnar_history)
+
+
+def test_columns_match_node_queries():
+    history = make_synthetic_history(3, 5, speech_fraction=0.2)
+    scenes = list(_scenes(history))
+    _, timeline = SceneTimeline.from_history(history)
+    assert timeline.keyframe_indices().tolist() == _reference_keyframe_indices(scenes)
+    assert timeline.keyframe_indices(5, 40).tolist() == _reference_keyframe_indices(scenes[5:40])
+    start = scenes[len(scenes) // 3].raw.timestamp
+    end = start + timedelta(hours=2)
+    assert timeline.rows_between(start, end).tolist() == [i for i, s in enumerate(scenes)
+                                                          if start <= s.raw.timestamp <= end]
@@ -0,0 +1,50 @@
+import torch
+
+from em.em_tree import get_children
+from em.tree_layout import layout_of
+from llm_emv.search_index import SearchEmbeddingIndex
+from test.synthetic_history import HashingEmbedding, make_synthetic_goals, make_synthetic_history
+
+QUERIES = ['milk', 'when did you load the dishwasher?', 'Pickup(Mug)', 'Day 1']
+
+
+def _per_item_similarities(embedding_fn, query, items):
+    # The search before batching: one query encoding and one cosine similarity per item
+    result = []
+    for item in items:
+        texts = [s for s in item.index_content if s]
+        if not texts:
+            result.append(0.0)
+            continue
+        embeddings = torch.nn.functional.normalize(embedding_fn(texts), dim=-1)
+        query_embedding = torch.nn.functional.normalize(embedding_fn([query]), dim=-1)
+        result.append((embeddings @ query_embedding.T).max().item())
+    return torch.tensor(result)
+
+
+def _nodes(node):
+    yield node
+    for c in get_children(node) or []:
+        yield from _nodes(c)
+
+
+def test_batched_search_equals_per_item_search():
+    history = make_synthetic_history(2, 4, speech_fraction=0.3)
+    embedding_fn = HashingEmbedding(bag_of_words=True)
+    index = SearchEmbeddingIndex(layout_of(history), embedding_fn)
+    # Children of every level, plus a node that is not part of the indexed tree
+    items = list(_nodes(history)) + make_synthetic_goals(1, seed=5)
+    for query in QUERIES:
+        expected = _per_item_similarities(embedding_fn, query, items)
+        assert torch.allclose(index.similarities(query, items), expected, atol=1e-5)
+
+
+def test_query_is_embedded_once_per_search():
+    history = make_synthetic_history(2, 4)
+    embedding_fn = HashingEmbedding()
+    index = SearchEmbeddingIndex(layout_of(history), embedding_fn)
+    items = history.children[0].children
+    index.similarities(QUERIES[0], items)
+    num_calls = embedding_fn.num_calls
+    index.similarities(QUERIES[1], items)
+    assert embedding_fn.num_calls == num_calls + 1
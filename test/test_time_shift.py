@@ -0,0 +1,84 @@
+import copy
+from datetime import timedelta
+
+import PIL.Image
+
+from em.em_tree import RawDataInstant, TreeMutationWatcher, get_children, mutation_epoch
+from em.time_shift import shift_time
+from test.synthetic_history import make_synthetic_history
+
+OFFSET = timedelta(days=3, hours=2)
+
+
+def _history_with_image():
+    history = make_synthetic_history(2, 3, speech_fraction=0.3)
+    history.children[0].children[0].events[0].scenes[0].raw.image = PIL.Image.new('RGB', (4, 4))
+    return history
+
+
+def _redated_copy(history):
+    # What the view must look like: a deep copy with every timestamp moved
+    redated = copy.deepcopy(history)
+    stack, seen = [redated], set()
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, RawDataInstant):
+            node.timestamp += OFFSET
+        elif hasattr(node, 'raw'):
+            stack.append(node.raw)
+        else:
+            stack.extend(get_children(node))
+    return redated
+
+
+def test_view_renders_like_redated_copy():
+    history = _history_with_image()
+    view = shift_time(history, OFFSET)
+    expected = _redated_copy(history)
+    assert repr(view) == repr(expected)
+    assert view.range == expected.range
+    assert view.children[1].children[2].nl_summary == expected.children[1].children[2].nl_summary
+    assert '<PIL.Image.Image ...>' in repr(view.children[0].children[0].events[0].scenes[0].raw)
+
+
+def test_repr_does_not_change_epoch():
+    view = shift_time(_history_with_image(), OFFSET)
+    repr(view)
+    epoch = mutation_epoch()
+    repr(view)
+    assert mutation_epoch() == epoch
+
+
+def test_assignments_change_original():
+    history = make_synthetic_history(1, 2)
+    view = shift_time(history, OFFSET)
+    raw = view.children[0].children[0].events[0].scenes[0].raw
+    raw.timestamp += timedelta(seconds=1)
+    assert history.children[0].children[0].events[0].scenes[0].raw.timestamp + OFFSET == raw.timestamp
+
+
+def test_watcher_ignores_views_and_other_trees():
+    history = make_synthetic_history(2, 3)
+    view = shift_time(history, OFFSET)
+    watcher = TreeMutationWatcher(view)
+    try:
+        repr(view)
+        make_synthetic_history(1, 2).children[0].nl_summary = 'other tree'
+        assert not watcher.modified
+        view.children[1].children[0].events[0].scenes[0].raw.asr_recognition = 'hello'
+        assert watcher.modified
+    finally:
+        watcher.close()
+
+
+def test_watcher_sees_child_list_changes():
+    history = make_synthetic_history(2, 3)
+    watcher = TreeMutationWatcher(history)
+    try:
+        history.children[0].children.pop()
+        assert watcher.modified
+    finally:
+        watcher.close()
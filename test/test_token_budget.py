@@ -0,0 +1,85 @@
+import torch
+
+from em.em_tree import get_children
+from llm_emv.interactive_tree import ExpandableTreeNode, recursive_apply
+from llm_emv.token_budget import TokenBudgetRenderer, _has_elided_ancestor, estimate_tokens
+from test.synthetic_history import make_synthetic_history
+
+BUDGET = 6000
+
+
+def _no_similarity(query, items):
+    return torch.zeros(len(items))
+
+
+def _set_simplified_repr(node):
+    node._simplified_repr = True
+
+
+def _busy_tree():
+    tree = ExpandableTreeNode(make_synthetic_history(6, 30), get_children, _no_similarity)
+    recursive_apply(tree, _set_simplified_repr)
+    tree.expand()
+    for day in tree.children[:4]:
+        day.expand()
+        for goal in day.children[::3]:
+            goal.expand()
+    return tree
+
+
+def _fresh_render(tree):
+    # What a renderer without state from earlier calls renders
+    previous = [n for n in _all_nodes(tree) if n._elided]
+    for node in previous:
+        node._elided = False
+    return TokenBudgetRenderer(BUDGET)(tree)
+
+
+def _all_nodes(node):
+    yield node
+    if not callable(node._children):
+        for c in node.children:
+            if hasattr(c, '_elided'):
+                yield from _all_nodes(c)
+
+
+def test_fits_budget_and_matches_fresh_render():
+    tree = _busy_tree()
+    renderer = TokenBudgetRenderer(BUDGET)
+    steps = [lambda: None, lambda: tree.children[5].expand(), lambda: tree.children[1].collapse(0),
+             lambda: tree.children[0].children[4].expand(), lambda: tree.children[2].expand(1),
+             lambda: tree.collapse(3)]
+    for step in steps:
+        step()
+        rendered = renderer(tree)
+        assert estimate_tokens(rendered) <= BUDGET
+        elided = [n for n in _all_nodes(tree) if n._elided]
+        assert _fresh_render(tree) == rendered
+        renderer._last = None
+        for node in _all_nodes(tree):
+            node._elided = node in elided
+        assert renderer(tree) == rendered
+
+
+def test_unchanged_tree_keeps_render_cache():
+    tree = _busy_tree()
+    renderer = TokenBudgetRenderer(BUDGET)
+    rendered = renderer(tree)
+    assert any(n._elided for n in _all_nodes(tree))
+    cache = tree._render_cache
+    assert renderer(tree) == rendered
+    assert tree._render_cache is cache
+
+
+def test_only_changed_flags_reset_caches():
+    tree = _busy_tree()
+    renderer = TokenBudgetRenderer(BUDGET)
+    renderer(tree)
+    elided = [n for n in _all_nodes(tree) if n._elided and not _has_elided_ancestor(n)]
+    caches = {id(n): n._render_cache for n in elided}
+    assert len(elided) > 0 and all(c is not None for c in caches.values())
+    # The most recent expansion is the most relevant, so the same nodes stay elided
+    tree.children[3].children[0].collapse()
+    renderer(tree)
+    assert [n for n in _all_nodes(tree) if n._elided and not _has_elided_ancestor(n)] == elided
+    assert all(n._render_cache is caches[id(n)] for n in elided)